@@ -0,0 +1,221 @@
+import bisect
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Set, Tuple
+from cache_manager import atomic_write_text
+from background_writer import BackgroundWriter
+from chunked_load import iter_chunks, iter_json_object, read_text
+from config import ALERTS_FILE, MAX_ALERTS_PER_USER, STORE_LOAD_CHUNK_SIZE
+
+# Configurar logger para las alertas
+logger = logging.getLogger(__name__)
+
+# Direcciones de cruce de precio
+UP = 'arriba'
+DOWN = 'abajo'
+
+# (mercado, dirección, umbral)
+Alert = Tuple[str, str, float]
+
+class AlertIndex:
+    """Alertas de precio de un solo disparo, indexadas por mercado y dirección"""
+
+    def __init__(self, alerts_file: str = ALERTS_FILE, max_per_user: int = MAX_ALERTS_PER_USER,
+                 writer: Optional[BackgroundWriter] = None, lazy: bool = False):
+        """
+        Args:
+            alerts_file: Archivo JSON donde se guardan las alertas
+            max_per_user: Cantidad máxima de alertas activas por usuario
+            writer: Escritor en segundo plano (si es None, se guarda en el momento)
+            lazy: Si es True, las alertas se cargan recién con load() / load_async() o al primer uso
+        """
+        self.alerts_file = alerts_file
+        self.max_per_user = max_per_user
+        self.writer = writer
+        # {(mercado, dirección): [(umbral, user_id), ...] ordenada}
+        self._index: Dict[Tuple[str, str], List[Tuple[float, int]]] = {}
+        self._by_user: Dict[int, Set[Alert]] = {}
+        self._loaded = False
+        self._loading = False
+        if not lazy:
+            self.load()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    def load(self):
+        """Carga las alertas desde el archivo (una sola vez)"""
+        if self._loaded:
+            return
+        if self._loading:
+            raise RuntimeError("Alertas cargándose por tandas: esperar a que termine load_async()")
+        self._loaded = True
+        if not os.path.exists(self.alerts_file):
+            return
+        try:
+            with open(self.alerts_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"No se pudieron cargar las alertas: {e}")
+            return
+        for user_id_str, alerts in data.items():
+            for market, direction, threshold in alerts:
+                self._insert(int(user_id_str), market, direction, float(threshold))
+
+    async def load_async(self, chunk_size: int = STORE_LOAD_CHUNK_SIZE):
+        """
+        Igual que load(), pero por tandas en el event loop, cediéndolo entre una y otra
+
+        Las alertas se agregan sin ordenar y cada lista del índice se ordena una
+        sola vez al final (en lugar de un insort por alerta).
+
+        Args:
+            chunk_size: Usuarios por tanda
+        """
+        if self._loaded:
+            return
+        self._loading = True
+        try:
+            text = await read_text(self.alerts_file)
+            async for chunk in iter_chunks(iter_json_object(text) if text else (), chunk_size):
+                for user_id_str, alerts in chunk:
+                    user_id = int(user_id_str)
+                    for market, direction, threshold in alerts:
+                        threshold = float(threshold)
+                        self._index.setdefault((market, direction), []).append((threshold, user_id))
+                        self._by_user.setdefault(user_id, set()).add((market, direction, threshold))
+            for entries in self._index.values():
+                entries.sort()
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"No se pudieron cargar las alertas: {e}")
+            self._index.clear()
+            self._by_user.clear()
+        except BaseException:
+            self._index.clear()
+            self._by_user.clear()
+            raise
+        finally:
+            self._loading = False
+        self._loaded = True
+
+    def _save(self):
+        """Guarda las alertas en el archivo"""
+        if self.writer is None:
+            self._prepare_save()()
+        else:
+            self.writer.coalesce(self.alerts_file, self._prepare_save)
+
+    def _prepare_save(self):
+        """Serializa las alertas y devuelve la escritura del archivo"""
+        data = {
+            str(user_id): sorted([list(alert) for alert in alerts])
+            for user_id, alerts in self._by_user.items()
+        }
+        content = json.dumps(data, ensure_ascii=False)
+
+        def write():
+            try:
+                atomic_write_text(self.alerts_file, content)
+            except Exception as e:
+                logger.error(f"Error al guardar alertas: {e}")
+
+        return write
+
+    def _insert(self, user_id: int, market: str, direction: str, threshold: float):
+        """Agrega una alerta al índice (sin guardar)"""
+        bisect.insort(self._index.setdefault((market, direction), []), (threshold, user_id))
+        self._by_user.setdefault(user_id, set()).add((market, direction, threshold))
+
+    def add_alert(self, user_id: int, market: str, direction: str, threshold: float) -> bool:
+        """
+        Agrega una alerta de un solo disparo
+
+        Args:
+            user_id: ID del usuario
+            market: Mercado a vigilar
+            direction: UP (avisar al subir hasta el umbral) o DOWN (al bajar)
+            threshold: Precio de venta que dispara la alerta
+
+        Returns:
+            bool: False si el usuario ya tiene el máximo de alertas
+        """
+        self.load()
+        alerts = self._by_user.get(user_id, set())
+        if (market, direction, threshold) in alerts:
+            return True
+        if len(alerts) >= self.max_per_user:
+            return False
+        self._insert(user_id, market, direction, threshold)
+        self._save()
+        return True
+
+    def get_user_alerts(self, user_id: int) -> List[Alert]:
+        """Obtiene las alertas activas de un usuario"""
+        self.load()
+        return sorted(self._by_user.get(user_id, set()))
+
+    def remove_user_alerts(self, user_id: int) -> int:
+        """
+        Elimina todas las alertas de un usuario
+
+        Returns:
+            int: Cantidad de alertas eliminadas
+        """
+        self.load()
+        alerts = self._by_user.pop(user_id, set())
+        for market, direction, threshold in alerts:
+            entries = self._index.get((market, direction), [])
+            position = bisect.bisect_left(entries, (threshold, user_id))
+            if position < len(entries) and entries[position] == (threshold, user_id):
+                del entries[position]
+        if alerts:
+            self._save()
+        return len(alerts)
+
+    def pop_triggered(self, market: str, old_price: float, new_price: float) -> List[Tuple[int, str, float]]:
+        """
+        Extrae las alertas que cruzó el movimiento de precio, en O(log N + k)
+
+        Args:
+            market: Mercado que cambió
+            old_price: Precio de venta anterior
+            new_price: Precio de venta nuevo
+
+        Returns:
+            Lista de (user_id, dirección, umbral) disparadas (ya eliminadas)
+        """
+        self.load()
+        if old_price is None or new_price is None or old_price == new_price:
+            return []
+        if new_price > old_price:
+            direction = UP
+            entries = self._index.get((market, UP), [])
+            # Umbrales en (old_price, new_price]
+            first = bisect.bisect_right(entries, (old_price, float('inf')))
+            last = bisect.bisect_right(entries, (new_price, float('inf')))
+        else:
+            direction = DOWN
+            entries = self._index.get((market, DOWN), [])
+            # Umbrales en [new_price, old_price)
+            first = bisect.bisect_left(entries, (new_price, float('-inf')))
+            last = bisect.bisect_left(entries, (old_price, float('-inf')))
+        if first >= last:
+            return []
+
+        fired = entries[first:last]
+        del entries[first:last]
+        for threshold, user_id in fired:
+            alerts = self._by_user.get(user_id)
+            if alerts is not None:
+                alerts.discard((market, direction, threshold))
+                if not alerts:
+                    del self._by_user[user_id]
+        self._save()
+        return [(user_id, direction, threshold) for threshold, user_id in fired]
+
+    def count(self) -> int:
+        """Cantidad total de alertas activas"""
+        self.load()
+        return sum(len(alerts) for alerts in self._by_user.values())
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable
+
+# Configurar logger para el escritor en segundo plano
+logger = logging.getLogger(__name__)
+
+# Escritura lista para correr en el hilo (sin argumentos)
+Write = Callable[[], None]
+
+class BackgroundWriter:
+    """
+    Escrituras a disco en un hilo propio, en el mismo orden en que se pidieron
+
+    Los datos se copian en el event loop (foto consistente) y solo la escritura
+    y el fsync corren en el hilo, así un disco lento no demora a los handlers.
+    Sin event loop corriendo (scripts, benchmark) se escribe en el momento.
+    """
+
+    def __init__(self, name: str = 'store-writer'):
+        """
+        Args:
+            name: Nombre del hilo de escritura
+        """
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        # Escrituras agrupadas que todavía no se prepararon {clave: preparar}
+        self._coalesced: Dict[Hashable, Callable[[], Write]] = {}
+
+    @staticmethod
+    def _run(write: Write):
+        try:
+            write()
+        except Exception as e:
+            logger.error(f"Error en escritura en segundo plano: {e}")
+
+    def submit(self, write: Write):
+        """Encola una escritura (o la hace en el momento si no hay event loop)"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._run(write)
+            return
+        self._executor.submit(self._run, write)
+
+    async def drain(self):
+        """Espera (sin bloquear el loop) a que terminen las escrituras encoladas hasta ahora"""
+        await asyncio.wrap_future(self._executor.submit(lambda: None))
+
+    def coalesce(self, key: Hashable, prepare: Callable[[], Write]):
+        """
+        Agrupa los pedidos de una misma clave en una sola escritura por vuelta del loop
+
+        Args:
+            key: Identifica el destino (ej. la ruta del archivo)
+            prepare: Se llama en el event loop y devuelve la escritura a hacer en el hilo
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._run(prepare())
+            return
+        if key not in self._coalesced:
+            loop.call_soon(self._submit_coalesced, key)
+        self._coalesced[key] = prepare
+
+    def _submit_coalesced(self, key: Hashable):
+        prepare = self._coalesced.pop(key, None)
+        if prepare is not None:
+            self._executor.submit(self._run, prepare())
+
+    def flush(self):
+        """Hace las escrituras pendientes y espera a que terminen"""
+        for key in list(self._coalesced):
+            self._submit_coalesced(key)
+        self._executor.submit(lambda: None).result()
+
+    def close(self):
+        """Termina las escrituras pendientes y libera el hilo"""
+        self.flush()
+        self._executor.shutdown(wait=True)
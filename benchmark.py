@@ -0,0 +1,290 @@
+"""
+Benchmark offline del bot: sin token de Telegram ni acceso a internet
+
+Levanta un dolarapi falso (aiohttp local) y usa un Bot falso con latencia y
+respuestas 429 configurables. Cada escenario corre en un proceso aparte (para
+medir el pico de memoria) con sus propios archivos en un directorio temporal.
+
+Uso:
+    python benchmark.py                      # escenarios de 1k, 10k y 100k suscriptores
+    python benchmark.py --subscribers 5000   # un escenario a medida
+    python benchmark.py --output bench.json  # guardar el resultado en JSON
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+DEFAULT_SCENARIOS = [1000, 10000, 100000]
+MARKETS_PER_USER = ['oficial', 'blue', 'bolsa']
+
+class FakeDolarApi:
+    """dolarapi falso: sirve /v1/dolares con ETag y cuenta las consultas"""
+
+    def __init__(self):
+        self.requests = 0
+        self.price = 1000.0
+        self.version = 0
+        self._runner = None
+        self.port = None
+
+    def bump(self, delta: float = 5.0):
+        """Cambia el precio de todos los mercados"""
+        self.price += delta
+        self.version += 1
+
+    def _payload(self) -> List[Dict]:
+        return [
+            {'casa': market, 'nombre': market.title(), 'compra': self.price - 20 + i, 'venta': self.price + i,
+             'fechaActualizacion': '2024-01-01T00:00:00.000Z'}
+            for i, market in enumerate(['oficial', 'blue', 'bolsa', 'contadoconliqui', 'tarjeta', 'mayorista', 'cripto'])
+        ]
+
+    async def handle(self, request):
+        from aiohttp import web
+        self.requests += 1
+        etag = f'"{self.version}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.json_response(self._payload(), headers={'ETag': etag})
+
+    async def start(self) -> str:
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get('/v1/dolares', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{self.port}'
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+class FakeBot:
+    """Bot falso: simula la latencia de Telegram e inyecta RetryAfter (429)"""
+
+    def __init__(self, latency: float, rate_limit_prob: float, retry_after: int, seed: int = 42):
+        self.latency = latency
+        self.rate_limit_prob = rate_limit_prob
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.rate_limited = 0
+
+    async def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        from telegram.error import RetryAfter
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rate_limit_prob and self.random.random() < self.rate_limit_prob:
+            self.rate_limited += 1
+            raise RetryAfter(self.retry_after)
+
+class FakeContext:
+    def __init__(self, bot):
+        self.bot = bot
+
+def read_io_counters() -> Dict[str, Optional[int]]:
+    """Bytes escritos por el proceso según /proc/self/io (solo Linux)"""
+    counters = {'wchar': None, 'write_bytes': None}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                if key in counters:
+                    counters[key] = int(value)
+    except OSError:
+        pass
+    return counters
+
+def peak_rss_bytes() -> int:
+    """Pico de memoria residente del proceso"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def write_fixtures(subscribers: int):
+    """Genera user_configs.json y bot_cache.json con los suscriptores del escenario"""
+    configs = {
+        str(100000000 + i): {
+            'interval_seconds': 5 + i % 56,
+            'enabled': True,
+            'markets': MARKETS_PER_USER[:1 + i % len(MARKETS_PER_USER)]
+        }
+        for i in range(subscribers)
+    }
+    with open('user_configs.json', 'w', encoding='utf-8') as f:
+        json.dump(configs, f)
+    with open('bot_cache.json', 'w', encoding='utf-8') as f:
+        json.dump({'last_quotations': {}, 'market_change_times': {}, 'user_last_sent': {}, 'last_updated': None}, f)
+
+async def run_scenario(args) -> Dict:
+    """Corre un escenario dentro del proceso actual (ya ubicado en su directorio temporal)"""
+    api = FakeDolarApi()
+    base_url = await api.start()
+    os.environ.update({
+        'DOLARAPI_URL': base_url,
+        'DOLARAPI_URLS': base_url,
+        'STORAGE_BACKEND': args.storage,
+        'SQLITE_PATH': 'bench.sqlite3',
+        'RUN_MODE': 'single',
+        'HISTORY_DIR': 'history',
+        'ALERTS_FILE': 'alerts.json',
+        'BROADCAST_GLOBAL_RATE': str(args.global_rate),
+        'BROADCAST_CONCURRENCY': str(args.concurrency),
+    })
+    write_fixtures(args.subscribers)
+
+    result = {'subscribers': args.subscribers, 'storage': args.storage}
+    start = time.perf_counter()
+    import logging
+    import main as bot
+    logging.getLogger().setLevel(logging.WARNING)
+    result['import_seconds'] = time.perf_counter() - start
+    # Los stores se cargan por tandas como en warm_up(): medir hasta que terminan
+    if bot.storage is not None:
+        await asyncio.to_thread(bot.migrate_json_to_sqlite, bot.storage)
+    for store in (bot.cache_manager, bot.alert_index, bot.user_config):
+        await store.load_async()
+    result['load_seconds'] = time.perf_counter() - start
+
+    fake_bot = FakeBot(args.latency, args.rate_limit_prob, args.retry_after)
+    context = FakeContext(fake_bot)
+    user_ids = list(bot.user_config.iter_active_ids())
+
+    # Primera consulta: se guarda la foto inicial sin enviar
+    await bot.check_quotation_change(context)
+    # Consultas sin cambios (304 del servidor)
+    start = time.perf_counter()
+    for _ in range(args.idle_polls):
+        await bot.check_quotation_change(context)
+    result['idle_poll_seconds'] = (time.perf_counter() - start) / max(1, args.idle_polls)
+
+    # Lecturas concurrentes (/cotizacion): deberían compartir una sola consulta
+    upstream_before = api.requests
+    start = time.perf_counter()
+    await asyncio.gather(*[bot.dolar_service.get_quotation('blue') for _ in range(args.concurrent_reads)])
+    result['concurrent_reads'] = args.concurrent_reads
+    result['concurrent_reads_seconds'] = time.perf_counter() - start
+    result['concurrent_reads_upstream_calls'] = api.requests - upstream_before
+
+    # Cambio de precio y difusión a todos los suscriptores
+    api.bump()
+    io_before = read_io_counters()
+    start = time.perf_counter()
+    changed = await bot.check_quotation_change(context)
+    result['change_detect_seconds'] = time.perf_counter() - start
+    result['changed_markets'] = len(changed)
+
+    start = time.perf_counter()
+    await bot.send_auto_quotations_to_users(context, user_ids)
+    result['broadcast_seconds'] = time.perf_counter() - start
+    await bot.cache_manager.flush_async()
+    bot.quotation_history.flush()
+    io_after = read_io_counters()
+
+    result['send_calls'] = fake_bot.calls
+    result['rate_limited'] = fake_bot.rate_limited
+    result['messages_per_second'] = fake_bot.calls / result['broadcast_seconds'] if result['broadcast_seconds'] else None
+    result['upstream_calls'] = api.requests
+    for key in ('wchar', 'write_bytes'):
+        if io_before[key] is not None and io_after[key] is not None:
+            result[f'disk_{key}'] = io_after[key] - io_before[key]
+    result['peak_rss_bytes'] = peak_rss_bytes()
+
+    await bot.dolar_service.close_session()
+    if bot.storage is not None:
+        bot.storage.close()
+    await api.stop()
+    return result
+
+def git_revision() -> Optional[str]:
+    """Commit actual del repositorio (para comparar resultados entre versiones)"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_in_subprocess(args, subscribers: int) -> Dict:
+    """Corre un escenario en un proceso nuevo dentro de un directorio temporal"""
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    command = [
+        sys.executable, os.path.join(repo_dir, 'benchmark.py'), '--child',
+        '--subscribers', str(subscribers),
+        '--storage', args.storage,
+        '--latency', str(args.latency),
+        '--rate-limit-prob', str(args.rate_limit_prob),
+        '--retry-after', str(args.retry_after),
+        '--global-rate', str(args.global_rate),
+        '--concurrency', str(args.concurrency),
+        '--concurrent-reads', str(args.concurrent_reads),
+        '--idle-polls', str(args.idle_polls),
+    ]
+    env = dict(os.environ, PYTHONPATH=repo_dir + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    with tempfile.TemporaryDirectory(prefix='dolarbot-bench-') as workdir:
+        output = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+    if output.returncode != 0:
+        return {'subscribers': subscribers, 'error': output.stderr.strip().splitlines()[-1:] or ['?']}
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark offline del bot de cotizaciones')
+    parser.add_argument('--subscribers', type=int, action='append',
+                        help='Suscriptores del escenario (se puede repetir; por defecto 1k, 10k y 100k)')
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--latency', type=float, default=0.005, help='Latencia simulada de cada envío (s)')
+    parser.add_argument('--rate-limit-prob', type=float, default=0.001, help='Probabilidad de responder 429')
+    parser.add_argument('--retry-after', type=int, default=0, help='Segundos de RetryAfter en cada 429')
+    parser.add_argument('--global-rate', type=float, default=1e9,
+                        help='Límite global de mensajes/s (alto por defecto para medir el costo propio)')
+    parser.add_argument('--concurrency', type=int, default=100, help='Envíos simultáneos')
+    parser.add_argument('--concurrent-reads', type=int, default=1000, help='Consultas /cotizacion simultáneas')
+    parser.add_argument('--idle-polls', type=int, default=20, help='Consultas sin cambios a medir')
+    parser.add_argument('--output', help='Archivo donde guardar el resultado en JSON')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.child:
+        args.subscribers = args.subscribers[0]
+        print(json.dumps(asyncio.run(run_scenario(args))))
+        return
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'parameters': {
+            key: getattr(args, key) for key in
+            ('storage', 'latency', 'rate_limit_prob', 'retry_after', 'global_rate', 'concurrency',
+             'concurrent_reads', 'idle_polls')
+        },
+        'scenarios': []
+    }
+    for subscribers in args.subscribers or DEFAULT_SCENARIOS:
+        print(f"▶ {subscribers} suscriptores...", file=sys.stderr)
+        report['scenarios'].append(run_in_subprocess(args, subscribers))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+
+if __name__ == '__main__':
+    main()
@@ -1,86 +1,444 @@
+import asyncio
+import copy
 import json
 import os
+import tempfile
+import threading
 import time
-from typing import Dict, Optional, Any
+from array import array
+from typing import Callable, Dict, Iterable, Optional, Any
+from storage import StorageBackend
+from subscribers import IdTable
+from metrics import CACHE_FLUSH_SECONDS
+from chunked_load import iter_chunks, iter_json_object, read_text
+from config import DEFAULT_MARKET, STORE_LOAD_CHUNK_SIZE
+
+# Usuarios de user_last_sent por llamada a json.dumps al escribir el cache en JSON
+SERIALIZE_CHUNK_SIZE = 10000
+
+def atomic_write_text(path: str, content: str):
+    """
+    Escribe un archivo de texto de forma atómica (archivo temporal + rename)
+    
+    Args:
+        path: Ruta del archivo destino
+        content: Contenido a escribir
+    """
+    atomic_write_bytes(path, content.encode('utf-8'))
+
+def atomic_write_bytes(path: str, content: bytes):
+    """
+    Escribe un archivo binario de forma atómica (archivo temporal + rename)
+    
+    Args:
+        path: Ruta del archivo destino
+        content: Contenido a escribir
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 class CacheManager:
     """Maneja el cache de cotizaciones y tiempos de envío"""
     
-    def __init__(self, cache_file: str = "bot_cache.json"):
+    def __init__(self, cache_file: Optional[str] = "bot_cache.json", write_behind: bool = False,
+                 flush_interval: float = 30, storage: Optional[StorageBackend] = None,
+                 lazy: bool = False):
+        """
+        Args:
+            cache_file: Ruta del archivo de cache (None y sin storage: solo en memoria)
+            write_behind: Si es True, los cambios se acumulan en memoria y se
+                escriben en disco con flush() o con el loop de flush periódico
+            flush_interval: Segundos entre flushes automáticos en modo write-behind
+            storage: Almacenamiento alternativo (ej. SQLite); solo se escriben
+                las filas que cambiaron
+            lazy: Si es True, el cache se carga recién con load() o al primer uso
+        """
         self.cache_file = cache_file
-        self.cache = self._load_cache()
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.storage = storage
+        self.dirty = False
+        self.dirty_since: Optional[float] = None
+        # Cada cambio incrementa la generación; flushed_generation es la última ya escrita
+        self.generation = 0
+        self.flushed_generation = 0
+        # Se llama con la generación guardada después de cada escritura exitosa
+        self.on_flushed: Optional[Callable[[int], None]] = None
+        # Cambios pendientes de escribir en storage
+        self._pending_keys = set()
+        self._pending_last_sent: Dict[str, float] = {}
+        self._cache: Optional[Dict] = None
+        # Último envío de cada usuario (ids int64 + float64), fuera del dict del cache
+        self._last_sent = IdTable({'last_sent': 'd'})
+        self._loading = False
+        self._load_lock = threading.Lock()
+        # Una escritura asíncrona a la vez, así una foto vieja no pisa a una nueva
+        self._flush_lock = asyncio.Lock()
+        if not lazy:
+            self.load()
+    
+    @property
+    def cache(self) -> Dict:
+        """Contenido del cache (se carga al primer uso)"""
+        if self._cache is None:
+            self.load()
+        return self._cache
+    
+    @cache.setter
+    def cache(self, value: Dict):
+        self._cache = value
+    
+    @property
+    def is_loaded(self) -> bool:
+        return self._cache is not None
+    
+    def load(self):
+        """
+        Carga el cache desde el archivo o el storage (una sola vez)
+        
+        Puede llamarse desde otro hilo para cargar en segundo plano; los
+        accesos concurrentes esperan a que termine la carga. Desde el event
+        loop no debe usarse mientras carga otro hilo (bloquearía al bot):
+        los handlers esperan a main.stores_ready.
+        """
+        if self._cache is not None:
+            return
+        if self._loading:
+            raise RuntimeError("Cache cargándose por tandas: esperar a que termine load_async()")
+        with self._load_lock:
+            if self._cache is None:
+                cache = self._load_cache()
+                self._last_sent.load(
+                    (int(user_id_str), timestamp) for user_id_str, timestamp in (cache.pop('user_last_sent', None) or {}).items()
+                )
+                self._cache = cache
+    
+    async def load_async(self, chunk_size: int = STORE_LOAD_CHUNK_SIZE):
+        """
+        Igual que load(), pero por tandas en el event loop, cediéndolo entre una y otra
+        
+        user_last_sent (la parte grande del cache) se decodifica de a
+        chunk_size usuarios; en un hilo, json.load() frenaba igual al loop por
+        el GIL. Mientras carga, load() (y todo lo que lo usa) falla.
+        
+        Args:
+            chunk_size: Usuarios por tanda
+        """
+        if self._cache is not None:
+            return
+        self._loading = True
+        try:
+            cache = {}
+            members = iter(())
+            user_last_sent = ()
+            if self.storage is not None:
+                for key in ('last_quotation', 'last_quotations', 'market_change_times', 'last_updated'):
+                    cache[key] = self.storage.get_value(key)
+                user_last_sent = self.storage.iter_user_last_sent(chunk_size)
+            else:
+                text = await read_text(self.cache_file) if self.cache_file else None
+                members = iter_json_object(text or '{}', nested=('user_last_sent',))
+                for key, value in members:
+                    if key == 'user_last_sent':
+                        # Iterador sobre el mismo texto: se recorre por tandas antes de seguir
+                        user_last_sent = value
+                        break
+                    cache[key] = value
+            ordered = True
+            async for chunk in iter_chunks(user_last_sent, chunk_size):
+                for user_id, timestamp in chunk:
+                    ordered = self._last_sent.append(int(user_id), timestamp) and ordered
+            if not ordered:
+                # Archivo de una versión anterior: se ordena una sola vez
+                await self._last_sent.sort_async(chunk_size)
+            # Claves que estaban después de user_last_sent (caches de versiones anteriores)
+            cache.update(members)
+            cache = self._upgrade_cache(cache)
+        except json.JSONDecodeError:
+            # Igual que load(): un archivo inválido se reemplaza por el cache por defecto
+            self._last_sent.clear()
+            cache = self._get_default_cache()
+        except BaseException:
+            self._last_sent.clear()
+            raise
+        finally:
+            self._loading = False
+        cache.pop('user_last_sent', None)
+        self._cache = cache
     
     def _load_cache(self) -> Dict:
         """Carga el cache desde el archivo"""
-        if os.path.exists(self.cache_file):
+        if self.storage is not None:
+            return self._upgrade_cache({
+                'last_quotation': self.storage.get_value('last_quotation'),
+                'last_quotations': self.storage.get_value('last_quotations'),
+                'market_change_times': self.storage.get_value('market_change_times'),
+                'user_last_sent': self.storage.load_user_last_sent(),
+                'last_updated': self.storage.get_value('last_updated')
+            })
+        if self.cache_file and os.path.exists(self.cache_file):
             try:
                 with open(self.cache_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    return self._upgrade_cache(json.load(f))
             except (json.JSONDecodeError, FileNotFoundError):
                 return self._get_default_cache()
         return self._get_default_cache()
     
+    @staticmethod
+    def _upgrade_cache(cache: Dict) -> Dict:
+        """Adapta un cache de versiones anteriores (solo dólar oficial) al formato por mercado"""
+        if not cache.get('last_quotations'):
+            legacy = cache.pop('last_quotation', None)
+            cache['last_quotations'] = {DEFAULT_MARKET: legacy} if legacy else {}
+        if not cache.get('market_change_times'):
+            legacy = cache.pop('last_change_time', None)
+            cache['market_change_times'] = {DEFAULT_MARKET: legacy} if legacy else {}
+        cache.pop('last_quotation', None)
+        cache.pop('last_change_time', None)
+        cache.setdefault('user_last_sent', {})
+        return cache
+    
     def _get_default_cache(self) -> Dict:
         """Retorna la estructura por defecto del cache"""
         return {
-            'last_quotation': None,
+            'last_quotations': {},
+            'market_change_times': {},
             'user_last_sent': {},
             'last_updated': None
         }
     
     def _save_cache(self):
-        """Guarda el cache en el archivo"""
+        """Guarda el cache en el archivo (o lo marca como sucio en modo write-behind)"""
+        self.cache['last_updated'] = time.time()
+        self.generation += 1
+        if self.storage is None and self.cache_file is None:
+            # Cache solo en memoria: no hay nada que escribir
+            self.flushed_generation = self.generation
+            return
+        self._pending_keys.add('last_updated')
+        if not self.dirty:
+            self.dirty = True
+            self.dirty_since = time.time()
+        if not self.write_behind:
+            self.flush()
+    
+    @staticmethod
+    def _serialize(cache: Dict, user_ids: array, timestamps: array) -> str:
+        """
+        Serializa una foto del cache a JSON (corre en el hilo de escritura)
+        
+        user_last_sent se codifica por tandas: json.dumps no suelta el GIL
+        mientras codifica, así que una sola llamada con todos los usuarios
+        frenaría el event loop hasta terminar. Sin indentación, que con muchos
+        usuarios solo agranda el archivo.
+        """
+        parts = []
+        for start in range(0, len(user_ids), SERIALIZE_CHUNK_SIZE):
+            end = start + SERIALIZE_CHUNK_SIZE
+            chunk = {str(user_id): timestamp for user_id, timestamp in zip(user_ids[start:end], timestamps[start:end])}
+            parts.append(json.dumps(chunk)[1:-1])
+        head = json.dumps(cache, ensure_ascii=False)[:-1]
+        return head + (', ' if cache else '') + '"user_last_sent": {' + ', '.join(parts) + '}}'
+    
+    def _take_snapshot(self):
+        """Toma una foto de los cambios pendientes y marca el cache como limpio"""
+        if self.storage is None:
+            # En el loop solo se copian los arrays (memcpy) y los dicts chicos;
+            # armar el dict de usuarios y el JSON queda para el hilo de escritura
+            cache = {key: copy.deepcopy(value) for key, value in self.cache.items() if key != 'user_last_sent'}
+            snapshot = (cache, array('q', self._last_sent.ids), array('d', self._last_sent.columns['last_sent']))
+        else:
+            # Copia profunda: el hilo de escritura no debe ver los dicts que el loop sigue modificando
+            values = {key: copy.deepcopy(self.cache.get(key)) for key in self._pending_keys}
+            snapshot = (values, self._pending_last_sent)
+            self._pending_keys = set()
+            self._pending_last_sent = {}
+        self.dirty = False
+        self.dirty_since = None
+        return snapshot
+    
+    def _write_snapshot(self, snapshot):
+        """Escribe una foto tomada con _take_snapshot()"""
+        if self.storage is None:
+            atomic_write_text(self.cache_file, self._serialize(*snapshot))
+            return
+        values, last_sent = snapshot
+        for key, value in values.items():
+            self.storage.set_value(key, value)
+        if last_sent:
+            self.storage.set_users_last_sent(last_sent.items())
+    
+    def _restore_snapshot(self, snapshot):
+        """Vuelve a marcar como pendientes los cambios de una escritura fallida"""
+        if self.storage is not None:
+            values, last_sent = snapshot
+            self._pending_keys.update(values)
+            for user_id_str, timestamp in last_sent.items():
+                self._pending_last_sent.setdefault(user_id_str, timestamp)
+        self.dirty = True
+        self.dirty_since = self.dirty_since or time.time()
+    
+    def _mark_flushed(self, generation: int):
+        """Registra que los cambios hasta una generación ya están en disco"""
+        self.flushed_generation = max(self.flushed_generation, generation)
+        if self.on_flushed is not None:
+            self.on_flushed(self.flushed_generation)
+    
+    def flush(self) -> bool:
+        """
+        Escribe el cache en disco si tiene cambios pendientes
+        
+        Returns:
+            bool: True si se escribió el archivo
+        """
+        if not self.dirty:
+            return False
+        generation = self.generation
+        snapshot = self._take_snapshot()
         try:
-            self.cache['last_updated'] = time.time()
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(self.cache, f, indent=2, ensure_ascii=False)
+            start = time.perf_counter()
+            self._write_snapshot(snapshot)
+            CACHE_FLUSH_SECONDS.set(time.perf_counter() - start)
+            self._mark_flushed(generation)
+            return True
         except Exception as e:
             print(f"Error al guardar cache: {e}")
+            self._restore_snapshot(snapshot)
+            return False
+    
+    async def flush_async(self) -> int:
+        """
+        Igual que flush() pero escribe el archivo fuera del event loop
+        
+        Las llamadas concurrentes (loop de flush, fin de una difusión, outbox)
+        se serializan para que las fotos se escriban en el orden en que se tomaron.
+        
+        Returns:
+            int: Generación que ya está en disco; los cambios hechos hasta esa
+                generación (ver self.generation) quedaron guardados
+        """
+        async with self._flush_lock:
+            if not self.dirty:
+                return self.flushed_generation
+            # Tomar la foto en el loop para que sea consistente
+            generation = self.generation
+            snapshot = self._take_snapshot()
+            try:
+                start = time.perf_counter()
+                await asyncio.to_thread(self._write_snapshot, snapshot)
+                CACHE_FLUSH_SECONDS.set(time.perf_counter() - start)
+                self._mark_flushed(generation)
+            except Exception as e:
+                print(f"Error al guardar cache: {e}")
+                self._restore_snapshot(snapshot)
+            return self.flushed_generation
+    
+    async def run_flush_loop(self):
+        """Loop que escribe el cache periódicamente en modo write-behind"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_async()
     
-    def get_last_quotation(self) -> Optional[Dict]:
-        """Obtiene la última cotización guardada"""
-        return self.cache.get('last_quotation')
+    def get_last_quotation(self, market: str = DEFAULT_MARKET) -> Optional[Dict]:
+        """Obtiene la última cotización guardada de un mercado"""
+        return self.cache['last_quotations'].get(market)
     
-    def set_last_quotation(self, quotation: Dict):
-        """Guarda la última cotización"""
-        self.cache['last_quotation'] = quotation
+    def set_last_quotation(self, quotation: Dict, market: str = DEFAULT_MARKET):
+        """Guarda la última cotización de un mercado"""
+        self.set_last_quotations({market: quotation})
+    
+    def get_last_quotations(self) -> Dict[str, Dict]:
+        """Obtiene la última foto guardada de todos los mercados"""
+        return self.cache['last_quotations']
+    
+    def set_last_quotations(self, quotations: Dict[str, Dict]):
+        """Guarda las cotizaciones de varios mercados con una sola escritura"""
+        self.cache['last_quotations'].update(quotations)
+        self._pending_keys.add('last_quotations')
+        self._save_cache()
+    
+    def get_last_change_time(self, market: str = DEFAULT_MARKET) -> float:
+        """Obtiene el momento en que se detectó el último cambio de un mercado"""
+        return self.cache['market_change_times'].get(market) or 0
+    
+    def set_last_change_time(self, timestamp: float, market: str = DEFAULT_MARKET):
+        """Guarda el momento en que se detectó un cambio en un mercado"""
+        self.set_markets_change_time([market], timestamp)
+    
+    def set_markets_change_time(self, markets: Iterable[str], timestamp: float):
+        """Guarda el momento del cambio para varios mercados con una sola escritura"""
+        for market in markets:
+            self.cache['market_change_times'][market] = timestamp
+        self._pending_keys.add('market_change_times')
         self._save_cache()
     
     def get_user_last_sent(self, user_id: int) -> float:
         """Obtiene el último tiempo de envío para un usuario"""
-        user_last_sent = self.cache.get('user_last_sent', {})
-        return user_last_sent.get(str(user_id), 0)
+        self.load()
+        return self._last_sent.get('last_sent', int(user_id), 0)
     
     def set_user_last_sent(self, user_id: int, timestamp: float):
         """Actualiza el último tiempo de envío para un usuario"""
-        if 'user_last_sent' not in self.cache:
-            self.cache['user_last_sent'] = {}
-        
-        self.cache['user_last_sent'][str(user_id)] = timestamp
+        self.load()
+        self._last_sent.upsert(int(user_id), last_sent=timestamp)
+        if self.storage is not None:
+            self._pending_last_sent[str(user_id)] = timestamp
+        self._save_cache()
+    
+    def set_users_last_sent(self, user_ids: Iterable[int], timestamp: float):
+        """Actualiza el último tiempo de envío para varios usuarios con una sola escritura"""
+        self.load()
+        user_ids = [int(user_id) for user_id in user_ids]
+        self._last_sent.upsert_many(user_ids, last_sent=timestamp)
+        if self.storage is not None:
+            # Solo storage escribe por filas; el JSON se arma completo desde la tabla
+            for user_id in user_ids:
+                self._pending_last_sent[str(user_id)] = timestamp
         self._save_cache()
     
     def get_all_user_times(self) -> Dict[str, float]:
-        """Obtiene todos los tiempos de último envío"""
-        return self.cache.get('user_last_sent', {})
+        """Obtiene todos los tiempos de último envío (copia armada al momento)"""
+        self.load()
+        return {str(user_id): timestamp for user_id, timestamp in self._last_sent.items('last_sent')}
     
     def clear_user_data(self, user_id: int):
         """Elimina los datos de un usuario del cache"""
-        if 'user_last_sent' in self.cache:
-            user_id_str = str(user_id)
-            if user_id_str in self.cache['user_last_sent']:
-                del self.cache['user_last_sent'][user_id_str]
-                self._save_cache()
+        self.load()
+        if self._last_sent.delete(int(user_id)):
+            self._pending_last_sent.pop(str(user_id), None)
+            if self.storage is not None:
+                self.storage.delete_user_last_sent(user_id)
+            self._save_cache()
     
     def get_cache_info(self) -> Dict[str, Any]:
         """Obtiene información del cache"""
         return {
             'cache_file': self.cache_file,
+            'storage': type(self.storage).__name__ if self.storage is not None else 'json',
             'last_updated': self.cache.get('last_updated'),
-            'has_quotation': self.cache.get('last_quotation') is not None,
-            'users_count': len(self.cache.get('user_last_sent', {}))
+            'has_quotation': bool(self.cache['last_quotations']),
+            'markets': sorted(self.cache['last_quotations']),
+            'users_count': len(self._last_sent),
+            'dirty': self.dirty,
+            'dirty_since': self.dirty_since
         }
     
     def reset_cache(self):
         """Resetea completamente el cache"""
         self.cache = self._get_default_cache()
+        self.cache.pop('user_last_sent')
+        self._last_sent.clear()
+        if self.storage is not None:
+            self.storage.clear_cache()
+            self._pending_last_sent = {}
         self._save_cache()
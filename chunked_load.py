@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+import re
+from itertools import islice
+from typing import Any, AsyncIterator, Collection, Iterable, Iterator, List, Optional, Tuple
+from config import STORE_LOAD_CHUNK_SIZE
+
+# Espacios permitidos entre tokens JSON
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_decoder = json.JSONDecoder()
+
+def _skip(text: str, position: int, expected: Optional[str] = None) -> int:
+    """Saltea espacios (y el caracter esperado, si se indica) y devuelve la nueva posición"""
+    position = _WHITESPACE.match(text, position).end()
+    if expected is None:
+        return position
+    if text[position:position + 1] != expected:
+        raise json.JSONDecodeError(f"Se esperaba '{expected}'", text, position)
+    return _WHITESPACE.match(text, position + 1).end()
+
+def _iter_members(text: str, cursor: List[int], nested: Collection[str]) -> Iterator[Tuple[str, Any]]:
+    """Recorre los miembros del objeto que empieza en cursor[0] y deja cursor[0] después de su cierre"""
+    position = _skip(text, cursor[0], '{')
+    if text[position:position + 1] == '}':
+        cursor[0] = position + 1
+        return
+    while True:
+        key, position = _decoder.raw_decode(text, position)
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Se esperaba una clave", text, position)
+        position = _skip(text, position, ':')
+        if key in nested:
+            cursor[0] = position
+            members = _iter_members(text, cursor, ())
+            yield key, members
+            # Si quien lee no recorrió el objeto anidado, terminarlo para ubicar la posición
+            for _ in members:
+                pass
+            position = cursor[0]
+        else:
+            value, position = _decoder.raw_decode(text, position)
+            yield key, value
+        position = _skip(text, position)
+        if text[position:position + 1] == '}':
+            cursor[0] = position + 1
+            return
+        position = _skip(text, position, ',')
+
+def iter_json_object(text: str, nested: Collection[str] = ()) -> Iterator[Tuple[str, Any]]:
+    """
+    Itera los miembros (clave, valor) de un objeto JSON de a uno
+
+    json.loads() arma el objeto entero en una sola llamada que no suelta el
+    GIL; acá cada miembro es una llamada corta, así quien carga puede ceder el
+    event loop entre tandas.
+
+    Args:
+        text: Texto JSON cuyo valor raíz es un objeto
+        nested: Claves cuyo valor (otro objeto) se devuelve como un iterador de
+            sus miembros en lugar de decodificarse entero
+
+    Raises:
+        json.JSONDecodeError: Si el texto no es un objeto JSON válido
+    """
+    return _iter_members(text, [0], nested)
+
+async def read_text(path: str) -> Optional[str]:
+    """Lee un archivo de texto en un hilo aparte (None si no existe)"""
+    def read() -> Optional[str]:
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    return await asyncio.to_thread(read)
+
+async def iter_chunks(items: Iterable, chunk_size: int = STORE_LOAD_CHUNK_SIZE) -> AsyncIterator[List]:
+    """
+    Consume un iterable por tandas, cediendo el event loop después de cada una
+
+    El trabajo de producir cada elemento (decodificar, leer de SQLite) corre
+    dentro de la tanda, así ninguna pausa del loop pasa de una tanda.
+    """
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+        await asyncio.sleep(0)
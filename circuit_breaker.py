@@ -0,0 +1,62 @@
+import logging
+import time
+
+# Configurar logger para el circuit breaker
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """Circuit breaker para dejar de consultar una API que está fallando"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 60):
+        """
+        Args:
+            name: Nombre para los logs
+            failure_threshold: Fallos consecutivos necesarios para abrir el circuito
+            reset_timeout: Segundos que el circuito queda abierto antes de probar de nuevo
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow_request(self) -> bool:
+        """
+        Indica si se puede hacer una consulta
+
+        Returns:
+            bool: True si el circuito está cerrado o toca una consulta de prueba
+        """
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            # Dejar pasar una única consulta de prueba
+            self.state = self.HALF_OPEN
+            logger.info(f"Circuito '{self.name}' semiabierto, probando la API")
+            return True
+        return False
+
+    def record_success(self):
+        """Registra una consulta exitosa y cierra el circuito"""
+        if self.state != self.CLOSED:
+            logger.info(f"Circuito '{self.name}' cerrado, la API respondió correctamente")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        """Registra una consulta fallida y abre el circuito si corresponde"""
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuito '{self.name}' abierto tras {self.failures} fallos, pausa de {self.reset_timeout}s")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def is_open(self) -> bool:
+        """Indica si el circuito está abierto (sin consultas a la API)"""
+        return self.state == self.OPEN
@@ -1,4 +1,5 @@
 import os
+import secrets
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
@@ -8,14 +9,139 @@ load_dotenv()
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 CHAT_ID = os.getenv('CHAT_ID')
 
+# Modo de recepción de updates: 'polling' (por defecto) o 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+
+# Webhook: URL pública del bot (en Railway se deduce del dominio público), ruta y secreto
+RAILWAY_PUBLIC_DOMAIN = os.getenv('RAILWAY_PUBLIC_DOMAIN')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL') or (f'https://{RAILWAY_PUBLIC_DOMAIN}' if RAILWAY_PUBLIC_DOMAIN else '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+# Puerto del servidor HTTP (webhook y health check en "/"); en modo polling solo se levanta si está definido
+PORT = int(os.getenv('PORT', '0'))
+
+# Modo de ejecución: 'single' (todo en un proceso) o 'sharded' (workers de envío en procesos aparte)
+RUN_MODE = os.getenv('RUN_MODE', 'single').lower()
+DISPATCHER_WORKERS = int(os.getenv('DISPATCHER_WORKERS', str(os.cpu_count() or 2)))
+
+# Updates que se procesan a la vez (los de un mismo usuario siempre en orden)
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '256'))
+
+# Límite de comandos por usuario (comandos por segundo, ráfaga máxima y usuarios recordados)
+COMMAND_RATE = float(os.getenv('COMMAND_RATE', '0.5'))
+COMMAND_BURST = float(os.getenv('COMMAND_BURST', '5'))
+RATE_LIMIT_MAX_USERS = int(os.getenv('RATE_LIMIT_MAX_USERS', '100000'))
+
+# Administradores (IDs separados por coma) que pueden usar /perfil
+ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').replace(' ', '').split(',') if user_id}
+
+# Capturas de perfil (directorio, duración por defecto y máxima en segundos)
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_DEFAULT_SECONDS = float(os.getenv('PROFILE_DEFAULT_SECONDS', '30'))
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '300'))
+
 # Configuración de la API
 DOLARAPI_URL = os.getenv('DOLARAPI_URL', 'https://dolarapi.com')
+# Fuentes de cotizaciones separadas por coma (espejos de dolarapi o APIs compatibles); por defecto solo DOLARAPI_URL
+DOLARAPI_URLS = [url.strip().rstrip('/') for url in os.getenv('DOLARAPI_URLS', DOLARAPI_URL).split(',') if url.strip()]
 
 # Configuración de envíos automáticos
 AUTO_SEND_INTERVAL = int(os.getenv('AUTO_SEND_INTERVAL', '60'))
 
-# URL de la API de dolarapi para dólar oficial
-API_ENDPOINT = f'{DOLARAPI_URL}/v1/dolares/oficial'
+# Cada cuántos segundos se consulta la API para detectar cambios
+POLL_INTERVAL = float(os.getenv('POLL_INTERVAL', '5'))
+
+# Cliente HTTP hacia dolarapi (pool, timeouts y reintentos)
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '30'))
+HTTP_DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', '300'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '5'))
+HTTP_TOTAL_TIMEOUT = float(os.getenv('HTTP_TOTAL_TIMEOUT', '10'))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '2'))
+HTTP_BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', '0.5'))
+HTTP_BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', '5'))
+
+# Circuit breaker: fallos seguidos para dejar de consultar y segundos de pausa
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '60'))
+
+# Consulta de cobertura: si la fuente no respondió en su percentil de latencia, se consulta también la siguiente
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', '0.2'))
+HEDGE_DEFAULT_DELAY = float(os.getenv('HEDGE_DEFAULT_DELAY', '1'))
+SOURCE_LATENCY_WINDOW = int(os.getenv('SOURCE_LATENCY_WINDOW', '100'))
+
+# Cache en memoria de la cotización (segundos fresca y segundos sirviendo la vieja mientras se actualiza)
+QUOTATION_CACHE_TTL = float(os.getenv('QUOTATION_CACHE_TTL', '5'))
+QUOTATION_STALE_TTL = float(os.getenv('QUOTATION_STALE_TTL', '30'))
+
+# Cache de mensajes renderizados (cantidad de mensajes distintos e idioma)
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', '256'))
+RENDER_LOCALE = os.getenv('RENDER_LOCALE', 'es')
+
+# Historial de cotizaciones (muestras por mercado, una muestra por minuto sin cambios)
+HISTORY_DIR = os.getenv('HISTORY_DIR', 'history')
+HISTORY_CAPACITY = int(os.getenv('HISTORY_CAPACITY', '20160'))
+HISTORY_SAMPLE_INTERVAL = float(os.getenv('HISTORY_SAMPLE_INTERVAL', '60'))
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '300'))
+
+# Modo resumen: minutos permitidos para agrupar los cambios en un solo mensaje
+DIGEST_MIN_MINUTES = int(os.getenv('DIGEST_MIN_MINUTES', '5'))
+DIGEST_MAX_MINUTES = int(os.getenv('DIGEST_MAX_MINUTES', '60'))
+
+# Segundos que Telegram puede guardar cada respuesta inline (@bot ...)
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '10'))
+
+# Alertas de precio (archivo y máximo de alertas activas por usuario)
+ALERTS_FILE = os.getenv('ALERTS_FILE', 'alerts.json')
+MAX_ALERTS_PER_USER = int(os.getenv('MAX_ALERTS_PER_USER', '10'))
+
+# Configuración de difusión (límites de Telegram: ~30 msg/s global, ~1 msg/s por chat)
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '20'))
+BROADCAST_GLOBAL_RATE = float(os.getenv('BROADCAST_GLOBAL_RATE', '30'))
+BROADCAST_PER_CHAT_RATE = float(os.getenv('BROADCAST_PER_CHAT_RATE', '1'))
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', '3'))
+
+# Outbox de envíos pendientes (journal y confirmaciones por checkpoint)
+OUTBOX_FILE = os.getenv('OUTBOX_FILE', 'outbox.jsonl')
+OUTBOX_CHECKPOINT_SIZE = int(os.getenv('OUTBOX_CHECKPOINT_SIZE', '500'))
+
+# Configuración de persistencia del cache (write-behind)
+CACHE_WRITE_BEHIND = os.getenv('CACHE_WRITE_BEHIND', 'true').lower() in ('1', 'true', 'yes')
+CACHE_FLUSH_INTERVAL = float(os.getenv('CACHE_FLUSH_INTERVAL', '30'))
+
+# Almacenamiento de configuraciones y cache ('json' o 'sqlite')
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'bot_data.sqlite3')
+
+# Filas que se cargan por tanda al arrancar antes de ceder el event loop
+STORE_LOAD_CHUNK_SIZE = int(os.getenv('STORE_LOAD_CHUNK_SIZE', '2000'))
+
+# URLs de la colección con todos los mercados en cada fuente (una sola consulta por ciclo)
+API_COLLECTION_ENDPOINTS = [f'{url}/v1/dolares' for url in DOLARAPI_URLS]
+
+# Mercados disponibles (clave "casa" de dolarapi → nombre para mostrar)
+MARKETS = {
+    'oficial': 'Dólar Oficial',
+    'blue': 'Dólar Blue',
+    'bolsa': 'Dólar MEP',
+    'contadoconliqui': 'Dólar CCL',
+    'tarjeta': 'Dólar Tarjeta',
+    'mayorista': 'Dólar Mayorista',
+    'cripto': 'Dólar Cripto',
+}
+
+# Nombres alternativos que pueden usar los usuarios en los comandos
+MARKET_ALIASES = {
+    'mep': 'bolsa',
+    'ccl': 'contadoconliqui',
+    'contado': 'contadoconliqui',
+}
+
+# Mercado por defecto para /cotizacion y nuevas suscripciones
+DEFAULT_MARKET = 'oficial'
 
 # Mensajes del bot
 MESSAGES = {
@@ -31,6 +157,8 @@ Te mantengo al día con la cotización del dólar oficial en tiempo real, ¡como
 • /configurar - Configurar envío automático ⚙️
 • /parar - Detener envío automático 🛑
 • /estado - Ver configuración actual 📊
+• /mercados - Ver mercados disponibles (blue, MEP, CCL...) 💱
+• /alerta - Avisarme cuando el dólar cruce un precio 🚨
 • /help - Mostrar ayuda completa 📚
 
 🚀 ¡Empecemos esta aventura juntos! 🚀
@@ -40,9 +168,18 @@ Te mantengo al día con la cotización del dólar oficial en tiempo real, ¡como
 
 🔹 ¡Comandos principales! 🔹
 • /cotizacion - Ver la cotización del dólar oficial 📈
+• /cotizacion blue - Ver la cotización de otro mercado (o "todos") 💱
 • /configurar - Configurar envío automático de cotizaciones ⚙️
 • /parar - Detener envío automático 🛑
 • /estado - Ver configuración actual 📊
+• /mercados - Ver mercados disponibles y tus suscripciones 💱
+• /historial 24h - Ver los últimos cambios de precio 📜
+• /stats 7d - Ver mínimo, máximo, promedio y variación 📉📈
+• /alerta blue 1100 - Avisarme cuando la venta cruce un precio 🚨
+• /alerta - Ver tus alertas (o /alerta borrar para eliminarlas) 🔔
+• /suscribir mep - Monitorear también otro mercado ➕
+• /desuscribir mep - Dejar de monitorear un mercado ➖
+• @ mi usuario + mercado (ej. blue) en cualquier chat - Compartir la cotización 💬
 • /help - Mostrar esta ayuda 📚
 
 💡 ¡Cómo configurar envío automático! 💡
@@ -63,7 +200,45 @@ Te mantengo al día con la cotización del dólar oficial en tiempo real, ¡como
 
 ¡Estoy aquí para ayudarte! 😊🤖''',
     
+    # Formato de las cotizaciones
+    'quotation_single': '''🏛️ <b>{name}</b>
+
+🟢 <b>Compra:</b> {compra}
+🔴 <b>Venta:</b> {venta}
+🕐 <b>Actualizado:</b> {fecha}''',
+    
+    'quotation_all_header': '''🏛️ <b>COTIZACIONES DEL DÓLAR</b>
+🕐 <i>Actualizado: {fecha}</i>
+''',
+    
+    'quotation_all_item': '''
+<b>{name}</b>
+🟢 Compra: {compra} | 🔴 Venta: {venta}
+''',
+    
+    'digest_header': '''🧾 <b>RESUMEN DE LOS ÚLTIMOS {minutes} MINUTOS</b>
+🕐 <i>{desde} → {hasta}</i>
+''',
+    
+    'digest_item': '''
+<b>{name}</b>
+🔓 Apertura: {apertura} | 🔒 Último: {ultimo}
+{arrow} Variación: {variacion}
+''',
+    
+    'quotation_change_footer': '''
+
+🎉🎊 ¡COTIZACIÓN ACTUALIZADA! 🎊🎉
+
+💸 ¡Tu botito detectó un cambio en el precio! 💸
+🕵️‍♂️ ¡Estaba vigilando como un detective! 🕵️‍♂️
+
+😊 ¡Espero que esta información te sea útil! 😊
+🚀 ¡Seguiré monitoreando para ti! 🚀''',
+    
     'error': '❌ Error al obtener la cotización\n\n🔄 Intenta nuevamente en unos minutos.\n\n💡 Si el problema persiste, verifica tu conexión a internet.',
+    'rate_limited': '⏳ ¡Despacio! Estás enviando muchos comandos seguidos. Esperá unos segundos y volvé a intentar.',
+    
     'no_data': '⚠️ No se pudo obtener la cotización\n\n🕐 Intenta nuevamente en unos minutos.',
     
     # Mensajes de configuración paso a paso
@@ -90,7 +265,7 @@ Tu botito favorito va a estar vigilando el dólar oficial cada X segundos, pero
 🎯 ¡Tu configuración está lista! 🎯
 ⏰ Verificación: cada {minutes} segundos ⏰
 🔄 Estado: ¡SUPER ACTIVO! 🔄
-🧠 Modo: Solo envía cuando cambie el precio (¡súper inteligente!) 🧠
+🧠 Modo: {mode} 🧠
 
 💬 ¡Tu botito va a estar súper atento! 💬
 Revisará si la cotización cambió cada {minutes} segundos, pero solo te va a molestar cuando detecte cambios reales en el precio del dólar oficial. ¡Qué considerado! 😊💸
@@ -100,6 +275,21 @@ Revisará si la cotización cambió cada {minutes} segundos, pero solo te va a m
 
 ¡Disfruta de tu monitoreo inteligente! 🚀✨''',
     
+    'config_digest': '''📬 ¡Último paso! ¿Cómo quieres recibir los cambios? 📬
+
+• 0 = cada cambio apenas ocurre ⚡
+• 5 a 60 = un solo resumen cada esos minutos, con apertura, último precio y variación 🧾
+
+💡 En días movidos, el resumen te ahorra un montón de mensajes 😉
+
+✍️ ¡Escribe solo el número! ✍️''',
+    
+    'config_digest_error': '''😅 Ese valor no es válido. Escribe 0 para recibir cada cambio, o un número de minutos entre {min} y {max} para el resumen 🔢''',
+    
+    'mode_every_change': 'Solo envía cuando cambie el precio (¡súper inteligente!)',
+    
+    'mode_digest': 'Resumen cada {minutes} minutos (apertura, último y variación)',
+    
     'config_error': '''😅 ¡Ups! Algo salió mal 😅
 
 ⚠️ Problema: El valor que ingresaste no es válido ⚠️
@@ -143,7 +333,8 @@ Revisará si la cotización cambió cada {minutes} segundos, pero solo te va a m
 
 ⏰ Verificación: cada {minutes} segundos ⏰
 🔄 Estado: {status} 🔄
-🧠 Modo: Solo envía cuando cambie el precio (¡súper inteligente!) 🧠
+💱 Mercados: {markets} 💱
+🧠 Modo: {mode} 🧠
 
 💡 ¡Te explico qué significa! 💡
 Tu botito revisa si la cotización cambió cada {minutes} segundos, pero solo te va a molestar cuando detecte cambios reales. ¡Qué considerado! 😊💸
@@ -151,5 +342,147 @@ Tu botito revisa si la cotización cambió cada {minutes} segundos, pero solo te
 🛑 Para detener: /parar 🛑
 ⚙️ Para cambiar: /configurar ⚙️
 
-¡Tu monitoreo está funcionando perfectamente! 🚀✨'''
+¡Tu monitoreo está funcionando perfectamente! 🚀✨''',
+    
+    # Mensajes de mercados
+    'markets_list': '''💱 ¡MERCADOS DISPONIBLES! 💱
+
+{markets}
+
+📌 Tus suscripciones: {subscribed}
+
+➕ Para agregar uno: /suscribir blue
+➖ Para quitar uno: /desuscribir blue
+📈 Para consultar uno: /cotizacion mep
+
+¡Solo te aviso de los mercados que elijas! 😊✨''',
+    
+    'market_unknown': '''🤔 ¡No conozco ese mercado! 🤔
+
+💱 Estos son los que puedo vigilar:
+{markets}
+
+💡 Ejemplo: /suscribir blue''',
+    
+    'subscribe_success': '''✅ ¡Listo! Ahora también vigilo el {market} 🕵️‍♂️
+
+📌 Tus suscripciones: {subscribed}''',
+    
+    'unsubscribe_success': '''➖ ¡Listo! Ya no te aviso de los cambios del {market}
+
+📌 Tus suscripciones: {subscribed}''',
+    
+    'unsubscribe_missing': '''🤷 No estabas suscripto al {market}
+
+💡 Para ver tus suscripciones: /mercados''',
+    
+    # Mensajes de historial y estadísticas
+    'history_header': '''📜 <b>Historial {name}</b> (últimos {window})
+''',
+    
+    'history_item': '''🕐 {fecha} → 🟢 {compra} | 🔴 {venta}
+''',
+    
+    'stats': '''📊 <b>Estadísticas {name}</b> (últimos {window})
+
+🟢 <b>Compra</b>
+• Mínimo: {compra_min}
+• Máximo: {compra_max}
+• Promedio: {compra_avg}
+• Variación: {compra_change}
+
+🔴 <b>Venta</b>
+• Mínimo: {venta_min}
+• Máximo: {venta_max}
+• Promedio: {venta_avg}
+• Variación: {venta_change}
+
+🔢 Muestras: {samples}''',
+    
+    'history_empty': '''📭 ¡Todavía no tengo datos para esa ventana! 📭
+
+🕐 Dame un ratito para juntar cotizaciones y vuelve a intentar 😊''',
+    
+    'history_usage': '''🤔 ¡No entendí la consulta! 🤔
+
+💡 Ejemplos:
+• /historial 24h
+• /historial blue 3d
+• /stats 7d
+• /stats mep 30m''',
+    
+    # Mensajes de alertas de precio
+    'alert_set': '''🚨 ¡Alerta creada! 🚨
+
+🔔 Te aviso cuando la venta del {name} {direction} {precio}
+💵 Venta actual: {actual}
+
+📋 Para ver tus alertas: /alerta''',
+    
+    'alert_list': '''🔔 <b>Tus alertas</b>
+
+{alerts}
+
+🗑️ Para eliminarlas: /alerta borrar''',
+    
+    'alert_item': '''• {name}: venta {direction} {precio}
+''',
+    
+    'alert_none': '''📭 No tienes alertas activas
+
+💡 Ejemplo: /alerta blue 1100''',
+    
+    'alert_cleared': '🗑️ ¡Listo! Eliminé {count} alerta(s)',
+    
+    'alert_limit': '''⚠️ ¡Ya tienes {max} alertas activas! ⚠️
+
+🗑️ Elimina las actuales con /alerta borrar''',
+    
+    'alert_same': '''🤔 ¡La venta ya está en {precio}! 🤔
+
+💡 Elige un precio más alto o más bajo''',
+    
+    'alert_usage': '''🤔 ¡No entendí la alerta! 🤔
+
+💡 Ejemplos:
+• /alerta 1100 (dólar oficial)
+• /alerta blue 1250.50
+• /alerta - ver tus alertas
+• /alerta borrar - eliminarlas''',
+    
+    'alert_triggered': '''🚨🚨 ¡ALERTA DE PRECIO! 🚨🚨
+
+💱 La venta del <b>{name}</b> {direction} <b>{precio}</b>
+🔴 Venta actual: <b>{venta}</b>
+
+🔔 La alerta ya se cumplió y fue eliminada''',
+    
+    # Mensajes de administración
+    'admin_only': '🔒 Este comando es solo para administradores',
+    
+    'profile_status': '''🔬 <b>Perfilado</b>
+
+📍 Captura: {status}
+
+⏱️ <b>Tiempos por handler</b>
+{timings}
+💡 /perfil 30 - capturar 30 segundos
+🛑 /perfil parar - terminar la captura''',
+    
+    'profile_timing': '''• {name}: {calls} llamadas, {avg} ms prom, {total} s total
+''',
+    
+    'profile_started': '🔬 Captura de perfil iniciada por {seconds} segundos. Te aviso cuando termine.',
+    
+    'profile_busy': '⚠️ Ya hay una captura en curso (termina en {seconds} segundos)',
+    
+    'profile_idle': '🤷 No hay ninguna captura en curso',
+    
+    'profile_done': '✅ Perfil guardado en {path}',
+    
+    'profile_failed': '❌ No se pudo guardar el perfil (revisa los logs)',
+    
+    'unsubscribe_last': '''⚠️ ¡Necesito vigilar al menos un mercado! ⚠️
+
+🛑 Si no quieres recibir más avisos, usa /parar'''
 }
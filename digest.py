@@ -0,0 +1,68 @@
+import math
+from datetime import datetime
+from typing import Iterable, Tuple
+from renderer import TEMPLATES
+
+def digest_window(now: float, minutes: int) -> Tuple[float, float]:
+    """
+    Ventana de resumen que terminó más recientemente
+
+    Las ventanas están alineadas al reloj (ej. cada 15 minutos: :00, :15, ...),
+    así todos los usuarios con el mismo resumen comparten el mismo mensaje.
+
+    Returns:
+        Tupla (inicio, fin) en segundos epoch
+    """
+    length = minutes * 60
+    end = math.floor(now / length) * length
+    return end - length, end
+
+def next_digest_due(now: float, minutes: int) -> float:
+    """Momento en que termina la ventana de resumen en curso"""
+    length = minutes * 60
+    return (math.floor(now / length) + 1) * length
+
+def format_delta(delta: float, first: float) -> str:
+    """Formatea la variación absoluta y porcentual (ej. +$12.50 (+1.10%))"""
+    sign = '+' if delta >= 0 else '-'
+    pct = delta / first * 100 if first else 0.0
+    return f"{sign}${abs(delta):,.2f} ({pct:+.2f}%)"
+
+def build_digest_message(markets: Iterable[str], minutes: int, window: Tuple[float, float],
+                         history, cache_manager, dolar_service) -> str:
+    """
+    Arma el resumen de una ventana: apertura, último precio y variación de cada mercado
+
+    Args:
+        markets: Mercados que cambiaron en la ventana
+        minutes: Duración de la ventana
+        window: (inicio, fin) de la ventana
+        history: Historial de cotizaciones (para el precio de apertura)
+        cache_manager: Cache con la última cotización de cada mercado
+        dolar_service: Servicio de cotizaciones (nombres y formato de precios)
+
+    Returns:
+        str: Mensaje listo para enviar (HTML)
+    """
+    start, end = window
+    parts = [TEMPLATES['digest_header'].render(
+        minutes=minutes,
+        desde=datetime.fromtimestamp(start).strftime('%H:%M'),
+        hasta=datetime.fromtimestamp(end).strftime('%H:%M')
+    )]
+    for market in markets:
+        quotation = cache_manager.get_last_quotation(market) or {}
+        last = quotation.get('venta')
+        opening = history.get_value_at(market, start)
+        first = opening[2] if opening is not None else last
+        if first is None or last is None:
+            continue
+        delta = last - first
+        parts.append(TEMPLATES['digest_item'].render(
+            name=dolar_service.get_market_name(market, quotation),
+            apertura=dolar_service.format_price(first),
+            ultimo=dolar_service.format_price(last),
+            arrow='📈' if delta > 0 else '📉' if delta < 0 else '➡️',
+            variacion=format_delta(delta, first)
+        ))
+    return ''.join(parts)
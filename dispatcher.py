@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+from telegram.error import Forbidden, RetryAfter
+from metrics import SEND_SECONDS, BROADCAST_SECONDS, MESSAGES_SENT, SEND_FAILURES, RATE_LIMITED
+from config import (
+    BROADCAST_CONCURRENCY,
+    BROADCAST_GLOBAL_RATE,
+    BROADCAST_PER_CHAT_RATE,
+    BROADCAST_MAX_RETRIES,
+)
+
+# Configurar logger para el dispatcher
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Token bucket para limitar la cantidad de mensajes por segundo"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        """Recarga los tokens según el tiempo transcurrido"""
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def reserve(self) -> float:
+        """
+        Reserva un token y devuelve cuánto hay que esperar para usarlo
+
+        Returns:
+            float: Segundos de espera (0 si el token está disponible)
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def try_acquire(self) -> bool:
+        """
+        Toma un token solo si está disponible (sin esperar)
+
+        Returns:
+            bool: True si se tomó el token
+        """
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens < 1 or self.blocked_until > now:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def acquire(self):
+        """Espera hasta que haya un token disponible"""
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Bloquea el bucket durante los segundos indicados (RetryAfter)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self) -> bool:
+        """Indica si el bucket está lleno y sin bloqueos (se puede descartar)"""
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+class BroadcastDispatcher:
+    """Envía un mismo mensaje a muchos usuarios con concurrencia acotada"""
+
+    def __init__(self,
+                 concurrency: int = BROADCAST_CONCURRENCY,
+                 global_rate: float = BROADCAST_GLOBAL_RATE,
+                 per_chat_rate: float = BROADCAST_PER_CHAT_RATE,
+                 max_retries: int = BROADCAST_MAX_RETRIES):
+        self.concurrency = max(1, concurrency)
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+
+    def _get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        """Obtiene o crea el bucket de un chat"""
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate, capacity=1.0)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_chat_buckets(self):
+        """Descarta los buckets de chats que ya no tienen restricciones"""
+        idle = [chat_id for chat_id, bucket in self.chat_buckets.items() if bucket.is_idle()]
+        for chat_id in idle:
+            del self.chat_buckets[chat_id]
+
+    async def _send_one(self, bot, chat_id: int, text: str, parse_mode: Optional[str]) -> bool:
+        """
+        Envía un mensaje respetando los límites global y por chat
+
+        Returns:
+            bool: True si el mensaje se entregó
+        """
+        chat_bucket = self._get_chat_bucket(chat_id)
+        for attempt in range(self.max_retries + 1):
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                with SEND_SECONDS.time():
+                    await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                MESSAGES_SENT.inc()
+                return True
+            except RetryAfter as e:
+                RATE_LIMITED.inc()
+                retry_after = float(e.retry_after)
+                logger.warning(f"Límite de Telegram alcanzado, esperando {retry_after}s (usuario {chat_id})")
+                self.global_bucket.pause(retry_after)
+                chat_bucket.pause(retry_after)
+            except Forbidden:
+                SEND_FAILURES.inc(reason='forbidden')
+                logger.info(f"Usuario {chat_id} bloqueó al bot, se omite el envío")
+                return False
+            except Exception as e:
+                SEND_FAILURES.inc(reason='error')
+                logger.error(f"Error enviando a usuario {chat_id}: {e}")
+                return False
+        SEND_FAILURES.inc(reason='retries')
+        logger.error(f"Se agotaron los reintentos para el usuario {chat_id}")
+        return False
+
+    async def broadcast(self, bot, chat_ids: Iterable[int], text: str,
+                        parse_mode: Optional[str] = 'HTML',
+                        on_result: Optional[Callable[[int, bool], None]] = None) -> List[int]:
+        """
+        Envía el mensaje a todos los chats indicados
+
+        Args:
+            bot: Instancia del bot de Telegram
+            chat_ids: IDs de los chats destino
+            text: Texto del mensaje
+            parse_mode: Modo de parseo de Telegram
+            on_result: Función llamada tras cada envío con (chat_id, entregado)
+
+        Returns:
+            List[int]: IDs de los chats a los que se entregó el mensaje
+        """
+        pending = iter(chat_ids)
+        delivered: List[int] = []
+
+        async def worker():
+            for chat_id in pending:
+                ok = await self._send_one(bot, chat_id, text, parse_mode)
+                if ok:
+                    delivered.append(chat_id)
+                if on_result is not None:
+                    on_result(chat_id, ok)
+
+        start = time.perf_counter()
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+            BROADCAST_SECONDS.observe(time.perf_counter() - start)
+        finally:
+            for task in workers:
+                task.cancel()
+            self._prune_chat_buckets()
+        return delivered
@@ -1,7 +1,27 @@
 import aiohttp
+import asyncio
+import hashlib
+import json
 import logging
+import random
+import time
 from datetime import datetime
-from config import API_ENDPOINT
+from typing import Dict, List, Optional
+from circuit_breaker import CircuitBreaker
+from metrics import FETCH_SECONDS, UPSTREAM_ERRORS, UPSTREAM_REQUESTS, UPSTREAM_WINS, UPSTREAM_HEDGES
+from upstream_sources import UpstreamSource, UpstreamSources
+from renderer import TEMPLATES
+from config import (
+    API_COLLECTION_ENDPOINTS, DEFAULT_MARKET, MARKETS, MARKET_ALIASES,
+    QUOTATION_CACHE_TTL, QUOTATION_STALE_TTL,
+    HTTP_POOL_SIZE, HTTP_KEEPALIVE_TIMEOUT, HTTP_DNS_CACHE_TTL,
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_TOTAL_TIMEOUT,
+    HTTP_MAX_RETRIES, HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT,
+)
+
+class UpstreamError(Exception):
+    """Error al consultar la API de cotizaciones"""
 
 # Configurar logger para el servicio
 logger = logging.getLogger(__name__)
@@ -9,13 +29,44 @@ logger = logging.getLogger(__name__)
 class DolarService:
     """Servicio para obtener cotizaciones del dólar desde dolarapi"""
     
-    def __init__(self):
+    def __init__(self, cache_ttl: float = QUOTATION_CACHE_TTL, stale_ttl: float = QUOTATION_STALE_TTL,
+                 endpoints: Optional[List[str]] = None):
+        """
+        Args:
+            cache_ttl: Segundos durante los que la cotización en memoria se considera fresca
+            stale_ttl: Segundos extra durante los que se sirve la cotización vieja
+                mientras se actualiza en segundo plano
+            endpoints: URLs de la colección de cotizaciones (por defecto, las de DOLARAPI_URLS)
+        """
         self.session = None
+        self.cache_ttl = cache_ttl
+        self.stale_ttl = stale_ttl
+        # Última foto de todos los mercados {casa: cotización}
+        self._cached_quotations: Optional[Dict[str, dict]] = None
+        self._cached_at = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+        # Fuentes de cotizaciones (cada una con sus validadores para requests condicionales)
+        self.sources = UpstreamSources(endpoints or API_COLLECTION_ENDPOINTS)
+        # Se incrementa cada vez que la API devuelve datos distintos
+        self.version = 0
+        self.updated_at: Optional[float] = None
+        self.circuit_breaker = CircuitBreaker('dolarapi', CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
     
     async def _get_session(self):
-        """Obtiene o crea una sesión HTTP"""
+        """Obtiene o crea una sesión HTTP con pool de conexiones y timeouts"""
         if self.session is None:
-            self.session = aiohttp.ClientSession()
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_SIZE,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                use_dns_cache=True,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=HTTP_TOTAL_TIMEOUT,
+                connect=HTTP_CONNECT_TIMEOUT,
+                sock_read=HTTP_READ_TIMEOUT
+            )
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
         return self.session
     
     async def close_session(self):
@@ -24,105 +75,367 @@ class DolarService:
             await self.session.close()
             self.session = None
     
-    async def get_quotation(self) -> dict:
+    async def get_quotations(self, force_refresh: bool = False) -> Optional[Dict[str, dict]]:
         """
-        Obtiene la cotización del dólar oficial
+        Obtiene las cotizaciones de todos los mercados con una sola consulta
+        
+        Las llamadas concurrentes comparten una única consulta a la API y,
+        mientras las cotizaciones en memoria estén frescas, se responde sin consultar.
+        
+        Args:
+            force_refresh: Si es True, ignora el cache y consulta la API
+        
+        Returns:
+            Dict {casa: cotización} o None si hay error
+        """
+        if not force_refresh and self._cached_quotations is not None:
+            age = time.monotonic() - self._cached_at
+            if age <= self.cache_ttl:
+                return self._cached_quotations
+            if age <= self.cache_ttl + self.stale_ttl:
+                # Servir la cotización vieja y actualizar en segundo plano
+                self._refresh()
+                return self._cached_quotations
+        return await asyncio.shield(self._refresh())
+    
+    async def get_quotation(self, market: str = DEFAULT_MARKET, force_refresh: bool = False) -> dict:
+        """
+        Obtiene la cotización de un mercado
+        
+        Args:
+            market: Casa de cambio según dolarapi (oficial, blue, bolsa, ...)
+            force_refresh: Si es True, ignora el cache y consulta la API
         
         Returns:
             dict: Datos de la cotización o None si hay error
         """
+        quotations = await self.get_quotations(force_refresh=force_refresh)
+        if not quotations:
+            return None
+        return quotations.get(market)
+    
+    def _refresh(self) -> asyncio.Future:
+        """Inicia (o reutiliza) la consulta en curso a la API"""
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh_quotations())
+        return self._inflight
+    
+    async def _refresh_quotations(self) -> Optional[Dict[str, dict]]:
+        """
+        Consulta la API y actualiza el cache en memoria
+        
+        Si la API falla o el circuito está abierto, devuelve la última
+        cotización conocida (o None si nunca se obtuvo una).
+        """
         try:
-            session = await self._get_session()
-            async with session.get(API_ENDPOINT) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data
-                else:
-                    logger.warning(f"Error HTTP {response.status} al obtener cotización oficial")
+            if not self.circuit_breaker.allow_request():
+                return self._cached_quotations
+            quotations = await self._fetch_with_retries()
+            if quotations:
+                self.circuit_breaker.record_success()
+                self._cached_quotations = quotations
+                self._cached_at = time.monotonic()
+                return quotations
+            self.circuit_breaker.record_failure()
+            return self._cached_quotations
+        finally:
+            self._inflight = None
+    
+    async def _fetch_with_retries(self) -> Optional[Dict[str, dict]]:
+        """
+        Consulta la API reintentando con backoff exponencial y jitter
+        
+        Returns:
+            Dict {casa: cotización} o None si fallaron todos los intentos
+        """
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            try:
+                with FETCH_SECONDS.time():
+                    return await self._fetch_quotations()
+            except UpstreamError as e:
+                if attempt == HTTP_MAX_RETRIES:
+                    logger.error(f"Error al obtener cotizaciones: {e}")
                     return None
-        except Exception as e:
-            logger.error(f"Error al obtener cotización oficial: {e}")
-            return None
+                delay = random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+                logger.warning(f"Error al obtener cotizaciones ({e}), reintento en {delay:.1f}s")
+                await asyncio.sleep(delay)
+        return None
     
-    async def get_all_quotations(self) -> dict:
+    async def _fetch_quotations(self) -> Dict[str, dict]:
         """
-        Obtiene la cotización del dólar oficial (mantiene compatibilidad con el nombre)
+        Consulta las cotizaciones de todos los mercados, con consultas de cobertura
+        
+        Se consulta primero la fuente más rápida y sana. Si no respondió dentro
+        de su percentil de latencia (p95), se consulta también la siguiente, y
+        si una falla se pasa enseguida a la próxima. Gana la primera respuesta
+        válida y las consultas que siguen en curso se cancelan.
         
         Returns:
-            dict: Diccionario con la cotización oficial
+            Dict {casa: cotización}
+        
+        Raises:
+            UpstreamError: Si ninguna fuente respondió correctamente
         """
-        quotation = await self.get_quotation()
-        if quotation:
-            return {'oficial': quotation}
-        return {}
+        sources = self.sources.ranked()
+        pending: Dict[asyncio.Future, UpstreamSource] = {}
+        next_index = 0
+        last_error: Optional[UpstreamError] = None
+        try:
+            while True:
+                if next_index < len(sources):
+                    if pending:
+                        UPSTREAM_HEDGES.inc()
+                        logger.debug(f"Consulta de cobertura a '{sources[next_index].name}'")
+                    task = asyncio.ensure_future(self._fetch_source(sources[next_index]))
+                    pending[task] = sources[next_index]
+                    next_index += 1
+                if not pending:
+                    raise last_error or UpstreamError("sin fuentes configuradas")
+                
+                # Esperar a la última fuente consultada hasta su p95 (si queda otra a la cual pasar)
+                timeout = sources[next_index - 1].hedge_delay() if next_index < len(sources) else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    source = pending.pop(task)
+                    try:
+                        quotations = task.result()
+                    except UpstreamError as e:
+                        last_error = UpstreamError(f"{source.name}: {e}")
+                        continue
+                    source.wins += 1
+                    UPSTREAM_WINS.inc(source=source.name)
+                    return self._accept(quotations)
+        finally:
+            for task in pending:
+                if task.done() and not task.cancelled():
+                    task.exception()
+                else:
+                    task.cancel()
+    
+    def _accept(self, quotations: Optional[Dict[str, dict]]) -> Dict[str, dict]:
+        """Toma la respuesta ganadora (None = sin cambios respecto del cache)"""
+        if quotations is None:
+            return self._cached_quotations
+        merged = self._merge_fresher(quotations)
+        if merged is None:
+            return self._cached_quotations
+        self.version += 1
+        self.updated_at = time.time()
+        return merged
     
-    def format_single_quotation(self, quotation: dict) -> str:
+    @staticmethod
+    def _updated_at(quotation: dict) -> Optional[datetime]:
+        """Momento de actualización informado por la fuente (fechaActualizacion), si se puede leer"""
+        try:
+            return datetime.fromisoformat(quotation['fechaActualizacion'])
+        except (KeyError, TypeError, ValueError):
+            return None
+    
+    def _merge_fresher(self, quotations: Dict[str, dict]) -> Optional[Dict[str, dict]]:
         """
-        Formatea la cotización del dólar oficial para mostrar
+        Combina una respuesta con el cache descartando los mercados más viejos
         
-        Args:
-            quotation: Datos de la cotización
+        Un espejo atrasado que gana la consulta no debe volver atrás los precios
+        (falsos cambios y alertas disparadas con un precio viejo): cada mercado
+        se toma solo si su fechaActualizacion no es anterior a la del cache.
         
         Returns:
-            str: Mensaje formateado
+            Foto combinada, o None si no aporta nada nuevo
         """
-        if not quotation:
-            return "❌ No se pudo obtener la cotización"
+        cached = self._cached_quotations
+        if cached is None:
+            return quotations
+        merged = dict(cached)
+        changed = False
+        stale = []
+        for market, quotation in quotations.items():
+            previous = cached.get(market)
+            if previous is not None:
+                new_at, old_at = self._updated_at(quotation), self._updated_at(previous)
+                if new_at is not None and old_at is not None and new_at < old_at:
+                    stale.append(market)
+                    continue
+            if quotation != previous:
+                merged[market] = quotation
+                changed = True
+        if stale:
+            logger.debug(f"Cotizaciones más viejas que las del cache ignoradas: {', '.join(stale)}")
+        return merged if changed else None
+    
+    async def _fetch_source(self, source: UpstreamSource) -> Optional[Dict[str, dict]]:
+        """
+        Consulta una fuente y registra su latencia y sus errores
         
-        # Extraer datos
-        compra = quotation.get('compra', 'N/A')
-        venta = quotation.get('venta', 'N/A')
-        fecha_actualizacion = quotation.get('fechaActualizacion', 'N/A')
+        Returns:
+            Cotizaciones de la fuente, o None si no cambiaron desde su respuesta
+            anterior (304 o mismo contenido)
         
-        # Formatear precios
-        if compra != 'N/A':
-            compra = f"${compra:,.2f}"
-        if venta != 'N/A':
-            venta = f"${venta:,.2f}"
+        Raises:
+            UpstreamError: Si la fuente no respondió correctamente
+        """
+        source.requests += 1
+        UPSTREAM_REQUESTS.inc(source=source.name)
+        started = time.monotonic()
+        try:
+            result = await self._request_source(source)
+        except UpstreamError:
+            source.record_failure()
+            UPSTREAM_ERRORS.inc(source=source.name)
+            raise
+        except asyncio.CancelledError:
+            # Perdió contra otra fuente: tardó al menos esto
+            source.record_latency(time.monotonic() - started)
+            raise
+        source.record_success(time.monotonic() - started)
+        return result
+    
+    async def _request_source(self, source: UpstreamSource) -> Optional[Dict[str, dict]]:
+        """Hace la consulta HTTP a una fuente y valida la respuesta (ver _fetch_source)"""
+        try:
+            session = await self._get_session()
+            headers = {}
+            if source.etag:
+                headers['If-None-Match'] = source.etag
+            if source.last_modified:
+                headers['If-Modified-Since'] = source.last_modified
+            
+            async with session.get(source.endpoint, headers=headers) as response:
+                if response.status == 304 and self._cached_quotations is not None:
+                    # Sin cambios según el servidor: no hay cuerpo que descargar
+                    return None
+                if response.status == 200:
+                    body = await response.read()
+                    body_hash = hashlib.blake2b(body, digest_size=16).digest()
+                    if body_hash == source.body_hash and self._cached_quotations is not None:
+                        # Mismo contenido que la respuesta anterior de esta fuente (ya combinada): no decodificar
+                        quotations = None
+                    else:
+                        data = json.loads(body)
+                        quotations = {item['casa']: item for item in data if item.get('casa')}
+                        if not quotations:
+                            raise UpstreamError("respuesta sin cotizaciones")
+                    source.etag = response.headers.get('ETag')
+                    source.last_modified = response.headers.get('Last-Modified')
+                    source.body_hash = body_hash
+                    return quotations
+                raise UpstreamError(f"HTTP {response.status}")
+        except UpstreamError:
+            raise
+        except asyncio.TimeoutError:
+            raise UpstreamError("tiempo de espera agotado")
+        except Exception as e:
+            raise UpstreamError(str(e) or type(e).__name__)
+    
+    async def get_all_quotations(self) -> dict:
+        """
+        Obtiene las cotizaciones de todos los mercados
         
-        # Formatear fecha actual
-        fecha_actual = datetime.now().strftime('%H:%M %d/%m/%Y')
+        Returns:
+            dict: Diccionario {casa: cotización}
+        """
+        quotations = await self.get_quotations()
+        return quotations or {}
+    
+    @staticmethod
+    def diff_quotations(old: Dict[str, dict], new: Dict[str, dict]) -> List[str]:
+        """
+        Compara dos fotos de mercados y devuelve los que cambiaron de precio
         
-        message = f"🏛️ <b>Dólar Oficial</b>\n\n"
-        message += f"🟢 <b>Compra:</b> {compra}\n"
-        message += f"🔴 <b>Venta:</b> {venta}\n"
-        message += f"🕐 <b>Actualizado:</b> {fecha_actual}"
+        Args:
+            old: Foto anterior {casa: cotización}
+            new: Foto nueva {casa: cotización}
         
-        return message
+        Returns:
+            List[str]: Mercados cuya compra o venta cambió (los nuevos no cuentan)
+        """
+        changed = []
+        for market, quotation in new.items():
+            previous = old.get(market)
+            if previous is None:
+                continue
+            if (quotation.get('compra', 0) != previous.get('compra', 0)
+                    or quotation.get('venta', 0) != previous.get('venta', 0)):
+                changed.append(market)
+        return changed
     
-    def format_all_quotations(self, quotations: dict) -> str:
+    @staticmethod
+    def resolve_market(name: str) -> Optional[str]:
         """
-        Formatea la cotización del dólar oficial para mostrar
+        Convierte lo que escribió el usuario en una clave de mercado
         
         Args:
-            quotations: Diccionario con la cotización oficial
+            name: Nombre o alias del mercado (ej. "blue", "mep", "ccl")
         
         Returns:
-            str: Mensaje formateado con la cotización
+            str: Clave del mercado o None si no existe
+        """
+        name = name.strip().lower()
+        name = MARKET_ALIASES.get(name, name)
+        return name if name in MARKETS else None
+    
+    @staticmethod
+    def get_market_name(market: str, quotation: Optional[dict] = None) -> str:
+        """Devuelve el nombre para mostrar de un mercado"""
+        if market in MARKETS:
+            return MARKETS[market]
+        if quotation and quotation.get('nombre'):
+            return f"Dólar {quotation['nombre']}"
+        return f"Dólar {market}"
+    
+    @staticmethod
+    def format_price(value) -> str:
+        """Formatea un precio (o N/A si no viene)"""
+        if value in ('N/A', None):
+            return 'N/A'
+        return f"${value:,.2f}"
+    
+    @staticmethod
+    def format_date(timestamp: Optional[float]) -> str:
+        """Formatea el momento de actualización (ahora si no se indica)"""
+        moment = datetime.fromtimestamp(timestamp) if timestamp else datetime.now()
+        return moment.strftime('%H:%M %d/%m/%Y')
+    
+    def format_single_quotation(self, quotation: dict, updated_at: Optional[float] = None) -> str:
         """
-        if not quotations or 'oficial' not in quotations:
-            return "❌ No se pudo obtener la cotización del dólar oficial"
+        Formatea la cotización de un mercado para mostrar
         
-        quotation = quotations['oficial']
+        Args:
+            quotation: Datos de la cotización
+            updated_at: Momento en que se obtuvo la cotización (por defecto, ahora)
         
-        # Extraer datos
-        compra = quotation.get('compra', 'N/A')
-        venta = quotation.get('venta', 'N/A')
-        fecha_actualizacion = quotation.get('fechaActualizacion', 'N/A')
+        Returns:
+            str: Mensaje formateado
+        """
+        if not quotation:
+            return "❌ No se pudo obtener la cotización"
         
-        # Formatear precios
-        if compra != 'N/A':
-            compra = f"${compra:,.2f}"
-        if venta != 'N/A':
-            venta = f"${venta:,.2f}"
+        return TEMPLATES['quotation_single'].render(
+            name=self.get_market_name(quotation.get('casa', DEFAULT_MARKET), quotation),
+            compra=self.format_price(quotation.get('compra')),
+            venta=self.format_price(quotation.get('venta')),
+            fecha=self.format_date(updated_at)
+        )
+    
+    def format_all_quotations(self, quotations: dict, updated_at: Optional[float] = None) -> str:
+        """
+        Formatea las cotizaciones de todos los mercados para mostrar
         
-        # Formatear fecha actual
-        fecha_actual = datetime.now().strftime('%H:%M %d/%m/%Y')
+        Args:
+            quotations: Diccionario {casa: cotización}
+            updated_at: Momento en que se obtuvieron las cotizaciones (por defecto, ahora)
         
-        message = "🏛️ <b>COTIZACIÓN DÓLAR OFICIAL</b>\n"
-        message += f"🕐 <i>Actualizado: {fecha_actual}</i>\n\n"
-        message += f"🟢 <b>Compra:</b> {compra}\n"
-        message += f"🔴 <b>Venta:</b> {venta}\n"
-        message += f"🕐 <b>Última actualización API:</b> {fecha_actualizacion}"
+        Returns:
+            str: Mensaje formateado con las cotizaciones
+        """
+        if not quotations:
+            return "❌ No se pudieron obtener las cotizaciones del dólar"
         
-        return message
+        parts = [TEMPLATES['quotation_all_header'].render(fecha=self.format_date(updated_at))]
+        item = TEMPLATES['quotation_all_item']
+        for market, quotation in quotations.items():
+            parts.append(item.render(
+                name=self.get_market_name(market, quotation),
+                compra=self.format_price(quotation.get('compra')),
+                venta=self.format_price(quotation.get('venta'))
+            ))
+        return ''.join(parts)
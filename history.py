@@ -0,0 +1,300 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+from cache_manager import atomic_write_bytes
+from config import HISTORY_DIR, HISTORY_CAPACITY, HISTORY_SAMPLE_INTERVAL, HISTORY_FLUSH_INTERVAL
+
+# Configurar logger para el historial
+logger = logging.getLogger(__name__)
+
+# Ventanas tipo "30m", "24h", "7d"
+WINDOW_PATTERN = re.compile(r'^(\d+)([mhd])$')
+WINDOW_UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+
+def parse_window(text: str) -> Optional[int]:
+    """
+    Convierte una ventana como "24h" o "7d" a segundos
+
+    Returns:
+        int: Segundos o None si el texto no es válido
+    """
+    match = WINDOW_PATTERN.match(text.strip().lower())
+    if not match or int(match.group(1)) <= 0:
+        return None
+    return int(match.group(1)) * WINDOW_UNITS[match.group(2)]
+
+class RingSeries:
+    """Buffer circular de (timestamp, compra, venta) en arrays tipados de float64"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.ts = array('d', bytes(8 * capacity))
+        self.compra = array('d', bytes(8 * capacity))
+        self.venta = array('d', bytes(8 * capacity))
+        self.start = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _physical(self, index: int) -> int:
+        """Convierte un índice lógico (0 = más viejo) en posición del array"""
+        return (self.start + index) % self.capacity
+
+    def append(self, timestamp: float, compra: float, venta: float):
+        """Agrega una muestra, pisando la más vieja si el buffer está lleno"""
+        if self.count < self.capacity:
+            position = self._physical(self.count)
+            self.count += 1
+        else:
+            position = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.ts[position] = timestamp
+        self.compra[position] = compra
+        self.venta[position] = venta
+
+    def last(self) -> Optional[Tuple[float, float, float]]:
+        """Devuelve la muestra más reciente"""
+        if not self.count:
+            return None
+        position = self._physical(self.count - 1)
+        return self.ts[position], self.compra[position], self.venta[position]
+
+    def _bisect(self, timestamp: float) -> int:
+        """Primer índice lógico con timestamp >= al indicado"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.ts[self._physical(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def at(self, timestamp: float) -> Optional[Tuple[float, float, float]]:
+        """Devuelve la última muestra tomada en el momento indicado o antes"""
+        index = self._bisect(timestamp)
+        if index < self.count and self.ts[self._physical(index)] == timestamp:
+            index += 1
+        if index == 0:
+            return None
+        position = self._physical(index - 1)
+        return self.ts[position], self.compra[position], self.venta[position]
+
+    def _slice(self, values: array, first: int, last: int) -> array:
+        """Copia el rango lógico [first, last) en orden cronológico"""
+        if first >= last:
+            return array('d')
+        begin = self._physical(first)
+        end = begin + (last - first)
+        if end <= self.capacity:
+            return values[begin:end]
+        return values[begin:] + values[:end - self.capacity]
+
+    def window(self, since: float) -> Tuple[array, array, array]:
+        """
+        Devuelve las muestras desde el momento indicado
+
+        Returns:
+            Tupla de arrays (timestamps, compra, venta) en orden cronológico
+        """
+        first = self._bisect(since)
+        return (self._slice(self.ts, first, self.count),
+                self._slice(self.compra, first, self.count),
+                self._slice(self.venta, first, self.count))
+
+    def to_bytes(self) -> bytes:
+        """Serializa las muestras en orden cronológico"""
+        return b''.join(values.tobytes() for values in self.window(float('-inf')))
+
+    @classmethod
+    def from_bytes(cls, capacity: int, data: bytes) -> 'RingSeries':
+        """Reconstruye la serie a partir de to_bytes()"""
+        series = cls(capacity)
+        values = array('d')
+        values.frombytes(data[:len(data) - len(data) % 24])
+        count = len(values) // 3
+        keep = min(count, capacity)
+        # Copiar los arrays completos (sin recorrer muestra por muestra)
+        for target, offset in ((series.ts, 0), (series.compra, count), (series.venta, 2 * count)):
+            target[:keep] = values[offset + count - keep:offset + count]
+        series.count = keep
+        return series
+
+class QuotationHistory:
+    """Historial de cotizaciones por mercado con estadísticas por ventana"""
+
+    def __init__(self, history_dir: str = HISTORY_DIR, capacity: int = HISTORY_CAPACITY,
+                 sample_interval: float = HISTORY_SAMPLE_INTERVAL):
+        """
+        Args:
+            history_dir: Directorio donde se guarda una serie binaria por mercado
+            capacity: Muestras máximas por mercado (las más viejas se descartan)
+            sample_interval: Segundos mínimos entre muestras sin cambio de precio
+        """
+        self.history_dir = history_dir
+        self.capacity = capacity
+        self.sample_interval = sample_interval
+        self.series: Dict[str, RingSeries] = {}
+        self.dirty = False
+        self._load()
+
+    def _path(self, market: str) -> str:
+        """Archivo de la serie de un mercado"""
+        return os.path.join(self.history_dir, f"{market}.bin")
+
+    def _load(self):
+        """Carga las series guardadas en disco"""
+        if not os.path.isdir(self.history_dir):
+            return
+        for filename in os.listdir(self.history_dir):
+            if not filename.endswith('.bin'):
+                continue
+            market = filename[:-4]
+            try:
+                with open(self._path(market), 'rb') as f:
+                    self.series[market] = RingSeries.from_bytes(self.capacity, f.read())
+            except OSError as e:
+                logger.error(f"No se pudo leer el historial de {market}: {e}")
+
+    def record(self, market: str, quotation: dict, timestamp: Optional[float] = None) -> bool:
+        """
+        Registra una cotización observada
+
+        Solo se guarda si el precio cambió o pasó sample_interval desde la última muestra.
+
+        Returns:
+            bool: True si se agregó una muestra
+        """
+        compra, venta = quotation.get('compra'), quotation.get('venta')
+        if compra is None or venta is None:
+            return False
+        timestamp = time.time() if timestamp is None else timestamp
+        series = self.series.get(market)
+        if series is None:
+            series = self.series[market] = RingSeries(self.capacity)
+        last = series.last()
+        if last is not None:
+            last_ts, last_compra, last_venta = last
+            unchanged = last_compra == compra and last_venta == venta
+            if unchanged and timestamp - last_ts < self.sample_interval:
+                return False
+        series.append(timestamp, float(compra), float(venta))
+        self.dirty = True
+        return True
+
+    def record_snapshot(self, quotations: Dict[str, dict], timestamp: Optional[float] = None):
+        """Registra la foto de todos los mercados"""
+        timestamp = time.time() if timestamp is None else timestamp
+        for market, quotation in quotations.items():
+            self.record(market, quotation, timestamp)
+
+    def get_window(self, market: str, seconds: float, now: Optional[float] = None) -> Tuple[array, array, array]:
+        """
+        Devuelve las muestras de un mercado en la ventana indicada
+
+        Returns:
+            Tupla de arrays (timestamps, compra, venta)
+        """
+        series = self.series.get(market)
+        if series is None:
+            return array('d'), array('d'), array('d')
+        now = time.time() if now is None else now
+        return series.window(now - seconds)
+
+    def get_value_at(self, market: str, timestamp: float) -> Optional[Tuple[float, float, float]]:
+        """
+        Devuelve la cotización vigente de un mercado en un momento dado
+
+        Returns:
+            Tupla (timestamp, compra, venta) de la última muestra a esa hora, o None si no hay
+        """
+        series = self.series.get(market)
+        return series.at(timestamp) if series is not None else None
+
+    def get_stats(self, market: str, seconds: float, now: Optional[float] = None) -> Optional[Dict]:
+        """
+        Calcula mínimo, máximo, promedio y variación en la ventana indicada
+
+        Returns:
+            Dict con las estadísticas de compra y venta, o None si no hay muestras
+        """
+        ts, compra, venta = self.get_window(market, seconds, now)
+        if not ts:
+            return None
+        stats = {'samples': len(ts), 'from': ts[0], 'to': ts[-1]}
+        for name, values in (('compra', compra), ('venta', venta)):
+            first, last = values[0], values[-1]
+            stats[name] = {
+                'min': min(values),
+                'max': max(values),
+                'avg': sum(values) / len(values),
+                'first': first,
+                'last': last,
+                'change_pct': (last - first) / first * 100 if first else 0.0
+            }
+        return stats
+
+    def get_changes(self, market: str, seconds: float, limit: int = 10,
+                    now: Optional[float] = None) -> List[Tuple[float, float, float]]:
+        """
+        Devuelve los últimos cambios de precio de la ventana indicada
+
+        Returns:
+            Lista de (timestamp, compra, venta), del más viejo al más nuevo
+        """
+        ts, compra, venta = self.get_window(market, seconds, now)
+        changes = []
+        previous = None
+        for point in zip(ts, compra, venta):
+            if previous is None or point[1:] != previous[1:]:
+                changes.append(point)
+            previous = point
+        return changes[-limit:]
+
+    def flush(self) -> bool:
+        """
+        Guarda las series en disco si hubo muestras nuevas
+
+        Returns:
+            bool: True si se escribió
+        """
+        if not self.dirty:
+            return False
+        snapshot = self._take_snapshot()
+        try:
+            self._write_snapshot(snapshot)
+            return True
+        except Exception as e:
+            logger.error(f"Error al guardar historial: {e}")
+            self.dirty = True
+            return False
+
+    async def run_flush_loop(self, interval: float = HISTORY_FLUSH_INTERVAL):
+        """Loop que guarda el historial periódicamente"""
+        while True:
+            await asyncio.sleep(interval)
+            if not self.dirty:
+                continue
+            # Serializar en el loop y escribir en otro hilo
+            snapshot = self._take_snapshot()
+            try:
+                await asyncio.to_thread(self._write_snapshot, snapshot)
+            except Exception as e:
+                logger.error(f"Error al guardar historial: {e}")
+                self.dirty = True
+
+    def _take_snapshot(self) -> Dict[str, bytes]:
+        """Serializa las series y marca el historial como guardado"""
+        self.dirty = False
+        return {market: series.to_bytes() for market, series in self.series.items()}
+
+    def _write_snapshot(self, snapshot: Dict[str, bytes]):
+        """Escribe en disco una foto serializada de las series"""
+        os.makedirs(self.history_dir, exist_ok=True)
+        for market, data in snapshot.items():
+            atomic_write_bytes(self._path(market), data)
@@ -0,0 +1,105 @@
+import logging
+from typing import Dict, List, Optional
+from telegram import InlineQueryResultArticle, InputTextMessageContent
+from config import MARKET_ALIASES, INLINE_CACHE_TIME
+
+# Configurar logger para las respuestas inline
+logger = logging.getLogger(__name__)
+
+# Clave de la respuesta con todos los mercados
+ALL = 'todos'
+
+class InlineResults:
+    """
+    Respuestas a consultas inline (@bot ...) armadas de antemano
+
+    Se reconstruyen solo cuando cambia la versión de la cotización; cada
+    consulta se responde con una búsqueda en un diccionario, sin ir a la API.
+    """
+
+    def __init__(self, dolar_service, cache_time: int = INLINE_CACHE_TIME):
+        """
+        Args:
+            dolar_service: Servicio de cotizaciones (para nombres y formato)
+            cache_time: Segundos que Telegram puede guardar cada respuesta
+        """
+        self.dolar_service = dolar_service
+        self.cache_time = cache_time
+        self.version = None
+        # {texto consultado o prefijo: resultados}
+        self._results: Dict[str, List[InlineQueryResultArticle]] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.version is not None
+
+    def rebuild(self, quotations: Dict[str, dict], version, updated_at: Optional[float] = None):
+        """
+        Arma todas las respuestas para una foto de cotizaciones
+
+        Args:
+            quotations: Diccionario {casa: cotización}
+            version: Versión de la cotización (se usa en los ids de los resultados)
+            updated_at: Momento en que se obtuvo la cotización
+        """
+        if version == self.version or not quotations:
+            return
+        service = self.dolar_service
+        articles = {
+            market: InlineQueryResultArticle(
+                id=f'{version}:{market}',
+                title=service.get_market_name(market, quotation),
+                description=(f"Compra {service.format_price(quotation.get('compra'))} · "
+                             f"Venta {service.format_price(quotation.get('venta'))}"),
+                input_message_content=InputTextMessageContent(
+                    service.format_single_quotation(quotation, updated_at), parse_mode='HTML'
+                )
+            )
+            for market, quotation in quotations.items()
+        }
+        articles[ALL] = InlineQueryResultArticle(
+            id=f'{version}:{ALL}',
+            title='Todas las cotizaciones',
+            description=', '.join(service.get_market_name(market, quotation) for market, quotation in quotations.items()),
+            input_message_content=InputTextMessageContent(
+                service.format_all_quotations(quotations, updated_at), parse_mode='HTML'
+            )
+        )
+
+        # Términos que identifican a cada resultado: clave, alias y palabras del nombre
+        terms: Dict[str, List[str]] = {ALL: [ALL]}
+        for market, quotation in quotations.items():
+            names = [market] + [alias for alias, target in MARKET_ALIASES.items() if target == market]
+            names += service.get_market_name(market, quotation).lower().split()
+            terms[market] = names
+
+        results: Dict[str, List[InlineQueryResultArticle]] = {'': [articles[ALL]] + [
+            article for market, article in articles.items() if market != ALL
+        ]}
+        for key in articles:
+            for term in terms[key]:
+                for end in range(1, len(term) + 1):
+                    matches = results.setdefault(term[:end], [])
+                    if articles[key] not in matches:
+                        matches.append(articles[key])
+
+        self._results = results
+        self.version = version
+        logger.info(f"🔎 Respuestas inline actualizadas ({len(articles)} resultados, versión {version})")
+
+    def get(self, query: str) -> List[InlineQueryResultArticle]:
+        """
+        Resultados para el texto consultado
+
+        Args:
+            query: Texto escrito después de @bot
+
+        Returns:
+            Lista de resultados (vacía si no coincide ningún mercado)
+        """
+        query = query.strip().lower()
+        results = self._results.get(query)
+        if results is None and ' ' in query:
+            # "dolar blue": buscar por la última palabra
+            results = self._results.get(query.rsplit(' ', 1)[1])
+        return results or []
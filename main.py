@@ -1,15 +1,37 @@
+import time
+# Inicio del arranque (para el reporte de tiempos)
+STARTUP_STARTED = time.perf_counter()
 import logging
 import asyncio
-import time
+import functools
+import signal
+from typing import Dict, List, Optional, Set, Tuple
 from telegram import Update
-from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, ConversationHandler, InlineQueryHandler, MessageHandler, TypeHandler, filters, ContextTypes
 from dolar_service import DolarService
 from user_config import UserConfig
 from cache_manager import CacheManager
-from config import BOT_TOKEN, CHAT_ID, AUTO_SEND_INTERVAL, MESSAGES
+from dispatcher import BroadcastDispatcher
+from storage import create_storage, migrate_json_to_sqlite
+from scheduler import DueScheduler
+from renderer import MessageRenderer, TEMPLATES
+from history import QuotationHistory, parse_window
+from digest import digest_window, next_digest_due, build_digest_message
+from alerts import AlertIndex, UP, DOWN
+from inline_results import InlineResults
+from rate_limiter import CommandRateLimiter
+from outbox import Outbox, OutboxEntry
+from background_writer import BackgroundWriter
+from update_processor import PerUserUpdateProcessor
+from profiler import Profiler, StartupTimer, timed, measure, get_timings
+from metrics import CHANGES_DETECTED, SCHEDULER_LAG, ACTIVE_SUBSCRIBERS, CACHE_DIRTY_AGE, COMMANDS_THROTTLED
+from config import BOT_TOKEN, CHAT_ID, AUTO_SEND_INTERVAL, MESSAGES, MARKETS, DEFAULT_MARKET, CACHE_WRITE_BEHIND, CACHE_FLUSH_INTERVAL, POLL_INTERVAL
+from config import BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, PORT, RUN_MODE
+from config import ADMIN_IDS, PROFILE_DEFAULT_SECONDS, UPDATE_CONCURRENCY, DIGEST_MIN_MINUTES, DIGEST_MAX_MINUTES
 
 # Estados de la conversación
 WAITING_MINUTES = 1
+WAITING_DIGEST = 2
 
 # Configurar logging profesional
 logging.basicConfig(
@@ -23,10 +45,83 @@ logger = logging.getLogger(__name__)
 logging.getLogger('aiohttp').setLevel(logging.WARNING)
 logging.getLogger('telegram').setLevel(logging.WARNING)
 
-# Inicializar servicios
+# Etapas del arranque que se informan en el log
+startup_timer = StartupTimer(STARTUP_STARTED, expected=('accepting_updates', 'scheduler_ready', 'first_poll'))
+startup_timer.mark('imports')
+
+# Inicializar servicios (los stores de usuarios y cache se cargan en segundo plano)
 dolar_service = DolarService()
-user_config = UserConfig()
-cache_manager = CacheManager()
+storage = create_storage()
+# Las escrituras de configuraciones y alertas no bloquean el event loop
+store_writer = BackgroundWriter()
+user_config = UserConfig(storage=storage, lazy=True, writer=store_writer)
+cache_manager = CacheManager(write_behind=CACHE_WRITE_BEHIND, flush_interval=CACHE_FLUSH_INTERVAL, storage=storage, lazy=True)
+broadcast_dispatcher = BroadcastDispatcher()
+due_scheduler = DueScheduler()
+message_renderer = MessageRenderer()
+quotation_history = QuotationHistory()
+alert_index = AlertIndex(writer=store_writer, lazy=True)
+inline_results = InlineResults(dolar_service)
+command_limiter = CommandRateLimiter()
+profiler = Profiler()
+outbox = Outbox(writer=store_writer)
+# Las entradas del outbox se cierran cuando el cache guarda las entregas que registran
+cache_manager.on_flushed = outbox.on_cache_flushed
+# Workers de envío en procesos aparte (solo con RUN_MODE=sharded)
+sharded_dispatch = None
+if RUN_MODE == 'sharded':
+    from shard_worker import ShardedDispatch
+    # Los envíos de los workers se guardan acá, por user_id
+    sharded_dispatch = ShardedDispatch(on_sent=cache_manager.set_users_last_sent)
+startup_timer.mark('services')
+
+# Se activa cuando warm_up() termina de cargar los stores (o falla)
+stores_ready = asyncio.Event()
+
+def needs_stores(handler):
+    """
+    Hace esperar al handler hasta que terminen de cargarse los stores
+    
+    La espera es sobre el event loop, así los demás updates se siguen
+    atendiendo mientras un store grande se carga por tandas (y ningún
+    handler lo usa a medio cargar).
+    """
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not stores_ready.is_set():
+            await stores_ready.wait()
+        return await handler(update, context)
+    
+    return wrapper
+
+# Difusiones lanzadas en segundo plano (se guarda la referencia hasta que terminan)
+background_tasks: Set[asyncio.Task] = set()
+
+def spawn(coroutine) -> asyncio.Task:
+    """Lanza una tarea en segundo plano sin que el recolector la descarte a mitad de camino"""
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Gauges que se calculan al exportar las métricas
+ACTIVE_SUBSCRIBERS.set_function(lambda: user_config.count_active() if user_config.is_loaded else float('nan'))
+CACHE_DIRTY_AGE.set_function(lambda: time.time() - cache_manager.dirty_since if cache_manager.dirty_since else 0)
+
+async def throttle(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Corre antes que todos los handlers: aplica el límite por usuario y el global de salida"""
+    user = update.effective_user
+    if user is None or update.inline_query is not None:
+        # Las consultas inline salen de respuestas ya armadas y Telegram las guarda (cache_time)
+        return
+    if command_limiter.allow(user.id):
+        # La respuesta comparte el límite global de mensajes con las difusiones
+        await broadcast_dispatcher.global_bucket.acquire()
+        return
+    COMMANDS_THROTTLED.inc()
+    if update.effective_message is not None and command_limiter.should_warn(user.id):
+        await update.effective_message.reply_text(MESSAGES['rate_limited'])
+    raise ApplicationHandlerStop
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Maneja el comando /start"""
@@ -37,11 +132,33 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     await update.message.reply_text(MESSAGES['help'])
 
 async def cotizacion(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Maneja el comando /cotizacion - muestra la cotización del dólar oficial"""
+    """Maneja el comando /cotizacion [mercado|todos] - muestra la cotización del dólar"""
     try:
-        quotation = await dolar_service.get_quotation()
+        argument = context.args[0].lower() if context.args else DEFAULT_MARKET
+        if argument == 'todos':
+            quotations = await dolar_service.get_all_quotations()
+            if quotations:
+                message = message_renderer.get(
+                    dolar_service.version, 'all',
+                    lambda: dolar_service.format_all_quotations(quotations, dolar_service.updated_at)
+                )
+                await update.message.reply_text(message, parse_mode='HTML')
+            else:
+                await update.message.reply_text(MESSAGES['no_data'])
+            return
+        
+        market = dolar_service.resolve_market(argument)
+        if market is None:
+            await update.message.reply_text(TEMPLATES['market_unknown'].render(markets=MARKET_LIST))
+            return
+        
+        quotation = await dolar_service.get_quotation(market)
         if quotation:
-            message = dolar_service.format_single_quotation(quotation)
+            # Se renderiza una vez por versión de la cotización y se comparte entre usuarios
+            message = message_renderer.get(
+                dolar_service.version, f'single:{market}',
+                lambda: dolar_service.format_single_quotation(quotation, dolar_service.updated_at)
+            )
             await update.message.reply_text(message, parse_mode='HTML')
         else:
             await update.message.reply_text(MESSAGES['no_data'])
@@ -49,6 +166,269 @@ async def cotizacion(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         logger.error(f"Error en cotizacion: {e}")
         await update.message.reply_text(MESSAGES['error'])
 
+# Lista de mercados para los mensajes (se arma una sola vez)
+MARKET_LIST = "\n".join(f"• {market} - {name}" for market, name in MARKETS.items())
+
+def publish_user_config(user_id: int) -> None:
+    """En modo sharded, avisa al worker dueño del usuario que cambió su configuración"""
+    if sharded_dispatch is not None:
+        sharded_dispatch.publish_user(
+            user_id, user_config.get_user_config(user_id), cache_manager.get_user_last_sent(user_id)
+        )
+
+async def mercados(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Maneja el comando /mercados - lista los mercados y las suscripciones del usuario"""
+    user_id = update.effective_user.id
+    subscribed = user_config.get_user_markets(user_id)
+    message = TEMPLATES['markets_list'].render(
+        markets=MARKET_LIST,
+        subscribed=", ".join(subscribed) if subscribed else "ninguno"
+    )
+    await update.message.reply_text(message)
+
+async def suscribir(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Maneja el comando /suscribir <mercado> - agrega un mercado al monitoreo"""
+    user_id = update.effective_user.id
+    market = dolar_service.resolve_market(context.args[0]) if context.args else None
+    if market is None:
+        await update.message.reply_text(TEMPLATES['market_unknown'].render(markets=MARKET_LIST))
+        return
+    
+    markets = user_config.get_user_markets(user_id)
+    if not markets:
+        await update.message.reply_text(MESSAGES['no_config'])
+        return
+    if market not in markets:
+        markets.append(market)
+        user_config.set_user_markets(user_id, markets)
+        publish_user_config(user_id)
+        logger.info(f"Usuario {user_id} se suscribió al mercado {market}")
+    
+    await update.message.reply_text(TEMPLATES['subscribe_success'].render(
+        market=MARKETS[market], subscribed=", ".join(markets)
+    ))
+
+async def desuscribir(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Maneja el comando /desuscribir <mercado> - quita un mercado del monitoreo"""
+    user_id = update.effective_user.id
+    market = dolar_service.resolve_market(context.args[0]) if context.args else None
+    if market is None:
+        await update.message.reply_text(TEMPLATES['market_unknown'].render(markets=MARKET_LIST))
+        return
+    
+    markets = user_config.get_user_markets(user_id)
+    if market not in markets:
+        await update.message.reply_text(TEMPLATES['unsubscribe_missing'].render(market=MARKETS[market]))
+        return
+    if len(markets) == 1:
+        await update.message.reply_text(MESSAGES['unsubscribe_last'])
+        return
+    
+    markets.remove(market)
+    user_config.set_user_markets(user_id, markets)
+    publish_user_config(user_id)
+    logger.info(f"Usuario {user_id} se desuscribió del mercado {market}")
+    await update.message.reply_text(TEMPLATES['unsubscribe_success'].render(
+        market=MARKETS[market], subscribed=", ".join(markets)
+    ))
+
+def parse_history_args(args: List[str], default_window: str) -> Optional[Tuple[str, str, int]]:
+    """
+    Interpreta los argumentos de /historial y /stats ([mercado] [ventana])
+    
+    Returns:
+        Tupla (mercado, ventana, segundos) o None si no son válidos
+    """
+    market, window = DEFAULT_MARKET, default_window
+    for arg in args[:2]:
+        if parse_window(arg) is not None:
+            window = arg.lower()
+        else:
+            market = dolar_service.resolve_market(arg)
+            if market is None:
+                return None
+    return market, window, parse_window(window)
+
+async def historial(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Maneja el comando /historial [mercado] [ventana] - muestra los últimos cambios de precio"""
+    parsed = parse_history_args(context.args or [], '24h')
+    if parsed is None:
+        await update.message.reply_text(MESSAGES['history_usage'])
+        return
+    market, window, seconds = parsed
+    
+    changes = quotation_history.get_changes(market, seconds)
+    if not changes:
+        await update.message.reply_text(MESSAGES['history_empty'])
+        return
+    
+    message = TEMPLATES['history_header'].render(name=MARKETS[market], window=window)
+    message += "".join(
+        TEMPLATES['history_item'].render(
+            fecha=dolar_service.format_date(timestamp),
+            compra=dolar_service.format_price(compra),
+            venta=dolar_service.format_price(venta)
+        )
+        for timestamp, compra, venta in changes
+    )
+    await update.message.reply_text(message, parse_mode='HTML')
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Maneja el comando /stats [mercado] [ventana] - muestra estadísticas de la ventana"""
+    parsed = parse_history_args(context.args or [], '7d')
+    if parsed is None:
+        await update.message.reply_text(MESSAGES['history_usage'])
+        return
+    market, window, seconds = parsed
+    
+    result = quotation_history.get_stats(market, seconds)
+    if result is None:
+        await update.message.reply_text(MESSAGES['history_empty'])
+        return
+    
+    values = {'name': MARKETS[market], 'window': window, 'samples': result['samples']}
+    for side in ('compra', 'venta'):
+        side_stats = result[side]
+        values[f'{side}_min'] = dolar_service.format_price(side_stats['min'])
+        values[f'{side}_max'] = dolar_service.format_price(side_stats['max'])
+        values[f'{side}_avg'] = dolar_service.format_price(side_stats['avg'])
+        values[f'{side}_change'] = f"{side_stats['change_pct']:+.2f}%"
+    await update.message.reply_text(TEMPLATES['stats'].render(**values), parse_mode='HTML')
+
+# Textos de cada dirección de alerta: al crearla, al listarla y al dispararse
+ALERT_DIRECTION_TEXT = {
+    UP: {'set': 'suba a', 'item': '≥', 'fired': 'subió a'},
+    DOWN: {'set': 'baje a', 'item': '≤', 'fired': 'bajó a'},
+}
+
+def parse_price(text: str) -> Optional[float]:
+    """Convierte un precio escrito por el usuario (ej. "1100" o "1250,50")"""
+    try:
+        price = float(text.replace('$', '').replace(',', '.'))
+    except ValueError:
+        return None
+    return price if price > 0 else None
+
+async def alerta(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Maneja el comando /alerta [mercado] <precio> - avisa cuando la venta cruce un precio"""
+    user_id = update.effective_user.id
+    args = context.args or []
+    
+    if not args:
+        alerts = alert_index.get_user_alerts(user_id)
+        if not alerts:
+            await update.message.reply_text(MESSAGES['alert_none'])
+            return
+        items = "".join(
+            TEMPLATES['alert_item'].render(
+                name=MARKETS.get(market, market),
+                direction=ALERT_DIRECTION_TEXT[direction]['item'],
+                precio=dolar_service.format_price(threshold)
+            )
+            for market, direction, threshold in alerts
+        )
+        await update.message.reply_text(TEMPLATES['alert_list'].render(alerts=items), parse_mode='HTML')
+        return
+    
+    if args[0].lower() == 'borrar':
+        count = alert_index.remove_user_alerts(user_id)
+        await update.message.reply_text(TEMPLATES['alert_cleared'].render(count=count))
+        return
+    
+    market = dolar_service.resolve_market(args[0]) if len(args) > 1 else DEFAULT_MARKET
+    price = parse_price(args[-1])
+    if market is None or price is None or len(args) > 2:
+        await update.message.reply_text(MESSAGES['alert_usage'])
+        return
+    
+    try:
+        quotation = await dolar_service.get_quotation(market)
+        current = quotation.get('venta') if quotation else None
+        if current is None:
+            await update.message.reply_text(MESSAGES['no_data'])
+            return
+        if price == current:
+            await update.message.reply_text(TEMPLATES['alert_same'].render(precio=dolar_service.format_price(price)))
+            return
+        
+        # La dirección sale de la posición del umbral respecto del precio actual
+        direction = UP if price > current else DOWN
+        if not alert_index.add_alert(user_id, market, direction, price):
+            await update.message.reply_text(TEMPLATES['alert_limit'].render(max=alert_index.max_per_user))
+            return
+        
+        logger.info(f"Usuario {user_id} creó alerta {market} {direction} {price}")
+        await update.message.reply_text(TEMPLATES['alert_set'].render(
+            name=MARKETS[market],
+            direction=ALERT_DIRECTION_TEXT[direction]['set'],
+            precio=dolar_service.format_price(price),
+            actual=dolar_service.format_price(current)
+        ))
+    except Exception as e:
+        logger.error(f"Error en alerta: {e}")
+        await update.message.reply_text(MESSAGES['error'])
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Responde @bot [mercado] con las respuestas ya armadas (sin consultar la API)"""
+    query = update.inline_query
+    if not inline_results.ready:
+        # Todavía no hubo una primera consulta: que Telegram no guarde la respuesta vacía
+        await query.answer([], cache_time=0)
+        return
+    await query.answer(inline_results.get(query.query), cache_time=inline_results.cache_time)
+
+def is_admin(user_id: int) -> bool:
+    """Indica si el usuario está en ADMIN_IDS"""
+    return user_id in ADMIN_IDS
+
+async def perfil(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Maneja el comando /perfil [segundos|parar] - tiempos por handler y captura con cProfile (solo admins)"""
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        await update.message.reply_text(MESSAGES['admin_only'])
+        return
+    
+    argument = context.args[0].lower() if context.args else None
+    if argument is None:
+        timings = "".join(
+            TEMPLATES['profile_timing'].render(
+                name=name, calls=calls, avg=f"{total / calls * 1000:.1f}", total=f"{total:.1f}"
+            )
+            for name, calls, total in get_timings()
+        )
+        status = f"activa (termina en {profiler.ends_at - time.time():.0f}s)" if profiler.active else "inactiva"
+        await update.message.reply_text(
+            TEMPLATES['profile_status'].render(status=status, timings=timings or "Sin datos todavía\n"),
+            parse_mode='HTML'
+        )
+        return
+    
+    if argument == 'parar':
+        if not profiler.active:
+            await update.message.reply_text(MESSAGES['profile_idle'])
+            return
+        # El aviso con la ruta del perfil lo envía el callback de la captura
+        profiler.stop()
+        return
+    
+    try:
+        seconds = float(argument)
+    except ValueError:
+        seconds = PROFILE_DEFAULT_SECONDS
+    if profiler.active:
+        await update.message.reply_text(TEMPLATES['profile_busy'].render(seconds=f"{profiler.ends_at - time.time():.0f}"))
+        return
+    
+    chat_id = update.effective_chat.id
+    
+    def on_done(path: Optional[str]) -> None:
+        text = TEMPLATES['profile_done'].render(path=path) if path else MESSAGES['profile_failed']
+        asyncio.create_task(context.bot.send_message(chat_id=chat_id, text=text))
+    
+    seconds = profiler.start(seconds, on_done)
+    logger.info(f"Usuario {user_id} inició una captura de perfil de {seconds:.0f}s")
+    await update.message.reply_text(TEMPLATES['profile_started'].render(seconds=f"{seconds:.0f}"))
+
 async def configurar_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Inicia el proceso de configuración"""
     await update.message.reply_text(MESSAGES['config_start'])
@@ -56,17 +436,16 @@ async def configurar_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
 async def configurar_minutes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Procesa los minutos ingresados por el usuario"""
-    user_id = update.effective_user.id
     user_input = update.message.text.strip()
     
     try:
         interval = int(user_input)
         
-        if user_config.set_user_config(user_id, interval):
-            message = MESSAGES['config_success'].format(minutes=interval)
-            await update.message.reply_text(message)
-            logger.info(f"Usuario {user_id} configuró envío automático cada {interval} segundos")
-            return ConversationHandler.END
+        if 5 <= interval <= 60:
+            # Se guarda al elegir el modo (cada cambio o resumen)
+            context.user_data['interval'] = interval
+            await update.message.reply_text(MESSAGES['config_digest'])
+            return WAITING_DIGEST
         else:
             await update.message.reply_text("❌ El intervalo debe estar entre 5 y 60 segundos (1 minuto)\n\n🔄 Intenta nuevamente:")
             return WAITING_MINUTES
@@ -75,6 +454,42 @@ async def configurar_minutes(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text(MESSAGES['config_error'])
         return WAITING_MINUTES
 
+def describe_mode(digest_minutes: int) -> str:
+    """Texto del modo de envío para /estado y /configurar"""
+    if digest_minutes:
+        return TEMPLATES['mode_digest'].render(minutes=digest_minutes)
+    return MESSAGES['mode_every_change']
+
+async def configurar_digest(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Procesa el modo elegido (0 = cada cambio, N = resumen cada N minutos) y guarda la configuración"""
+    user_id = update.effective_user.id
+    interval = context.user_data.get('interval')
+    try:
+        digest_minutes = int(update.message.text.strip())
+    except ValueError:
+        digest_minutes = -1
+    if digest_minutes != 0 and not DIGEST_MIN_MINUTES <= digest_minutes <= DIGEST_MAX_MINUTES:
+        await update.message.reply_text(TEMPLATES['config_digest_error'].render(
+            min=DIGEST_MIN_MINUTES, max=DIGEST_MAX_MINUTES
+        ))
+        return WAITING_DIGEST
+    
+    was_enabled = user_config.is_user_enabled(user_id)
+    if interval is None or not user_config.set_user_config(user_id, interval, digest_minutes=digest_minutes):
+        await update.message.reply_text(MESSAGES['config_error'])
+        return ConversationHandler.END
+    context.user_data.pop('interval', None)
+    if not was_enabled:
+        # Empieza al día: solo recibirá los cambios a partir de ahora
+        cache_manager.set_user_last_sent(user_id, time.time())
+    schedule_user(user_id, interval, digest_minutes=digest_minutes)
+    publish_user_config(user_id)
+    message = TEMPLATES['config_success'].render(minutes=interval, mode=describe_mode(digest_minutes))
+    await update.message.reply_text(message)
+    logger.info(f"Usuario {user_id} configuró envío automático cada {interval} segundos"
+                + (f" con resumen cada {digest_minutes} minutos" if digest_minutes else ""))
+    return ConversationHandler.END
+
 async def configurar_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancela el proceso de configuración"""
     await update.message.reply_text(MESSAGES['config_cancel'])
@@ -85,6 +500,8 @@ async def parar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     
     if user_config.disable_user_config(user_id):
+        due_scheduler.cancel(user_id)
+        publish_user_config(user_id)
         await update.message.reply_text(MESSAGES['stop_success'])
         logger.info(f"Usuario {user_id} detuvo envío automático")
     else:
@@ -97,88 +514,270 @@ async def estado(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     
     if config and config.get('enabled', False):
         status = "🟢 Activo"
-        message = MESSAGES['current_config'].format(
+        message = TEMPLATES['current_config'].render(
             minutes=config['interval_seconds'],
-            status=status
+            status=status,
+            markets=", ".join(user_config.get_user_markets(user_id)),
+            mode=describe_mode(config.get('digest_minutes', 0))
         )
     else:
         message = MESSAGES['no_config']
     
     await update.message.reply_text(message)
 
-async def send_auto_quotations_to_users(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Verifica cambios en cotización y envía solo cuando hay cambios"""
-    try:
-        # Obtener cotización actual
-        current_quotation = await dolar_service.get_quotation()
-        if not current_quotation:
-            logger.warning("No se pudo obtener cotización para verificación")
-            return
-        
-        # Obtener última cotización del cache
-        last_quotation = cache_manager.get_last_quotation()
-        
-        # Verificar si la cotización cambió
-        quotation_changed = False
-        if last_quotation is None:
-            # Primera vez, no enviar pero guardar la cotización
-            cache_manager.set_last_quotation(current_quotation)
-            logger.info("Primera cotización obtenida, monitoreo iniciado")
-            return
-        
-        # Comparar precios (compra y venta)
-        current_compra = current_quotation.get('compra', 0)
-        current_venta = current_quotation.get('venta', 0)
-        last_compra = last_quotation.get('compra', 0)
-        last_venta = last_quotation.get('venta', 0)
-        
-        if current_compra != last_compra or current_venta != last_venta:
-            quotation_changed = True
-            logger.info(f"¡Cambio detectado! Compra: {last_compra} → {current_compra}, Venta: {last_venta} → {current_venta}")
-            cache_manager.set_last_quotation(current_quotation)  # Actualizar cotización en cache
-        
-        # Solo enviar si hubo cambio
-        if not quotation_changed:
-            return
+# Versión de la respuesta de la API que ya fue comparada con el cache
+last_checked_version = None
+
+async def check_quotation_change(context: Optional[ContextTypes.DEFAULT_TYPE] = None) -> List[str]:
+    """
+    Consulta todos los mercados y registra los que cambiaron respecto del cache
+    
+    Args:
+        context: Contexto con el bot para enviar las alertas de precio disparadas
+    
+    Returns:
+        List[str]: Mercados cuyo precio cambió (vacía si no hubo cambios)
+    """
+    global last_checked_version
+    
+    # Obtener cotizaciones actuales (siempre de la API; de paso refresca el cache de /cotizacion)
+    current_quotations = await dolar_service.get_quotations(force_refresh=True)
+    if not current_quotations:
+        logger.warning("No se pudo obtener cotización para verificación")
+        return []
+    
+    # Registrar la observación en el historial (muestreado, barato si no cambió)
+    quotation_history.record_snapshot(current_quotations)
+    
+    # Si la API devolvió exactamente lo mismo que antes, no hay nada que hacer
+    if dolar_service.version == last_checked_version:
+        return []
+    last_checked_version = dolar_service.version
+    inline_results.rebuild(current_quotations, dolar_service.version, dolar_service.updated_at)
+    
+    # Comparar cada mercado contra la última foto guardada
+    last_quotations = cache_manager.get_last_quotations()
+    changed_markets = dolar_service.diff_quotations(last_quotations, current_quotations)
+    new_markets = [market for market in current_quotations if market not in last_quotations]
+    
+    if new_markets:
+        # Primera vez que vemos estos mercados: guardar sin enviar
+        logger.info(f"Primera cotización obtenida para {', '.join(new_markets)}, monitoreo iniciado")
+    
+    if changed_markets or new_markets:
+        cache_manager.set_last_quotations({
+            market: current_quotations[market] for market in changed_markets + new_markets
+        })
+    
+    if changed_markets:
+        for market in changed_markets:
+            last, current = last_quotations[market], current_quotations[market]
+            CHANGES_DETECTED.inc(market=market)
+            logger.info(f"¡Cambio detectado en {market}! Compra: {last.get('compra')} → {current.get('compra')}, Venta: {last.get('venta')} → {current.get('venta')}")
+        change_time = time.time()
+        cache_manager.set_markets_change_time(changed_markets, change_time)
+        if sharded_dispatch is not None:
+            # Los workers se encargan de avisar a sus usuarios
+            sharded_dispatch.publish_change(
+                {market: current_quotations[market] for market in changed_markets}, change_time
+            )
+        elif user_config.is_loaded:
+            # Solo los suscriptores de estos mercados entran al planificador (antes de
+            # cargar los usuarios, schedule_active_users() los encuentra por el cambio)
+            schedule_market_subscribers(changed_markets, change_time)
         
+        # Extraer las alertas que cruzó cada movimiento de precio
+        triggered = {}
+        for market in changed_markets:
+            old_venta = last_quotations[market].get('venta')
+            new_venta = current_quotations[market].get('venta')
+            for user_id, direction, threshold in alert_index.pop_triggered(market, old_venta, new_venta):
+                triggered.setdefault((market, direction, threshold), []).append(user_id)
+        if triggered and context is not None:
+            # En segundo plano: una difusión grande de alertas no debe demorar el próximo sondeo
+            spawn(send_price_alerts(context, triggered, current_quotations))
+    
+    return changed_markets
+
+async def send_price_alerts(context: ContextTypes.DEFAULT_TYPE, triggered: Dict[Tuple[str, str, float], List[int]],
+                            quotations: Dict[str, dict]) -> None:
+    """
+    Envía las alertas de precio disparadas (un mensaje por mercado, dirección y umbral)
+    
+    Args:
+        context: Contexto con el bot
+        triggered: {(mercado, dirección, umbral): [user_id, ...]}
+        quotations: Cotizaciones actuales {casa: cotización}
+    """
+    try:
+        results = await asyncio.gather(*[
+            broadcast_dispatcher.broadcast(context.bot, user_ids, TEMPLATES['alert_triggered'].render(
+                name=MARKETS.get(market, market),
+                direction=ALERT_DIRECTION_TEXT[direction]['fired'],
+                precio=dolar_service.format_price(threshold),
+                venta=dolar_service.format_price(quotations[market].get('venta'))
+            ))
+            for (market, direction, threshold), user_ids in triggered.items()
+        ])
+        logger.info(f"🚨 Alertas de precio enviadas a {sum(len(group) for group in results)} usuarios")
+    except Exception as e:
+        logger.error(f"Error enviando alertas de precio: {e}")
+
+def pending_markets(user_id: int, markets: List[str]) -> Tuple[str, ...]:
+    """Mercados del usuario que cambiaron después de su último envío"""
+    last_sent_time = cache_manager.get_user_last_sent(user_id)
+    return tuple(market for market in markets if cache_manager.get_last_change_time(market) > last_sent_time)
+
+def next_check_time(user_id: int, interval_seconds: int, now: float, digest_minutes: int = 0) -> float:
+    """Momento en que le toca recibir sus cambios (respetando su intervalo o el cierre de su resumen)"""
+    if digest_minutes:
+        return next_digest_due(now, digest_minutes)
+    return max(now, cache_manager.get_user_last_sent(user_id) + interval_seconds)
+
+def schedule_user(user_id: int, interval_seconds: int, now: float = None, digest_minutes: int = 0) -> None:
+    """
+    Programa la próxima verificación de un usuario, solo si tiene cambios sin recibir
+    
+    Sin cambios pendientes el usuario queda fuera del planificador hasta que
+    check_quotation_change() detecte un cambio en alguno de sus mercados.
+    """
+    now = time.time() if now is None else now
+    if not pending_markets(user_id, user_config.get_user_markets(user_id)):
+        due_scheduler.cancel(user_id)
+        return
+    due_scheduler.schedule(user_id, next_check_time(user_id, interval_seconds, now, digest_minutes))
+
+def schedule_market_subscribers(markets: List[str], now: float) -> None:
+    """Programa a los suscriptores de los mercados que cambiaron (los ya programados no se tocan)"""
+    for user_id_str, config in user_config.iter_markets_subscribers(markets):
+        user_id = int(user_id_str)
+        if user_id in due_scheduler:
+            # Ya tiene una verificación pendiente, que verá también este cambio
+            continue
+        due_scheduler.schedule(user_id, next_check_time(
+            user_id, config.get('interval_seconds', 5), now, config.get('digest_minutes', 0)
+        ))
+
+def schedule_active_users() -> None:
+    """Carga en el planificador a los usuarios activos con cambios que todavía no recibieron"""
+    now = time.time()
+    for user_id_str, config in user_config.iter_active_configs():
+        user_id = int(user_id_str)
+        if not pending_markets(user_id, config.get('markets') or [DEFAULT_MARKET]):
+            continue
+        due_scheduler.schedule(user_id, next_check_time(
+            user_id, config.get('interval_seconds', 5), now, config.get('digest_minutes', 0)
+        ))
+    logger.info(f"⏰ {len(due_scheduler)} usuarios con cambios pendientes en el planificador")
+
+def build_change_message(markets: Tuple[str, ...]) -> str:
+    """Arma (o toma del cache) el mensaje de cambio de cotización para uno o más mercados"""
+    version = tuple(cache_manager.get_last_change_time(market) for market in markets)
+    
+    def build() -> str:
+        body = "\n\n".join(
+            dolar_service.format_single_quotation(
+                cache_manager.get_last_quotation(market),
+                cache_manager.get_last_change_time(market)
+            )
+            for market in markets
+        )
         # Formatear mensaje súper amigable con indicación de cambio
-        message = dolar_service.format_single_quotation(current_quotation)
-        message += "\n\n🎉🎊 ¡COTIZACIÓN ACTUALIZADA! 🎊🎉"
-        message += "\n\n💸 ¡Tu botito detectó un cambio en el precio! 💸"
-        message += "\n🕵️‍♂️ ¡Estaba vigilando como un detective! 🕵️‍♂️"
-        message += "\n\n😊 ¡Espero que esta información te sea útil! 😊"
-        message += "\n🚀 ¡Seguiré monitoreando para ti! 🚀"
-        
-        active_configs = user_config.get_all_active_configs()
-        if not active_configs:
-            logger.info("No hay usuarios con monitoreo configurado")
+        return body + MESSAGES['quotation_change_footer']
+    
+    return message_renderer.get(version, 'change:' + ','.join(markets), build)
+
+def build_digest(markets: Tuple[str, ...], digest_minutes: int, now: float) -> str:
+    """Arma (o toma del cache) el resumen de la última ventana para uno o más mercados"""
+    window = digest_window(now, digest_minutes)
+    version = (window, tuple(cache_manager.get_last_change_time(market) for market in markets))
+    return message_renderer.get(
+        version, f'digest:{digest_minutes}:' + ','.join(markets),
+        lambda: build_digest_message(markets, digest_minutes, window, quotation_history, cache_manager, dolar_service)
+    )
+
+async def send_auto_quotations_to_users(context: ContextTypes.DEFAULT_TYPE, user_ids: Optional[List[int]] = None) -> None:
+    """
+    Envía la última cotización a los usuarios a los que les toca verificar y
+    que todavía no recibieron el último cambio
+    
+    Args:
+        context: Contexto con el bot
+        user_ids: Usuarios a verificar (por defecto, los vencidos en el planificador)
+    """
+    try:
+        current_time = time.time()
+        next_due = due_scheduler.next_due_time()
+        SCHEDULER_LAG.set(max(0.0, current_time - next_due) if next_due is not None else 0.0)
+        due_user_ids = due_scheduler.pop_due(current_time) if user_ids is None else list(user_ids)
+        if not due_user_ids:
             return
         
-        # Enviar a cada usuario configurado
-        sent_count = 0
-        current_time = time.time()
+        # Agrupar a los destinatarios según los mercados que tienen pendientes y su modo
+        # (0 = cada cambio, N = resumen de N minutos)
+        recipients: Dict[Tuple[Tuple[str, ...], int], List[int]] = {}
         
-        for user_id_str, config in active_configs.items():
+        for user_id in due_user_ids:
             try:
-                user_id = int(user_id_str)
-                interval_seconds = config.get('interval_seconds', 5)
+                config = user_config.get_user_config(user_id)
+                if not config or not config.get('enabled', False):
+                    continue
                 
-                # Obtener último tiempo de envío del cache
-                last_sent_time = cache_manager.get_user_last_sent(user_id)
+                interval_seconds = config.get('interval_seconds', 5)
+                digest_minutes = config.get('digest_minutes', 0)
                 
-                # Verificar si ha pasado el tiempo suficiente
-                if current_time - last_sent_time >= interval_seconds:
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text=message,
-                        parse_mode='HTML'
-                    )
-                    cache_manager.set_user_last_sent(user_id, current_time)
-                    sent_count += 1
-                    logger.info(f"Cambio de cotización enviado a usuario {user_id} (verificación cada {interval_seconds}s)")
+                # Si todavía tiene un envío sin terminar en el outbox, volver a mirar en un intervalo
+                if outbox.is_pending(user_id):
+                    due_scheduler.schedule(user_id, current_time + interval_seconds)
+                    continue
                 
+                # Enviar solo los mercados que cambiaron después del último envío; sin
+                # cambios el usuario sale del planificador hasta el próximo
+                markets = pending_markets(user_id, config.get('markets') or [DEFAULT_MARKET])
+                if markets:
+                    recipients.setdefault((markets, digest_minutes), []).append(user_id)
+            
             except Exception as e:
-                logger.error(f"Error enviando a usuario {user_id_str}: {e}")
+                logger.error(f"Error preparando envío a usuario {user_id}: {e}")
+        
+        if not recipients:
+            return
+        
+        # Registrar las difusiones en el outbox antes de enviar (sobreviven a un reinicio)
+        entries = [
+            outbox.enqueue(
+                markets,
+                build_digest(markets, digest_minutes, current_time) if digest_minutes else build_change_message(markets),
+                user_ids_group, current_time
+            )
+            for (markets, digest_minutes), user_ids_group in recipients.items()
+        ]
+        await outbox.sync()
+        
+        # Enviar en paralelo respetando los límites de Telegram
+        results = await asyncio.gather(*[deliver_outbox_entry(context.bot, entry) for entry in entries])
+        delivered = [user_id for group in results for user_id in group]
+        if delivered:
+            cache_manager.set_users_last_sent(delivered, current_time)
+        # Los envíos fallidos se reintentan en un intervalo (o con el próximo resumen)
+        delivered_set = set(delivered)
+        retry_time = time.time()
+        for user_ids_group in recipients.values():
+            for user_id in user_ids_group:
+                if user_id in delivered_set:
+                    continue
+                config = user_config.get_user_config(user_id)
+                if not config or not config.get('enabled', False):
+                    continue
+                digest_minutes = config.get('digest_minutes', 0)
+                if digest_minutes:
+                    due_scheduler.schedule(user_id, next_digest_due(retry_time, digest_minutes))
+                else:
+                    due_scheduler.schedule(user_id, retry_time + config.get('interval_seconds', 5))
+        # Una sola escritura a disco por difusión; las entradas se cierran cuando la cubre un guardado
+        outbox.complete_after([entry.id for entry in entries], cache_manager.generation)
+        outbox.on_cache_flushed(await cache_manager.flush_async())
+        sent_count = len(delivered)
         
         if sent_count > 0:
             logger.info(f"Cambios de cotización enviados a {sent_count} usuarios")
@@ -186,6 +785,57 @@ async def send_auto_quotations_to_users(context: ContextTypes.DEFAULT_TYPE) -> N
     except Exception as e:
         logger.error(f"Error en monitoreo de cotización: {e}")
 
+async def deliver_outbox_entry(bot, entry: OutboxEntry) -> List[int]:
+    """
+    Envía una entrada del outbox a sus usuarios pendientes, confirmando los envíos en lote
+    
+    Returns:
+        List[int]: Usuarios a los que se entregó el mensaje
+    """
+    delivered = await broadcast_dispatcher.broadcast(
+        bot, sorted(entry.pending), entry.text,
+        on_result=lambda chat_id, ok: outbox.record(entry, chat_id, ok)
+    )
+    outbox.checkpoint()
+    return delivered
+
+async def recover_outbox() -> None:
+    """
+    Reconstruye el outbox tras un reinicio
+    
+    Las entregas confirmadas que no llegaron al cache se marcan como enviadas,
+    así no se repiten; los usuarios que faltaban quedan para resume_outbox().
+    """
+    entries = outbox.recover()
+    if not entries:
+        return
+    for entry in entries:
+        delivered = [
+            user_id for user_id in entry.delivered
+            if cache_manager.get_user_last_sent(user_id) < entry.created_at
+        ]
+        if delivered:
+            cache_manager.set_users_last_sent(delivered, entry.created_at)
+    outbox.complete_after([entry.id for entry in entries if not entry.pending], cache_manager.generation)
+    outbox.on_cache_flushed(await cache_manager.flush_async())
+
+async def resume_outbox(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Retoma las difusiones que quedaron a medias antes del reinicio"""
+    entries = outbox.pending_entries()
+    if not entries:
+        return
+    try:
+        logger.info(f"📬 Retomando {len(entries)} difusiones pendientes del outbox")
+        results = await asyncio.gather(*[deliver_outbox_entry(context.bot, entry) for entry in entries])
+        for entry, delivered in zip(entries, results):
+            if delivered:
+                cache_manager.set_users_last_sent(delivered, entry.created_at)
+        outbox.complete_after([entry.id for entry in entries], cache_manager.generation)
+        outbox.on_cache_flushed(await cache_manager.flush_async())
+        logger.info(f"📬 Outbox retomado: {sum(len(group) for group in results)} envíos completados")
+    except Exception as e:
+        logger.error(f"Error retomando el outbox: {e}")
+
 async def send_auto_quotations(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Envía cotizaciones automáticamente (compatibilidad con sistema anterior)"""
     # Mantener compatibilidad con CHAT_ID global si está configurado
@@ -204,8 +854,44 @@ async def send_auto_quotations(context: ContextTypes.DEFAULT_TYPE) -> None:
             logger.error(f"Error en envío automático global: {e}")
     
     # También enviar a usuarios configurados individualmente
+    await check_quotation_change(context)
     await send_auto_quotations_to_users(context)
 
+async def run_webhook(application: Application) -> None:
+    """
+    Corre el bot en modo webhook: Telegram envía cada update al servidor HTTP embebido
+    
+    Reemplaza a run_polling respetando el mismo ciclo de vida
+    (post_init al iniciar y post_shutdown al detener).
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES
+        )
+        await application.start()
+        logger.info(f"🔗 Webhook registrado en {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        await stop_event.wait()
+        logger.info("🛑 Bot detenido")
+    finally:
+        if application.running:
+            await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+
 def main() -> None:
     """Función principal del bot"""
     print("\n" + "="*60)
@@ -216,70 +902,212 @@ def main() -> None:
         logger.error("❌ TELEGRAM_BOT_TOKEN no está configurado")
         print("💡 Crea un archivo .env con tu token de Telegram")
         return
+    
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        logger.error("❌ BOT_MODE=webhook requiere WEBHOOK_URL (la URL pública del bot)")
+        return
 
     logger.info("🚀 Iniciando bot de cotizaciones...")
-    logger.info("📊 Configurado para obtener cotización del dólar oficial")
+    logger.info(f"📊 Configurado para monitorear {len(MARKETS)} mercados: {', '.join(MARKETS)}")
+    
+    # Crear aplicación (en modo webhook no hace falta el updater de long polling)
+    # Updates de distintos usuarios en paralelo; los de un mismo usuario, en orden
+    builder = Application.builder().token(BOT_TOKEN).concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+    if BOT_MODE == 'webhook':
+        builder = builder.updater(None)
+    application = builder.build()
     
-    # Crear aplicación
-    application = Application.builder().token(BOT_TOKEN).build()
+    def health_status() -> Tuple[bool, Dict]:
+        """Estado para el health check: listo cuando la aplicación procesa updates"""
+        return application.running, {
+            'mode': BOT_MODE,
+            'quotation_version': dolar_service.version,
+            'quotation_updated_at': dolar_service.updated_at,
+            'upstream_circuit': dolar_service.circuit_breaker.state,
+            'upstream_sources': dolar_service.sources.stats(),
+            'active_users': user_config.count_active() if user_config.is_loaded else None,
+            'stores_loaded': user_config.is_loaded and cache_manager.is_loaded,
+        }
+    
+    # Servidor HTTP: recibe los updates en modo webhook y sirve "/" para el health check
+    http_server = None
+    if BOT_MODE == 'webhook' or PORT:
+        from webhook_server import WebhookServer
+    if BOT_MODE == 'webhook':
+        http_server = WebhookServer(application, PORT or 8080, WEBHOOK_PATH, WEBHOOK_SECRET, status=health_status)
+    elif PORT:
+        http_server = WebhookServer(application, PORT, status=health_status)
 
     # Crear ConversationHandler para configuración paso a paso
     configurar_handler = ConversationHandler(
-        entry_points=[CommandHandler("configurar", configurar_start)],
+        entry_points=[CommandHandler("configurar", timed(configurar_start))],
         states={
             WAITING_MINUTES: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, configurar_minutes),
-                CommandHandler("cancelar", configurar_cancel),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, timed(configurar_minutes)),
+                CommandHandler("cancelar", timed(configurar_cancel)),
+            ],
+            WAITING_DIGEST: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, timed(needs_stores(configurar_digest))),
+                CommandHandler("cancelar", timed(configurar_cancel)),
             ],
         },
-        fallbacks=[CommandHandler("cancelar", configurar_cancel)],
+        fallbacks=[CommandHandler("cancelar", timed(configurar_cancel))],
     )
 
-    # Agregar handlers de comandos
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("cotizacion", cotizacion))
+    # Límite de comandos por usuario (grupo -1: corre antes que el resto)
+    application.add_handler(TypeHandler(Update, throttle), group=-1)
+    
+    # Agregar handlers de comandos (cada uno con su contador de tiempo)
+    application.add_handler(CommandHandler("start", timed(start)))
+    application.add_handler(CommandHandler("help", timed(help_command)))
+    application.add_handler(CommandHandler("cotizacion", timed(cotizacion)))
     application.add_handler(configurar_handler)  # ConversationHandler para /configurar
-    application.add_handler(CommandHandler("parar", parar))
-    application.add_handler(CommandHandler("estado", estado))
+    # Los handlers que leen usuarios o el cache esperan (sin bloquear) a que terminen de cargarse
+    application.add_handler(CommandHandler("parar", timed(needs_stores(parar))))
+    application.add_handler(CommandHandler("estado", timed(needs_stores(estado))))
+    application.add_handler(CommandHandler("mercados", timed(needs_stores(mercados))))
+    application.add_handler(CommandHandler("suscribir", timed(needs_stores(suscribir))))
+    application.add_handler(CommandHandler("desuscribir", timed(needs_stores(desuscribir))))
+    application.add_handler(CommandHandler("historial", timed(historial)))
+    application.add_handler(CommandHandler("stats", timed(stats)))
+    application.add_handler(CommandHandler("alerta", timed(needs_stores(alerta))))
+    application.add_handler(CommandHandler("perfil", perfil))
+    application.add_handler(InlineQueryHandler(timed(inline_query)))
     
-    logger.info("✅ Comandos registrados: /start, /help, /cotizacion, /configurar, /parar, /estado")
-
-    logger.info("⏰ Sistema de envío automático configurado (verificación cada 5 segundos)")
+    logger.info("✅ Comandos registrados: /start, /help, /cotizacion, /configurar, /parar, /estado, /mercados, /suscribir, /desuscribir, /historial, /stats, /alerta, /perfil e inline (@bot)")
+    
+    logger.info(f"⏰ Sistema de envío automático configurado (consulta a la API cada {POLL_INTERVAL} segundos)")
 
     logger.info("🔄 Bot iniciado y escuchando mensajes...")
     print("="*60)
     print("💡 Presiona Ctrl+C para detener el bot")
     print("="*60 + "\n")
     
+    # Crear contexto temporal
+    class TempContext:
+        def __init__(self, bot):
+            self.bot = bot
+    
     # Configurar envío automático usando asyncio (sin dependencias adicionales)
+    async def poll_loop():
+        """Loop que consulta la API y detecta cambios de cotización"""
+        temp_context = TempContext(application.bot)
+        while True:
+            try:
+                with measure('poll_loop'):
+                    await check_quotation_change(temp_context)
+            except Exception as e:
+                logger.error(f"Error en poll_loop: {e}")
+            startup_timer.mark('first_poll')
+            await asyncio.sleep(POLL_INTERVAL)
+    
     async def auto_send_loop():
-        """Loop para enviar cotizaciones automáticamente"""
+        """Loop que envía la cotización a cada usuario cuando le toca"""
+        temp_context = TempContext(application.bot)
         while True:
             try:
-                # Crear contexto temporal
-                class TempContext:
-                    def __init__(self, bot):
-                        self.bot = bot
-                
-                temp_context = TempContext(application.bot)
-                await send_auto_quotations_to_users(temp_context)
-                await asyncio.sleep(5)  # Verificar cada 5 segundos
+                # Dormir hasta el próximo vencimiento (solo se procesan usuarios vencidos)
+                await due_scheduler.wait_for_due()
+                with measure('auto_send_loop'):
+                    await send_auto_quotations_to_users(temp_context)
             except Exception as e:
                 logger.error(f"Error en auto_send_loop: {e}")
-                await asyncio.sleep(5)
+                await asyncio.sleep(1)
+    
+    def toggle_profiling():
+        """Inicia o termina una captura de perfil (SIGUSR1)"""
+        if profiler.active:
+            profiler.stop()
+        else:
+            profiler.start(PROFILE_DEFAULT_SECONDS)
+    
+    async def warm_up():
+        """Carga los stores por tandas (sin frenar el loop) y después arranca los loops que los usan"""
+        try:
+            if storage is not None:
+                # Migración única de los JSON a SQLite (no en el import del módulo)
+                await asyncio.to_thread(migrate_json_to_sqlite, storage)
+            for name, store in (('cache', cache_manager), ('alerts', alert_index), ('user_configs', user_config)):
+                started = time.perf_counter()
+                await store.load_async()
+                startup_timer.record(f'load_{name}', time.perf_counter() - started)
+                if store is alert_index:
+                    # El monitoreo solo necesita el cache de cotizaciones y las alertas
+                    asyncio.create_task(poll_loop())
+            startup_timer.mark('stores_loaded')
+            stores_ready.set()
+            if sharded_dispatch is None:
+                await recover_outbox()
+                schedule_active_users()
+                asyncio.create_task(resume_outbox(TempContext(application.bot)))
+                asyncio.create_task(auto_send_loop())
+            startup_timer.mark('scheduler_ready')
+            logger.info("✅ Loop de envío automático iniciado")
+        except Exception as e:
+            logger.error(f"Error al cargar los datos de usuarios: {e}")
+        finally:
+            # Si la carga falló, los handlers la reintentan al primer uso
+            stores_ready.set()
     
     # Callback para iniciar el loop después de que el bot esté listo
     async def post_init(application):
         """Se ejecuta después de que el bot esté inicializado"""
-        asyncio.create_task(auto_send_loop())
-        logger.info("✅ Loop de envío automático iniciado")
+        # Los updates se atienden desde ya; la carga de usuarios sigue en segundo plano
+        asyncio.create_task(warm_up())
+        if cache_manager.write_behind:
+            asyncio.create_task(cache_manager.run_flush_loop())
+            logger.info(f"💾 Cache en modo write-behind (flush cada {cache_manager.flush_interval}s)")
+        asyncio.create_task(quotation_history.run_flush_loop())
+        if sharded_dispatch is not None:
+            asyncio.create_task(sharded_dispatch.run_results_loop())
+        if http_server is not None:
+            await http_server.start()
+        try:
+            # kill -USR1 <pid> inicia (o termina) una captura de perfil
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, toggle_profiling)
+        except (NotImplementedError, AttributeError):
+            pass
+        startup_timer.mark('accepting_updates')
+    
+    # Callback para guardar el cache pendiente al apagar el bot
+    async def post_shutdown(application):
+        """Se ejecuta al detener el bot"""
+        if http_server is not None:
+            await http_server.stop()
+        if sharded_dispatch is not None:
+            sharded_dispatch.stop()
+        # Esperar a un guardado en curso del loop de flush en lugar de pisarlo
+        await cache_manager.flush_async()
+        outbox.close()
+        store_writer.close()
+        quotation_history.flush()
+        if storage is not None:
+            storage.close()
+        logger.info("💾 Cache guardado en disco")
     
-    # Configurar el callback
+    # Configurar los callbacks
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
+    
+    if sharded_dispatch is not None:
+        from shard_worker import merge_legacy_shard_caches
+        if storage is not None:
+            migrate_json_to_sqlite(storage)
+        merge_legacy_shard_caches(cache_manager)
+        # Los workers se crean antes de iniciar el event loop del bot
+        sharded_dispatch.start(
+            user_config.iter_active_configs(),
+            cache_manager.get_last_quotations(),
+            {market: cache_manager.get_last_change_time(market) for market in cache_manager.get_last_quotations()},
+            cache_manager.get_all_user_times()
+        )
     
     try:
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if BOT_MODE == 'webhook':
+            logger.info("🔗 Modo webhook: los updates llegan por HTTP")
+            asyncio.run(run_webhook(application))
+        else:
+            application.run_polling(allowed_updates=Update.ALL_TYPES)
     except KeyboardInterrupt:
         logger.info("🛑 Bot detenido por el usuario")
         print("\n👋 ¡Hasta luego!")
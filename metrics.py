@@ -0,0 +1,167 @@
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Buckets por defecto (segundos), de 5 ms a 60 s
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _format_value(value: float) -> str:
+    """Formatea un número como lo espera el formato de texto de Prometheus"""
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    """Formatea las etiquetas como {clave="valor",...}"""
+    if not labels:
+        return ''
+    escaped = (
+        key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+class Counter:
+    """Contador que solo crece, opcionalmente con etiquetas"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        """Incrementa el contador"""
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        if not self.values:
+            return [(self.name, (), 0)]
+        return [(self.name, labels, value) for labels, value in self.values.items()]
+
+class Gauge:
+    """Valor que sube y baja; puede leerse de una función al momento de exportar"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        """Fija el valor del gauge"""
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Calcula el valor con una función cada vez que se exporta"""
+        self.function = function
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = float('nan')
+        return [(self.name, (), value)]
+
+class Histogram:
+    """Histograma de duraciones con buckets acumulativos"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """Registra una observación"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        """Mide la duración del bloque"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            samples.append((f'{self.name}_bucket', (('le', _format_value(bound)),), cumulative))
+        samples.append((f'{self.name}_sum', (), self.sum))
+        samples.append((f'{self.name}_count', (), self.count))
+        return samples
+
+class Registry:
+    """Conjunto de métricas que se exportan en formato de texto de Prometheus"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Exporta todas las métricas
+
+        Returns:
+            str: Texto en formato de exposición de Prometheus (versión 0.0.4)
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+# Métricas del bot
+REGISTRY = Registry()
+
+FETCH_SECONDS = REGISTRY.histogram('dolarbot_upstream_fetch_seconds', 'Duración de cada consulta a dolarapi')
+UPSTREAM_ERRORS = REGISTRY.counter('dolarbot_upstream_errors_total', 'Consultas a dolarapi fallidas por fuente')
+UPSTREAM_REQUESTS = REGISTRY.counter('dolarbot_upstream_requests_total', 'Consultas enviadas a cada fuente de cotizaciones')
+UPSTREAM_WINS = REGISTRY.counter('dolarbot_upstream_wins_total', 'Respuestas usadas de cada fuente (la primera válida gana)')
+UPSTREAM_HEDGES = REGISTRY.counter('dolarbot_upstream_hedges_total', 'Consultas de cobertura a otra fuente por demora de la anterior')
+CHANGES_DETECTED = REGISTRY.counter('dolarbot_changes_detected_total', 'Cambios de cotización detectados por mercado')
+SEND_SECONDS = REGISTRY.histogram('dolarbot_send_seconds', 'Duración de cada envío a Telegram')
+BROADCAST_SECONDS = REGISTRY.histogram('dolarbot_broadcast_seconds', 'Duración total de cada difusión')
+MESSAGES_SENT = REGISTRY.counter('dolarbot_messages_sent_total', 'Mensajes entregados')
+SEND_FAILURES = REGISTRY.counter('dolarbot_send_failures_total', 'Envíos fallidos por motivo')
+RATE_LIMITED = REGISTRY.counter('dolarbot_rate_limited_total', 'Respuestas 429 (RetryAfter) de Telegram')
+SCHEDULER_LAG = REGISTRY.gauge('dolarbot_scheduler_lag_seconds', 'Atraso del planificador respecto del vencimiento más viejo')
+ACTIVE_SUBSCRIBERS = REGISTRY.gauge('dolarbot_active_subscribers', 'Usuarios con monitoreo activo')
+CACHE_DIRTY_AGE = REGISTRY.gauge('dolarbot_cache_dirty_age_seconds', 'Antigüedad de los cambios del cache sin guardar')
+CACHE_FLUSH_SECONDS = REGISTRY.gauge('dolarbot_cache_flush_seconds', 'Duración del último guardado del cache')
+COMMANDS_THROTTLED = REGISTRY.counter('dolarbot_commands_throttled_total', 'Updates descartados por el límite de comandos por usuario')
+HANDLER_CALLS = REGISTRY.counter('dolarbot_handler_calls_total', 'Ejecuciones de cada handler y loop')
+HANDLER_SECONDS = REGISTRY.counter('dolarbot_handler_seconds_total', 'Tiempo acumulado de cada handler y loop')
@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from background_writer import BackgroundWriter, Write
+from cache_manager import atomic_write_text
+from config import OUTBOX_FILE, OUTBOX_CHECKPOINT_SIZE
+
+# Configurar logger para el outbox
+logger = logging.getLogger(__name__)
+
+class OutboxEntry:
+    """Un mensaje de cambio y los usuarios que todavía no lo recibieron"""
+
+    __slots__ = ('id', 'created_at', 'markets', 'text', 'pending', 'delivered')
+
+    def __init__(self, entry_id: int, created_at: float, markets: List[str], text: str, pending: Set[int]):
+        self.id = entry_id
+        self.created_at = created_at
+        self.markets = markets
+        self.text = text
+        self.pending = pending
+        self.delivered: List[int] = []
+
+class Outbox:
+    """
+    Journal durable de envíos pendientes
+
+    Cada difusión se registra antes de empezar (mensaje + destinatarios) y los
+    envíos ya hechos se confirman en lote. Si el proceso se cae a mitad de una
+    difusión, al reiniciar se retoma solo con los usuarios que faltaban.
+    Con un writer, las escrituras y el fsync corren en su hilo, en orden.
+
+    Formato: una línea JSON por operación
+        {"op": "enqueue", "id", "at", "markets", "text", "users"}
+        {"op": "ack", "id", "delivered", "failed"}
+        {"op": "done", "id"}
+    """
+
+    def __init__(self, path: str = OUTBOX_FILE, checkpoint_size: int = OUTBOX_CHECKPOINT_SIZE,
+                 writer: Optional[BackgroundWriter] = None):
+        """
+        Args:
+            path: Archivo del journal
+            checkpoint_size: Envíos confirmados que se acumulan antes de escribirlos
+            writer: Escritor en segundo plano (sin writer se escribe en el momento)
+        """
+        self.path = path
+        self.checkpoint_size = checkpoint_size
+        self.writer = writer
+        self.entries: Dict[int, OutboxEntry] = {}
+        self._next_id = 1
+        self._pending_users: Dict[int, int] = {}
+        # Confirmaciones aún no escritas {id: (entregados, fallidos)}
+        self._acks: Dict[int, Tuple[List[int], List[int]]] = {}
+        self._unwritten = 0
+        # Entradas entregadas que esperan a que el cache guarde sus envíos {id: generación del cache}
+        self._awaiting_flush: Dict[int, int] = {}
+        self._file = None
+
+    def _submit(self, write: Write):
+        """Corre una escritura del journal en el hilo del writer (o en el momento)"""
+        if self.writer is None:
+            write()
+        else:
+            self.writer.submit(write)
+
+    def _append(self, records: Iterable[dict]):
+        """Agrega operaciones al journal y las baja a disco"""
+        text = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+        self._submit(lambda: self._write(text))
+
+    def _write(self, text: str):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(text)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    async def sync(self):
+        """Espera a que lo registrado hasta ahora esté en disco"""
+        if self.writer is not None:
+            await self.writer.drain()
+
+    def _track(self, user_ids: Iterable[int], delta: int):
+        """Actualiza el conteo de envíos pendientes por usuario"""
+        for user_id in user_ids:
+            count = self._pending_users.get(user_id, 0) + delta
+            if count > 0:
+                self._pending_users[user_id] = count
+            else:
+                self._pending_users.pop(user_id, None)
+
+    def recover(self) -> List[OutboxEntry]:
+        """
+        Reconstruye el estado a partir del journal (al iniciar)
+
+        Returns:
+            Entradas sin terminar: con usuarios pendientes y/o entregas que
+            todavía no se reflejaron en el cache
+        """
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError as e:
+            logger.error(f"No se pudo leer el outbox: {e}")
+            return []
+
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Última línea cortada por una caída: se descarta
+                continue
+            entry_id = record.get('id')
+            if record.get('op') == 'enqueue':
+                self.entries[entry_id] = OutboxEntry(
+                    entry_id, record['at'], record['markets'], record['text'], set(record['users'])
+                )
+                self._next_id = max(self._next_id, entry_id + 1)
+            elif record.get('op') == 'ack' and entry_id in self.entries:
+                entry = self.entries[entry_id]
+                entry.pending.difference_update(record['delivered'])
+                entry.pending.difference_update(record['failed'])
+                entry.delivered.extend(record['delivered'])
+            elif record.get('op') == 'done':
+                self.entries.pop(entry_id, None)
+
+        for entry in self.entries.values():
+            self._track(entry.pending, 1)
+        if self.entries:
+            pending = sum(len(entry.pending) for entry in self.entries.values())
+            logger.info(f"📬 Outbox recuperado: {len(self.entries)} difusiones sin terminar, {pending} envíos pendientes")
+        else:
+            self._compact()
+        return list(self.entries.values())
+
+    def enqueue(self, markets: Iterable[str], text: str, user_ids: Iterable[int],
+                created_at: Optional[float] = None) -> OutboxEntry:
+        """
+        Registra una difusión antes de empezar a enviarla
+
+        Returns:
+            OutboxEntry: Entrada con los usuarios pendientes
+        """
+        entry = OutboxEntry(self._next_id, created_at or time.time(), list(markets), text, set(user_ids))
+        self._next_id += 1
+        self._append([{
+            'op': 'enqueue', 'id': entry.id, 'at': entry.created_at,
+            'markets': entry.markets, 'text': entry.text, 'users': sorted(entry.pending)
+        }])
+        self.entries[entry.id] = entry
+        self._track(entry.pending, 1)
+        return entry
+
+    def record(self, entry: OutboxEntry, user_id: int, delivered: bool):
+        """Confirma un envío (entregado o descartado); se escribe en lote con checkpoint()"""
+        if user_id not in entry.pending:
+            return
+        entry.pending.discard(user_id)
+        self._track([user_id], -1)
+        acks = self._acks.setdefault(entry.id, ([], []))
+        if delivered:
+            entry.delivered.append(user_id)
+            acks[0].append(user_id)
+        else:
+            acks[1].append(user_id)
+        self._unwritten += 1
+        if self._unwritten >= self.checkpoint_size:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Escribe en el journal las confirmaciones acumuladas"""
+        if not self._acks:
+            return
+        records = [
+            {'op': 'ack', 'id': entry_id, 'delivered': delivered, 'failed': failed}
+            for entry_id, (delivered, failed) in self._acks.items()
+        ]
+        self._acks = {}
+        self._unwritten = 0
+        try:
+            self._append(records)
+        except Exception as e:
+            logger.error(f"Error al guardar el outbox: {e}")
+
+    def complete(self, entry_ids: Iterable[int]):
+        """
+        Da por terminadas las entradas indicadas (sus entregas ya están guardadas en el cache)
+
+        Cuando no queda ninguna entrada abierta, el journal se vacía.
+        """
+        self.checkpoint()
+        done = [entry_id for entry_id in entry_ids if entry_id in self.entries]
+        for entry_id in done:
+            self._track(self.entries.pop(entry_id).pending, -1)
+        if not done:
+            return
+        try:
+            if self.entries:
+                self._append({'op': 'done', 'id': entry_id} for entry_id in done)
+            else:
+                self._compact()
+        except Exception as e:
+            logger.error(f"Error al guardar el outbox: {e}")
+
+    def complete_after(self, entry_ids: Iterable[int], generation: int):
+        """
+        Cierra las entradas cuando el cache haya guardado hasta la generación indicada
+
+        Ver on_cache_flushed(); así una entrada no queda abierta si el guardado
+        que la cubre es uno posterior (ej. el del loop de flush).
+        """
+        for entry_id in entry_ids:
+            if entry_id in self.entries:
+                self._awaiting_flush[entry_id] = generation
+
+    def on_cache_flushed(self, generation: int):
+        """Cierra las entradas cuyas entregas ya quedaron guardadas en el cache"""
+        done = [entry_id for entry_id, required in self._awaiting_flush.items() if required <= generation]
+        if not done:
+            return
+        for entry_id in done:
+            del self._awaiting_flush[entry_id]
+        self.complete(done)
+
+    def _compact(self):
+        """Vacía el journal (no quedan difusiones abiertas)"""
+        self._next_id = 1
+        self._submit(self._truncate)
+
+    def _truncate(self):
+        self._close_file()
+        atomic_write_text(self.path, '')
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def pending_entries(self) -> List[OutboxEntry]:
+        """Entradas que todavía tienen usuarios por recibir el mensaje"""
+        return [entry for entry in self.entries.values() if entry.pending]
+
+    def is_pending(self, user_id: int) -> bool:
+        """Indica si el usuario tiene un envío pendiente en el outbox"""
+        return user_id in self._pending_users
+
+    def close(self):
+        """Escribe las confirmaciones pendientes y cierra el journal"""
+        self.checkpoint()
+        self._submit(self._close_file)
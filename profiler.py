@@ -0,0 +1,173 @@
+import asyncio
+import functools
+import io
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from metrics import HANDLER_CALLS, HANDLER_SECONDS
+from config import PROFILE_DIR, PROFILE_MAX_SECONDS
+
+# Configurar logger para el profiler
+logger = logging.getLogger(__name__)
+
+def record_timing(name: str, elapsed: float):
+    """Suma una ejecución a los contadores de tiempo (siempre activos)"""
+    HANDLER_CALLS.inc(handler=name)
+    HANDLER_SECONDS.inc(elapsed, handler=name)
+
+@contextmanager
+def measure(name: str):
+    """Mide la duración del bloque y la suma a los contadores de tiempo"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - start)
+
+def timed(handler: Callable) -> Callable:
+    """Decora un handler async para medir cada ejecución"""
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            record_timing(name, time.perf_counter() - start)
+
+    return wrapper
+
+def get_timings() -> List[Tuple[str, int, float]]:
+    """
+    Devuelve los contadores de tiempo acumulados
+
+    Returns:
+        Lista de (handler, ejecuciones, segundos totales), de mayor a menor tiempo total
+    """
+    timings = []
+    for labels, calls in HANDLER_CALLS.values.items():
+        total = HANDLER_SECONDS.values.get(labels, 0.0)
+        timings.append((dict(labels)['handler'], int(calls), total))
+    return sorted(timings, key=lambda item: item[2], reverse=True)
+
+class Profiler:
+    """Captura con cProfile durante una ventana acotada y guarda el resultado en disco"""
+
+    def __init__(self, output_dir: str = PROFILE_DIR, max_seconds: float = PROFILE_MAX_SECONDS):
+        """
+        Args:
+            output_dir: Directorio donde se guardan los perfiles
+            max_seconds: Duración máxima de una captura
+        """
+        self.output_dir = output_dir
+        self.max_seconds = max_seconds
+        self._profile = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._on_done: Optional[Callable[[Optional[str]], None]] = None
+        self.ends_at: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self._profile is not None
+
+    def start(self, seconds: float, on_done: Optional[Callable[[Optional[str]], None]] = None) -> float:
+        """
+        Empieza una captura del event loop (handlers, loops de monitoreo y envío)
+
+        Args:
+            seconds: Duración de la captura (se recorta a max_seconds)
+            on_done: Función que recibe la ruta del perfil al terminar
+
+        Returns:
+            float: Duración efectiva de la captura
+        """
+        if self.active:
+            raise RuntimeError("Ya hay una captura en curso")
+        # cProfile se importa recién al usarlo para no sumar al arranque
+        import cProfile
+        seconds = max(1.0, min(seconds, self.max_seconds))
+        self._profile = cProfile.Profile()
+        self._on_done = on_done
+        self.ends_at = time.time() + seconds
+        self._timer = asyncio.get_running_loop().call_later(seconds, self.stop)
+        self._profile.enable()
+        logger.info(f"🔬 Captura de perfil iniciada por {seconds:.0f}s")
+        return seconds
+
+    def stop(self) -> Optional[str]:
+        """
+        Termina la captura en curso y la guarda en disco
+
+        Returns:
+            str: Ruta del archivo .prof (junto a un resumen .txt) o None si falló
+        """
+        if not self.active:
+            return None
+        profile, on_done = self._profile, self._on_done
+        profile.disable()
+        if self._timer is not None:
+            self._timer.cancel()
+        self._profile, self._timer, self._on_done, self.ends_at = None, None, None, None
+
+        path = None
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, f"profile-{datetime.now():%Y%m%d-%H%M%S}.prof")
+            profile.dump_stats(path)
+            with open(path[:-5] + '.txt', 'w', encoding='utf-8') as f:
+                f.write(self.summarize(profile, limit=60))
+            logger.info(f"🔬 Perfil guardado en {path}")
+        except Exception as e:
+            logger.error(f"Error al guardar el perfil: {e}")
+            path = None
+        if on_done is not None:
+            on_done(path)
+        return path
+
+    @staticmethod
+    def summarize(profile, limit: int = 20) -> str:
+        """Resumen en texto de las funciones con más tiempo acumulado"""
+        import pstats
+        out = io.StringIO()
+        stats = pstats.Stats(profile, stream=out)
+        stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+        return out.getvalue()
+
+class StartupTimer:
+    """Mide las etapas del arranque y las resume en un solo log cuando terminan todas"""
+
+    def __init__(self, started: float, expected: Iterable[str] = ()):
+        """
+        Args:
+            started: Momento de inicio (time.perf_counter())
+            expected: Etapas que deben registrarse antes de emitir el reporte
+        """
+        self.started = started
+        self.expected = set(expected)
+        self.marks: Dict[str, float] = {}
+        self.durations: Dict[str, float] = {}
+        self.reported = False
+
+    def mark(self, stage: str):
+        """Registra el momento en que se alcanzó una etapa"""
+        self.marks.setdefault(stage, time.perf_counter() - self.started)
+        self._maybe_report()
+
+    def record(self, stage: str, seconds: float):
+        """Registra la duración de una tarea del arranque"""
+        self.durations[stage] = seconds
+
+    def report(self) -> str:
+        """Texto del reporte: momento de cada etapa y duración de cada tarea"""
+        marks = " | ".join(f"{stage} {offset * 1000:.0f}ms" for stage, offset in self.marks.items())
+        durations = " | ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in self.durations.items())
+        return f"⏱️ Arranque: {marks}" + (f" (duraciones: {durations})" if durations else "")
+
+    def _maybe_report(self):
+        if not self.reported and self.expected.issubset(self.marks):
+            self.reported = True
+            logger.info(self.report())
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from dispatcher import TokenBucket
+from config import COMMAND_RATE, COMMAND_BURST, RATE_LIMIT_MAX_USERS
+
+class CommandBucket(TokenBucket):
+    """Bucket de comandos de un usuario; recuerda si ya se le avisó que espere"""
+
+    __slots__ = ('warned',)
+
+    def __init__(self, rate: float, capacity: float):
+        super().__init__(rate, capacity)
+        self.warned = False
+
+class CommandRateLimiter:
+    """
+    Límite de comandos por usuario con token buckets en un LRU de tamaño fijo
+
+    Los usuarios menos recientes se descartan al llenarse el LRU (vuelven a
+    empezar con el bucket lleno), así la memoria no crece con la cantidad de
+    usuarios distintos.
+    """
+
+    def __init__(self, rate: float = COMMAND_RATE, burst: float = COMMAND_BURST,
+                 max_users: int = RATE_LIMIT_MAX_USERS):
+        """
+        Args:
+            rate: Comandos por segundo que recupera cada usuario
+            burst: Comandos seguidos que puede mandar un usuario con el bucket lleno
+            max_users: Usuarios que se recuerdan como máximo
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max(1, max_users)
+        self._buckets: "OrderedDict[int, CommandBucket]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _get_bucket(self, user_id: int) -> CommandBucket:
+        """Obtiene (o crea) el bucket del usuario y lo marca como el más reciente"""
+        bucket = self._buckets.get(user_id)
+        if bucket is not None:
+            self._buckets.move_to_end(user_id)
+            return bucket
+        bucket = self._buckets[user_id] = CommandBucket(self.rate, self.burst)
+        if len(self._buckets) > self.max_users:
+            self._buckets.popitem(last=False)
+        return bucket
+
+    def allow(self, user_id: int) -> bool:
+        """
+        Consume un comando del usuario
+
+        Returns:
+            bool: True si puede seguir, False si superó el límite
+        """
+        bucket = self._get_bucket(user_id)
+        if bucket.try_acquire():
+            bucket.warned = False
+            return True
+        return False
+
+    def should_warn(self, user_id: int) -> bool:
+        """
+        Indica si hay que avisarle al usuario que está limitado (una sola vez por racha)
+
+        Returns:
+            bool: True la primera vez que se lo limita desde su último comando permitido
+        """
+        bucket = self._get_bucket(user_id)
+        if bucket.warned:
+            return False
+        bucket.warned = True
+        return True
@@ -0,0 +1,82 @@
+import string
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+from config import MESSAGES, RENDER_CACHE_SIZE, RENDER_LOCALE
+
+class CompiledTemplate:
+    """Plantilla de MESSAGES analizada una sola vez (partes literales + campos)"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.parts: Tuple[Tuple[str, Optional[str], str], ...] = tuple(
+            (literal, field, spec or '')
+            for literal, field, spec, _ in string.Formatter().parse(text)
+        )
+        # Si no tiene campos, el resultado es siempre el mismo
+        self.static: Optional[str] = None
+        if all(field is None for _, field, _ in self.parts):
+            self.static = ''.join(literal for literal, _, _ in self.parts)
+
+    def render(self, **values) -> str:
+        """
+        Completa la plantilla con los valores indicados
+
+        Returns:
+            str: Texto final (equivalente a text.format(**values))
+        """
+        if self.static is not None:
+            return self.static
+        out = []
+        for literal, field, spec in self.parts:
+            out.append(literal)
+            if field is not None:
+                out.append(format(values[field], spec))
+        return ''.join(out)
+
+def compile_messages(messages: Dict[str, str]) -> Dict[str, CompiledTemplate]:
+    """Precompila todas las plantillas de mensajes"""
+    return {key: CompiledTemplate(text) for key, text in messages.items()}
+
+# Plantillas precompiladas al iniciar
+TEMPLATES = compile_messages(MESSAGES)
+
+class MessageRenderer:
+    """Cache de mensajes ya renderizados, por (versión de la cotización, plantilla, idioma)"""
+
+    def __init__(self, max_entries: int = RENDER_CACHE_SIZE, locale: str = RENDER_LOCALE):
+        self.max_entries = max_entries
+        self.locale = locale
+        self._cache: "OrderedDict[Tuple[Hashable, str, str], str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version: Hashable, template: str, build: Callable[[], str],
+            locale: Optional[str] = None) -> str:
+        """
+        Devuelve el mensaje renderizado, construyéndolo solo la primera vez
+
+        Args:
+            version: Identifica los datos de la cotización (cambia cuando cambian los datos)
+            template: Nombre del tipo de mensaje (ej. "single:blue", "all")
+            build: Función que arma el mensaje si no está en cache
+            locale: Idioma del mensaje (por defecto el del renderer)
+
+        Returns:
+            str: Mensaje listo para enviar
+        """
+        key = (version, template, locale or self.locale)
+        message = self._cache.get(key)
+        if message is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return message
+        self.misses += 1
+        message = build()
+        self._cache[key] = message
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return message
+
+    def clear(self):
+        """Vacía el cache de mensajes"""
+        self._cache.clear()
@@ -0,0 +1,92 @@
+import asyncio
+import heapq
+import time
+from typing import Dict, List, Optional, Tuple
+
+class DueScheduler:
+    """Planificador de usuarios ordenado por su próximo momento de verificación"""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int]] = []
+        self._due: Dict[int, float] = {}
+        self._wakeup = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._due
+
+    def schedule(self, user_id: int, due_time: float):
+        """
+        Programa (o reprograma) la próxima verificación de un usuario
+
+        Args:
+            user_id: ID del usuario
+            due_time: Momento (time.time()) en el que le toca
+        """
+        self._due[user_id] = due_time
+        heapq.heappush(self._heap, (due_time, user_id))
+        if self._heap[0] == (due_time, user_id):
+            # Hay un vencimiento más próximo: despertar al loop que espera
+            self._wakeup.set()
+
+    def cancel(self, user_id: int):
+        """Quita a un usuario del planificador (la entrada del heap se descarta al salir)"""
+        self._due.pop(user_id, None)
+
+    def _discard_stale(self):
+        """Descarta entradas canceladas o reprogramadas del tope del heap"""
+        heap = self._heap
+        while heap and self._due.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        # Compactar si las entradas obsoletas dominan el heap
+        if len(heap) > 64 and len(heap) > 2 * len(self._due):
+            self._heap = [(due, user_id) for user_id, due in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def next_due_time(self) -> Optional[float]:
+        """Devuelve el próximo vencimiento o None si no hay usuarios"""
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: Optional[float] = None) -> List[int]:
+        """
+        Extrae a todos los usuarios cuyo vencimiento ya pasó
+
+        Args:
+            now: Momento actual (por defecto time.time())
+
+        Returns:
+            List[int]: IDs de los usuarios vencidos (quedan fuera del planificador)
+        """
+        now = time.time() if now is None else now
+        due_users = []
+        while True:
+            self._discard_stale()
+            heap = self._heap
+            if not heap or heap[0][0] > now:
+                break
+            _, user_id = heapq.heappop(heap)
+            del self._due[user_id]
+            due_users.append(user_id)
+        return due_users
+
+    async def wait_for_due(self, max_wait: Optional[float] = None):
+        """
+        Espera hasta el próximo vencimiento, o hasta que se programe uno más cercano
+
+        Args:
+            max_wait: Espera máxima en segundos
+        """
+        self._wakeup.clear()
+        next_due = self.next_due_time()
+        timeout = max_wait if next_due is None else max(0.0, next_due - time.time())
+        if max_wait is not None:
+            timeout = min(timeout, max_wait)
+        if timeout is not None and timeout <= 0:
+            return
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
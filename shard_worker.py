@@ -0,0 +1,325 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import multiprocessing
+import queue
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from telegram import Bot
+from telegram.request import HTTPXRequest
+from cache_manager import CacheManager
+from dispatcher import BroadcastDispatcher
+from dolar_service import DolarService
+from renderer import MessageRenderer
+from scheduler import DueScheduler
+from config import (
+    BOT_TOKEN, DEFAULT_MARKET, MESSAGES, DISPATCHER_WORKERS,
+    BROADCAST_CONCURRENCY, BROADCAST_GLOBAL_RATE,
+)
+
+# Configurar logger para los workers de envío
+logger = logging.getLogger(__name__)
+
+def shard_of(user_id: int, shards: int) -> int:
+    """Devuelve el worker dueño de un usuario"""
+    return user_id % shards
+
+def merge_legacy_shard_caches(cache_manager: CacheManager, pattern: str = 'bot_cache.shard*.json') -> int:
+    """
+    Pasa al cache principal los últimos envíos de los archivos por shard de versiones anteriores
+
+    Los archivos se borran después de guardar el cache, así no se vuelven a leer.
+
+    Returns:
+        int: Usuarios cuyo último envío se actualizó
+    """
+    paths = glob.glob(pattern)
+    if not paths:
+        return 0
+    # {momento: usuarios} (los envíos de una misma difusión comparten el momento)
+    by_time: Dict[float, List[int]] = {}
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                user_last_sent = json.load(f).get('user_last_sent') or {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudo leer {path}: {e}")
+            return 0
+        for user_id_str, timestamp in user_last_sent.items():
+            if timestamp > cache_manager.get_user_last_sent(int(user_id_str)):
+                by_time.setdefault(timestamp, []).append(int(user_id_str))
+    for timestamp, user_ids in by_time.items():
+        cache_manager.set_users_last_sent(user_ids, timestamp)
+    cache_manager.flush()
+    if cache_manager.dirty:
+        # No se pudo guardar: conservar los archivos para el próximo arranque
+        return 0
+    for path in paths:
+        os.remove(path)
+    updated = sum(len(user_ids) for user_ids in by_time.values())
+    logger.info(f"Últimos envíos de {len(paths)} archivos por shard migrados ({updated} usuarios)")
+    return updated
+
+class ShardedDispatch:
+    """
+    Lado del proceso principal: levanta N workers de envío y les publica los eventos
+
+    Cada worker es dueño de los usuarios con user_id % N == índice, así que la
+    difusión de un cambio se reparte entre procesos y el proceso principal
+    solo consulta la API y atiende comandos. Los workers no escriben a disco:
+    informan sus envíos y el proceso principal los guarda por user_id, así
+    cambiar la cantidad de workers no pierde los últimos envíos.
+    """
+
+    def __init__(self, workers: int = DISPATCHER_WORKERS,
+                 on_sent: Optional[Callable[[List[int], float], None]] = None):
+        """
+        Args:
+            workers: Cantidad de procesos worker
+            on_sent: Se llama con (user_ids, momento) por cada envío que informa un worker
+        """
+        self.workers = max(1, workers)
+        self.on_sent = on_sent
+        self.queues: List[multiprocessing.Queue] = []
+        self.processes: List[multiprocessing.Process] = []
+        self.results: Optional[multiprocessing.Queue] = None
+
+    def start(self, active_configs: Iterable[Tuple[str, Dict]], last_quotations: Dict[str, dict],
+              change_times: Dict[str, float], user_last_sent: Dict[str, float]):
+        """
+        Levanta los workers y les envía la foto inicial de su shard
+
+        Debe llamarse antes de iniciar el event loop del bot (los workers se crean con fork).
+
+        Args:
+            active_configs: Pares (user_id, config) de los usuarios activos
+            last_quotations: Última cotización conocida de cada mercado
+            change_times: Momento del último cambio de cada mercado
+            user_last_sent: Último envío de cada usuario
+        """
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+
+        shards: List[Dict[int, Tuple[Dict, float]]] = [{} for _ in range(self.workers)]
+        for user_id_str, config in active_configs:
+            user_id = int(user_id_str)
+            shards[shard_of(user_id, self.workers)][user_id] = (config, user_last_sent.get(user_id_str, 0))
+
+        self.results = context.Queue()
+        for index in range(self.workers):
+            events = context.Queue()
+            process = context.Process(
+                target=run_worker, args=(index, self.workers, events, self.results),
+                name=f'dispatcher-{index}', daemon=True
+            )
+            process.start()
+            events.put(('snapshot', shards[index], dict(last_quotations), dict(change_times)))
+            self.queues.append(events)
+            self.processes.append(process)
+        logger.info(f"🧩 {self.workers} workers de envío iniciados")
+
+    def publish_change(self, quotations: Dict[str, dict], change_time: float):
+        """Publica a todos los workers los mercados que cambiaron"""
+        for events in self.queues:
+            events.put(('change', quotations, change_time))
+
+    def publish_user(self, user_id: int, config: Optional[Dict], last_sent: float = 0):
+        """Publica al worker dueño la configuración nueva de un usuario (None si se desactivó)"""
+        if self.queues:
+            self.queues[shard_of(user_id, self.workers)].put(('user', user_id, config, last_sent))
+
+    def _apply_result(self, result: tuple):
+        """Aplica un envío informado por un worker"""
+        _, user_ids, sent_at = result
+        if self.on_sent is not None:
+            self.on_sent(user_ids, sent_at)
+
+    async def run_results_loop(self):
+        """Lee los envíos informados por los workers sin bloquear el event loop"""
+        loop = asyncio.get_running_loop()
+        while self.results is not None:
+            try:
+                result = await loop.run_in_executor(None, self.results.get, True, 1.0)
+            except queue.Empty:
+                continue
+            self._apply_result(result)
+
+    def _drain_results(self):
+        """Aplica los envíos que quedaron en la cola"""
+        while self.results is not None:
+            try:
+                self._apply_result(self.results.get_nowait())
+            except queue.Empty:
+                break
+
+    def stop(self, timeout: float = 10):
+        """Pide a los workers que terminen y aplica sus últimos envíos"""
+        for events in self.queues:
+            events.put(('stop',))
+        # Leer mientras terminan: un worker no sale mientras su cola tenga datos sin leer
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            while process.is_alive() and time.monotonic() < deadline:
+                self._drain_results()
+                process.join(0.1)
+            if process.is_alive():
+                process.terminate()
+        self._drain_results()
+        self.queues, self.processes, self.results = [], [], None
+
+class DispatcherWorker:
+    """Worker de envío: programa y notifica los cambios a los usuarios de su shard"""
+
+    def __init__(self, index: int, shards: int, events: multiprocessing.Queue,
+                 results: multiprocessing.Queue):
+        self.index = index
+        self.shards = shards
+        self.events = events
+        self.results = results
+        self.configs: Dict[int, Dict] = {}
+        self.scheduler = DueScheduler()
+        self.renderer = MessageRenderer()
+        self.formatter = DolarService()
+        # El límite global de Telegram es por bot: se reparte entre los workers
+        self.dispatcher = BroadcastDispatcher(global_rate=BROADCAST_GLOBAL_RATE / shards)
+        # Estado del shard solo en memoria: los envíos se informan al proceso principal
+        self.cache = CacheManager(cache_file=None)
+        self.stopped = asyncio.Event()
+
+    def _apply_user(self, user_id: int, config: Optional[Dict], last_sent: float, now: float):
+        """Agrega, actualiza o quita un usuario del shard"""
+        if not config or not config.get('enabled', False):
+            self.configs.pop(user_id, None)
+            self.scheduler.cancel(user_id)
+            return
+        self.configs[user_id] = config
+        if last_sent > self.cache.get_user_last_sent(user_id):
+            self.cache.set_user_last_sent(user_id, last_sent)
+        if self._pending_markets(user_id, config):
+            self._schedule(user_id, config, now)
+        else:
+            self.scheduler.cancel(user_id)
+
+    def _pending_markets(self, user_id: int, config: Dict) -> Tuple[str, ...]:
+        """Mercados del usuario que cambiaron después de su último envío"""
+        last_sent_time = self.cache.get_user_last_sent(user_id)
+        return tuple(
+            market for market in config.get('markets') or [DEFAULT_MARKET]
+            if self.cache.get_last_change_time(market) > last_sent_time
+        )
+
+    def _schedule(self, user_id: int, config: Dict, now: float):
+        """Programa al usuario cuando le toque según su intervalo"""
+        interval_seconds = config.get('interval_seconds', 5)
+        self.scheduler.schedule(user_id, max(now, self.cache.get_user_last_sent(user_id) + interval_seconds))
+
+    def apply_event(self, event: tuple):
+        """Aplica un evento publicado por el proceso principal"""
+        kind = event[0]
+        now = time.time()
+        if kind == 'snapshot':
+            _, users, quotations, change_times = event
+            self.cache.set_last_quotations(quotations)
+            for market, change_time in change_times.items():
+                self.cache.set_markets_change_time([market], change_time)
+            for user_id, (config, last_sent) in users.items():
+                self._apply_user(user_id, config, last_sent, now)
+            logger.info(f"Worker {self.index}: {len(self.configs)} usuarios en el shard")
+        elif kind == 'change':
+            _, quotations, change_time = event
+            self.cache.set_last_quotations(quotations)
+            self.cache.set_markets_change_time(quotations.keys(), change_time)
+            # Solo los usuarios de estos mercados entran al planificador
+            for user_id, config in self.configs.items():
+                if user_id not in self.scheduler and not quotations.keys().isdisjoint(config.get('markets') or [DEFAULT_MARKET]):
+                    self._schedule(user_id, config, now)
+        elif kind == 'user':
+            _, user_id, config, last_sent = event
+            self._apply_user(user_id, config, last_sent, now)
+        elif kind == 'stop':
+            self.stopped.set()
+
+    async def read_events(self):
+        """Lee los eventos de la cola sin bloquear el event loop"""
+        loop = asyncio.get_running_loop()
+        while not self.stopped.is_set():
+            try:
+                event = await loop.run_in_executor(None, self.events.get, True, 1.0)
+            except queue.Empty:
+                continue
+            self.apply_event(event)
+
+    def build_change_message(self, markets: Tuple[str, ...]) -> str:
+        """Arma (o toma del cache) el mensaje de cambio para uno o más mercados"""
+        version = tuple(self.cache.get_last_change_time(market) for market in markets)
+
+        def build() -> str:
+            body = "\n\n".join(
+                self.formatter.format_single_quotation(
+                    self.cache.get_last_quotation(market),
+                    self.cache.get_last_change_time(market)
+                )
+                for market in markets
+            )
+            return body + MESSAGES['quotation_change_footer']
+
+        return self.renderer.get(version, 'change:' + ','.join(markets), build)
+
+    async def send_due(self, bot: Bot):
+        """Envía los cambios pendientes a los usuarios vencidos del shard"""
+        current_time = time.time()
+        recipients: Dict[Tuple[str, ...], List[int]] = {}
+        for user_id in self.scheduler.pop_due(current_time):
+            config = self.configs.get(user_id)
+            if not config:
+                continue
+            # Sin cambios pendientes el usuario queda fuera hasta el próximo evento 'change'
+            pending_markets = self._pending_markets(user_id, config)
+            if pending_markets:
+                recipients.setdefault(pending_markets, []).append(user_id)
+
+        if not recipients:
+            return
+        results = await asyncio.gather(*[
+            self.dispatcher.broadcast(bot, user_ids, self.build_change_message(markets))
+            for markets, user_ids in recipients.items()
+        ])
+        delivered = [user_id for group in results for user_id in group]
+        if delivered:
+            self.cache.set_users_last_sent(delivered, current_time)
+            self.results.put(('sent', delivered, current_time))
+            logger.info(f"Worker {self.index}: cambios enviados a {len(delivered)} usuarios")
+        # Los envíos fallidos se reintentan en un intervalo
+        delivered_set = set(delivered)
+        retry_time = time.time()
+        for user_ids in recipients.values():
+            for user_id in user_ids:
+                config = self.configs.get(user_id)
+                if user_id not in delivered_set and config:
+                    self.scheduler.schedule(user_id, retry_time + config.get('interval_seconds', 5))
+
+    async def run(self):
+        """Loop principal del worker"""
+        bot = Bot(BOT_TOKEN, request=HTTPXRequest(connection_pool_size=BROADCAST_CONCURRENCY))
+        await bot.initialize()
+        reader = asyncio.create_task(self.read_events())
+        try:
+            while not self.stopped.is_set():
+                try:
+                    await self.scheduler.wait_for_due(max_wait=1.0)
+                    await self.send_due(bot)
+                except Exception as e:
+                    logger.error(f"Worker {self.index}: error en el envío: {e}")
+                    await asyncio.sleep(1)
+        finally:
+            reader.cancel()
+            await bot.shutdown()
+
+def run_worker(index: int, shards: int, events: multiprocessing.Queue, results: multiprocessing.Queue):
+    """Punto de entrada del proceso worker"""
+    try:
+        asyncio.run(DispatcherWorker(index, shards, events, results).run())
+    except KeyboardInterrupt:
+        pass
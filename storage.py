@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from config import STORAGE_BACKEND, SQLITE_PATH
+
+# Configurar logger para el almacenamiento
+logger = logging.getLogger(__name__)
+
+class StorageBackend:
+    """Interfaz de almacenamiento para configuraciones de usuarios y cache"""
+
+    # Configuraciones de usuarios
+    def load_user_configs(self) -> Dict[str, Dict]:
+        """Carga todas las configuraciones de usuarios"""
+        raise NotImplementedError
+
+    def iter_user_configs(self, batch_size: int = 1000) -> Iterator[Tuple[str, Dict]]:
+        """Itera las configuraciones de usuarios en orden de id, leyendo de a batch_size"""
+        return iter(sorted(self.load_user_configs().items(), key=lambda item: int(item[0])))
+
+    def get_user_config(self, user_id: int) -> Optional[Dict]:
+        """Obtiene la configuración de un usuario"""
+        raise NotImplementedError
+
+    def save_user_config(self, user_id: int, config: Dict):
+        """Guarda (inserta o actualiza) la configuración de un usuario"""
+        raise NotImplementedError
+
+    def delete_user_config(self, user_id: int):
+        """Elimina la configuración de un usuario"""
+        raise NotImplementedError
+
+    # Cache
+    def get_value(self, key: str, default: Any = None) -> Any:
+        """Obtiene un valor del cache"""
+        raise NotImplementedError
+
+    def set_value(self, key: str, value: Any):
+        """Guarda un valor en el cache"""
+        raise NotImplementedError
+
+    def load_user_last_sent(self) -> Dict[str, float]:
+        """Carga todos los tiempos de último envío"""
+        raise NotImplementedError
+
+    def iter_user_last_sent(self, batch_size: int = 1000) -> Iterator[Tuple[int, float]]:
+        """Itera los tiempos de último envío en orden de id, leyendo de a batch_size"""
+        return iter(sorted((int(user_id), timestamp) for user_id, timestamp in self.load_user_last_sent().items()))
+
+    def set_users_last_sent(self, items: Iterable[Tuple[int, float]]):
+        """Guarda varios tiempos de último envío en una sola transacción"""
+        raise NotImplementedError
+
+    def delete_user_last_sent(self, user_id: int):
+        """Elimina el tiempo de último envío de un usuario"""
+        raise NotImplementedError
+
+    def clear_cache(self):
+        """Elimina todos los datos del cache"""
+        raise NotImplementedError
+
+    def is_empty(self) -> bool:
+        """Indica si el almacenamiento no tiene datos"""
+        raise NotImplementedError
+
+    def close(self):
+        """Cierra el almacenamiento"""
+        pass
+
+class SQLiteStorage(StorageBackend):
+    """Almacenamiento en SQLite (modo WAL) con actualizaciones fila por fila"""
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS user_configs (
+            user_id INTEGER PRIMARY KEY,
+            enabled INTEGER NOT NULL,
+            interval_seconds INTEGER NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_user_configs_enabled ON user_configs(enabled);
+        CREATE TABLE IF NOT EXISTS user_last_sent (
+            user_id INTEGER PRIMARY KEY,
+            last_sent REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS kv (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    '''
+
+    def __init__(self, db_path: str = "bot_data.sqlite3"):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+
+    def _execute(self, sql: str, params: Tuple = ()):
+        """Ejecuta una sentencia con el lock tomado"""
+        with self.lock:
+            self.conn.execute(sql, params)
+
+    def _query(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        """Ejecuta una consulta con el lock tomado y devuelve todas las filas"""
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _execute_many(self, sql: str, rows: Iterable[Tuple]):
+        """Ejecuta una sentencia para muchas filas dentro de una transacción"""
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.executemany(sql, rows)
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def _iter_batches(self, table: str, column: str, batch_size: int) -> Iterator[Tuple[int, Any]]:
+        """
+        Itera (user_id, columna) de una tabla en orden de id con consultas de a batch_size
+
+        Cada tanda es una consulta aparte (paginada por id), así el lock no
+        queda tomado entre tandas y las escrituras pueden intercalarse.
+        """
+        last_id = None
+        while True:
+            if last_id is None:
+                rows = self._query(f'SELECT user_id, {column} FROM {table} ORDER BY user_id LIMIT ?', (batch_size,))
+            else:
+                rows = self._query(
+                    f'SELECT user_id, {column} FROM {table} WHERE user_id > ? ORDER BY user_id LIMIT ?',
+                    (last_id, batch_size)
+                )
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def load_user_configs(self) -> Dict[str, Dict]:
+        rows = self._query('SELECT user_id, data FROM user_configs')
+        return {str(user_id): json.loads(data) for user_id, data in rows}
+
+    def iter_user_configs(self, batch_size: int = 1000) -> Iterator[Tuple[str, Dict]]:
+        for user_id, data in self._iter_batches('user_configs', 'data', batch_size):
+            yield str(user_id), json.loads(data)
+
+    def get_user_config(self, user_id: int) -> Optional[Dict]:
+        rows = self._query('SELECT data FROM user_configs WHERE user_id = ?', (int(user_id),))
+        return json.loads(rows[0][0]) if rows else None
+
+    def save_user_config(self, user_id: int, config: Dict):
+        self._execute(
+            'INSERT INTO user_configs (user_id, enabled, interval_seconds, data) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(user_id) DO UPDATE SET enabled = excluded.enabled, '
+            'interval_seconds = excluded.interval_seconds, data = excluded.data',
+            (int(user_id), int(bool(config.get('enabled', False))),
+             int(config.get('interval_seconds', 0)), json.dumps(config, ensure_ascii=False))
+        )
+
+    def save_user_configs(self, configs: Dict[str, Dict]):
+        """Guarda muchas configuraciones en una sola transacción"""
+        self._execute_many(
+            'INSERT OR REPLACE INTO user_configs (user_id, enabled, interval_seconds, data) VALUES (?, ?, ?, ?)',
+            ((int(user_id), int(bool(config.get('enabled', False))),
+              int(config.get('interval_seconds', 0)), json.dumps(config, ensure_ascii=False))
+             for user_id, config in configs.items())
+        )
+
+    def delete_user_config(self, user_id: int):
+        self._execute('DELETE FROM user_configs WHERE user_id = ?', (int(user_id),))
+
+    def get_value(self, key: str, default: Any = None) -> Any:
+        rows = self._query('SELECT value FROM kv WHERE key = ?', (key,))
+        return json.loads(rows[0][0]) if rows else default
+
+    def set_value(self, key: str, value: Any):
+        self._execute(
+            'INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)',
+            (key, json.dumps(value, ensure_ascii=False))
+        )
+
+    def load_user_last_sent(self) -> Dict[str, float]:
+        rows = self._query('SELECT user_id, last_sent FROM user_last_sent')
+        return {str(user_id): last_sent for user_id, last_sent in rows}
+
+    def iter_user_last_sent(self, batch_size: int = 1000) -> Iterator[Tuple[int, float]]:
+        return self._iter_batches('user_last_sent', 'last_sent', batch_size)
+
+    def set_users_last_sent(self, items: Iterable[Tuple[int, float]]):
+        self._execute_many(
+            'INSERT OR REPLACE INTO user_last_sent (user_id, last_sent) VALUES (?, ?)',
+            ((int(user_id), float(timestamp)) for user_id, timestamp in items)
+        )
+
+    def delete_user_last_sent(self, user_id: int):
+        self._execute('DELETE FROM user_last_sent WHERE user_id = ?', (int(user_id),))
+
+    def clear_cache(self):
+        with self.lock:
+            self.conn.execute('BEGIN')
+            self.conn.execute('DELETE FROM user_last_sent')
+            self.conn.execute('DELETE FROM kv WHERE key != ?', ('migrated_from_json',))
+            self.conn.execute('COMMIT')
+
+    def is_empty(self) -> bool:
+        for table in ('user_configs', 'user_last_sent', 'kv'):
+            if self._query(f'SELECT 1 FROM {table} LIMIT 1'):
+                return False
+        return True
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def _read_json(path: str) -> Optional[Dict]:
+    """Lee un archivo JSON, devolviendo None si no existe o es inválido"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"No se pudo leer {path} para migrar: {e}")
+        return None
+
+def migrate_json_to_sqlite(storage: SQLiteStorage,
+                           config_file: str = "user_configs.json",
+                           cache_file: str = "bot_cache.json") -> Dict[str, int]:
+    """
+    Migra (una sola vez) los archivos JSON existentes a SQLite
+
+    Args:
+        storage: Almacenamiento SQLite destino
+        config_file: Archivo de configuraciones de usuarios
+        cache_file: Archivo de cache
+
+    Returns:
+        Dict con la cantidad de registros migrados
+    """
+    result = {'user_configs': 0, 'user_last_sent': 0}
+    if storage.get_value('migrated_from_json'):
+        return result
+    if not storage.is_empty():
+        # Ya tiene datos propios: no pisarlos con los archivos viejos
+        storage.set_value('migrated_from_json', True)
+        return result
+
+    configs = _read_json(config_file)
+    if configs:
+        storage.save_user_configs(configs)
+        result['user_configs'] = len(configs)
+
+    cache = _read_json(cache_file)
+    if cache:
+        # Import diferido: cache_manager importa este módulo
+        from cache_manager import CacheManager
+        # Llevar caches viejos (solo dólar oficial) al formato por mercado
+        cache = CacheManager._upgrade_cache(cache)
+        user_last_sent = cache.pop('user_last_sent', None) or {}
+        storage.set_users_last_sent(user_last_sent.items())
+        result['user_last_sent'] = len(user_last_sent)
+        for key, value in cache.items():
+            if value is not None:
+                storage.set_value(key, value)
+
+    storage.set_value('migrated_from_json', True)
+    logger.info(f"Migración de JSON a SQLite completada: {result}")
+    return result
+
+def create_storage() -> Optional[StorageBackend]:
+    """
+    Crea el almacenamiento configurado en STORAGE_BACKEND
+
+    No migra los archivos JSON: eso lo hace migrate_json_to_sqlite() al
+    arrancar (main.warm_up), así importar el bot no lee archivos grandes.
+
+    Returns:
+        StorageBackend o None si se usan los archivos JSON
+    """
+    if STORAGE_BACKEND != 'sqlite':
+        return None
+    return SQLiteStorage(SQLITE_PATH)
+
+if __name__ == '__main__':
+    # Migración manual: python storage.py [db_path] [user_configs.json] [bot_cache.json]
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    args = sys.argv[1:]
+    db = SQLiteStorage(args[0] if len(args) > 0 else SQLITE_PATH)
+    print(migrate_json_to_sqlite(
+        db,
+        args[1] if len(args) > 1 else "user_configs.json",
+        args[2] if len(args) > 2 else "bot_cache.json"
+    ))
+    db.close()
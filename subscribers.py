@@ -0,0 +1,160 @@
+import asyncio
+import heapq
+from array import array
+from bisect import bisect_left
+from itertools import islice
+from typing import Dict, Iterable, Iterator, Tuple
+
+# A partir de cuántos usuarios nuevos conviene reordenar todo en lugar de insertar
+BULK_INSERT_THRESHOLD = 64
+
+class IdTable:
+    """
+    Ids de usuario ordenados (int64) con columnas paralelas en arrays tipados
+
+    Cada usuario ocupa unos pocos bytes por columna, en lugar de una clave str
+    y un dict por usuario. Las búsquedas son por bisección sobre los ids.
+    """
+
+    def __init__(self, columns: Dict[str, str]):
+        """
+        Args:
+            columns: {nombre: typecode de array} de cada columna (ej. {'last_sent': 'd'})
+        """
+        self.ids = array('q')
+        self.columns = {name: array(typecode) for name, typecode in columns.items()}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.find(user_id) >= 0
+
+    def find(self, user_id: int) -> int:
+        """Posición del usuario en las columnas, o -1 si no está"""
+        position = bisect_left(self.ids, user_id)
+        if position < len(self.ids) and self.ids[position] == user_id:
+            return position
+        return -1
+
+    def get(self, column: str, user_id: int, default=None):
+        """Valor de una columna para un usuario"""
+        position = self.find(user_id)
+        return self.columns[column][position] if position >= 0 else default
+
+    def upsert(self, user_id: int, **values) -> int:
+        """
+        Agrega un usuario o actualiza sus valores (las columnas omitidas quedan en 0 al agregar)
+
+        Returns:
+            int: Posición del usuario
+        """
+        position = bisect_left(self.ids, user_id)
+        if position < len(self.ids) and self.ids[position] == user_id:
+            for column, value in values.items():
+                self.columns[column][position] = value
+            return position
+        self.ids.insert(position, user_id)
+        for column, data in self.columns.items():
+            data.insert(position, values.get(column, 0))
+        return position
+
+    def upsert_many(self, user_ids: Iterable[int], **values):
+        """
+        Igual que upsert() para muchos usuarios con los mismos valores
+
+        Los usuarios nuevos se agregan con un solo reordenamiento en lugar de
+        insertar uno por uno (cada inserción mueve la cola de los arrays).
+        """
+        new_ids = []
+        for user_id in user_ids:
+            position = self.find(user_id)
+            if position < 0:
+                new_ids.append(user_id)
+                continue
+            for column, value in values.items():
+                self.columns[column][position] = value
+        if len(new_ids) <= BULK_INSERT_THRESHOLD:
+            for user_id in new_ids:
+                self.upsert(user_id, **values)
+            return
+        defaults = tuple(values.get(column, 0) for column in self.columns)
+        rows = list(zip(self.ids, *self.columns.values()))
+        rows.extend((user_id,) + defaults for user_id in set(new_ids))
+        self.load(rows)
+
+    def delete(self, user_id: int) -> bool:
+        """Quita un usuario; devuelve False si no estaba"""
+        position = self.find(user_id)
+        if position < 0:
+            return False
+        del self.ids[position]
+        for data in self.columns.values():
+            del data[position]
+        return True
+
+    def clear(self):
+        """Quita todos los usuarios"""
+        del self.ids[:]
+        for data in self.columns.values():
+            del data[:]
+
+    def load(self, rows: Iterable[Tuple]):
+        """
+        Reemplaza el contenido con filas (user_id, valor de cada columna en orden)
+
+        Ordena una sola vez en lugar de insertar fila por fila.
+        """
+        self.clear()
+        for row in sorted(rows, key=lambda row: row[0]):
+            self.ids.append(row[0])
+            for data, value in zip(self.columns.values(), row[1:]):
+                data.append(value)
+
+    def append(self, user_id: int, *values) -> bool:
+        """
+        Agrega una fila al final, sin buscar su posición (carga por tandas)
+
+        Args:
+            user_id: ID del usuario
+            values: Valor de cada columna, en orden
+
+        Returns:
+            bool: False si el id no quedó después del último; la tabla queda
+                desordenada hasta llamar a sort()
+        """
+        ordered = not self.ids or self.ids[-1] < user_id
+        self.ids.append(user_id)
+        for data, value in zip(self.columns.values(), values):
+            data.append(value)
+        return ordered
+
+    def sort(self):
+        """Reordena las filas por id (después de append() fuera de orden)"""
+        self.load(list(zip(self.ids, *self.columns.values())))
+
+    async def sort_async(self, chunk_size: int):
+        """
+        Igual que sort(), pero cediendo el event loop cada chunk_size filas
+
+        Un solo sorted() sobre un millón de filas retiene el GIL cerca de un
+        segundo; acá se ordenan tramos chicos y se mezclan con heapq.merge.
+        """
+        runs = []
+        for start in range(0, len(self.ids), chunk_size):
+            end = start + chunk_size
+            runs.append(sorted(zip(self.ids[start:end], *(data[start:end] for data in self.columns.values()))))
+            await asyncio.sleep(0)
+        self.clear()
+        merged = heapq.merge(*runs)
+        while True:
+            chunk = list(islice(merged, chunk_size))
+            if not chunk:
+                return
+            for row in chunk:
+                self.append(*row)
+            await asyncio.sleep(0)
+
+    def items(self, column: str) -> Iterator[Tuple[int, object]]:
+        """Itera (user_id, valor) de una columna en orden de id"""
+        return zip(self.ids, self.columns[column])
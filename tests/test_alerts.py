@@ -0,0 +1,40 @@
+from alerts import AlertIndex, DOWN, UP
+
+def make_index(tmp_path) -> AlertIndex:
+    index = AlertIndex(str(tmp_path / 'alerts.json'))
+    for user_id, direction, threshold in [
+        (1, UP, 1000.0), (2, UP, 1010.0), (3, UP, 1020.0), (4, UP, 1030.0),
+        (5, DOWN, 970.0), (6, DOWN, 980.0), (7, DOWN, 990.0), (8, DOWN, 1000.0),
+    ]:
+        index.add_alert(user_id, 'blue', direction, threshold)
+    return index
+
+def test_rising_price_fires_thresholds_above_old_up_to_new(tmp_path):
+    index = make_index(tmp_path)
+    # (1000, 1020]: el umbral igual al precio anterior ya estaba cruzado, el igual al nuevo se dispara
+    assert index.pop_triggered('blue', 1000.0, 1020.0) == [(2, UP, 1010.0), (3, UP, 1020.0)]
+    assert index.get_user_alerts(1) == [('blue', UP, 1000.0)]
+    assert index.get_user_alerts(3) == []
+    # Ya disparadas: no se repiten
+    assert index.pop_triggered('blue', 1000.0, 1020.0) == []
+
+def test_falling_price_fires_thresholds_from_new_up_to_below_old(tmp_path):
+    index = make_index(tmp_path)
+    # [980, 1000)
+    assert index.pop_triggered('blue', 1000.0, 980.0) == [(6, DOWN, 980.0), (7, DOWN, 990.0)]
+    assert index.get_user_alerts(8) == [('blue', DOWN, 1000.0)]
+    assert index.count() == 6
+
+def test_unchanged_or_unknown_prices_fire_nothing(tmp_path):
+    index = make_index(tmp_path)
+    assert index.pop_triggered('blue', 1000.0, 1000.0) == []
+    assert index.pop_triggered('blue', None, 1030.0) == []
+    assert index.pop_triggered('oficial', 900.0, 2000.0) == []
+    assert index.count() == 8
+
+def test_alerts_survive_a_reload(tmp_path):
+    index = make_index(tmp_path)
+    index.pop_triggered('blue', 1000.0, 1020.0)
+    reloaded = AlertIndex(str(tmp_path / 'alerts.json'))
+    assert reloaded.count() == 6
+    assert reloaded.pop_triggered('blue', 1020.0, 1030.0) == [(4, UP, 1030.0)]
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import pytest
+from cache_manager import CacheManager
+from chunked_load import iter_json_object
+from user_config import UserConfig
+
+def test_members_match_json_loads_with_any_whitespace():
+    data = {'a': [1, {'b': None}], 'c': 'x', 'd': {}}
+    for text in (json.dumps(data), json.dumps(data, indent=2), '\n' + json.dumps(data, indent=4) + '\n'):
+        assert dict(iter_json_object(text)) == data
+
+def test_nested_object_is_read_member_by_member():
+    text = json.dumps({'head': 1, 'users': {'2': 2.0, '1': 1.0}, 'tail': [3]}, indent=2)
+    members = iter_json_object(text, nested=('users',))
+    assert next(members) == ('head', 1)
+    key, users = next(members)
+    assert key == 'users'
+    assert list(users) == [('2', 2.0), ('1', 1.0)]
+    assert list(members) == [('tail', [3])]
+
+def test_unread_nested_object_is_skipped():
+    text = json.dumps({'users': {'1': 1.0}, 'tail': 2})
+    assert [key for key, _ in iter_json_object(text, nested=('users',))] == ['users', 'tail']
+
+def test_truncated_text_raises_decode_error():
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_object('{"a": 1, "b": {"c": 2'))
+
+def test_user_configs_load_async_matches_load(tmp_path):
+    path = tmp_path / 'user_configs.json'
+    # Ids desordenados, como en archivos de versiones anteriores
+    configs = {
+        str(user_id): {'interval_seconds': 5 + user_id % 50, 'enabled': user_id % 3 != 0, 'markets': ['blue']}
+        for user_id in range(500, 0, -1)
+    }
+    configs['7']['interval_seconds'] = 1000
+    path.write_text(json.dumps(configs, indent=2))
+    expected = UserConfig(str(path))
+    loaded = UserConfig(str(path), lazy=True)
+    asyncio.run(loaded.load_async(chunk_size=64))
+    assert loaded.configs == expected.configs
+    assert loaded.get_active_intervals() == expected.get_active_intervals()
+    assert loaded.count_active() == expected.count_active()
+
+def test_cache_load_async_matches_load(tmp_path):
+    path = tmp_path / 'bot_cache.json'
+    path.write_text(json.dumps({
+        'last_quotation': {'venta': 1000},
+        'user_last_sent': {str(user_id): float(user_id) for user_id in range(300, 0, -1)},
+        'last_updated': 5.0,
+    }))
+    expected = CacheManager(str(path))
+    loaded = CacheManager(str(path), lazy=True)
+    asyncio.run(loaded.load_async(chunk_size=64))
+    assert loaded.cache == expected.cache
+    assert loaded.get_all_user_times() == expected.get_all_user_times()
+
+def test_load_is_refused_while_loading_in_chunks(tmp_path):
+    path = tmp_path / 'user_configs.json'
+    path.write_text(json.dumps({str(user_id): {'interval_seconds': 10, 'enabled': True} for user_id in range(10)}))
+    user_config = UserConfig(str(path), lazy=True)
+
+    async def scenario():
+        task = asyncio.create_task(user_config.load_async(chunk_size=2))
+        await asyncio.sleep(0)
+        with pytest.raises(RuntimeError):
+            user_config.count_active()
+        await task
+
+    asyncio.run(scenario())
+    assert user_config.count_active() == 10
@@ -0,0 +1,47 @@
+from dolar_service import DolarService
+
+def quotation(market: str, venta: float, updated: str) -> dict:
+    return {'casa': market, 'compra': venta - 20, 'venta': venta, 'fechaActualizacion': updated}
+
+def make_service(cached: dict) -> DolarService:
+    service = DolarService(endpoints=['http://primary/v1/dolares', 'http://mirror/v1/dolares'])
+    service._cached_quotations = cached
+    service.version = 1
+    return service
+
+def test_older_markets_from_a_lagging_source_are_ignored():
+    cached = {
+        'blue': quotation('blue', 1100, '2024-05-10T15:00:00.000Z'),
+        'oficial': quotation('oficial', 900, '2024-05-10T15:00:00.000Z'),
+    }
+    service = make_service(cached)
+    result = service._accept({
+        'blue': quotation('blue', 1080, '2024-05-10T14:00:00.000Z'),
+        'oficial': quotation('oficial', 905, '2024-05-10T15:05:00.000Z'),
+    })
+    assert result['blue']['venta'] == 1100
+    assert result['oficial']['venta'] == 905
+    assert service.version == 2
+
+def test_fully_stale_snapshot_keeps_cache_and_version():
+    cached = {'blue': quotation('blue', 1100, '2024-05-10T15:00:00.000Z')}
+    service = make_service(cached)
+    result = service._accept({'blue': quotation('blue', 1080, '2024-05-10T14:00:00.000Z')})
+    assert result is cached
+    assert service.version == 1
+
+def test_newer_or_undated_markets_are_taken():
+    cached = {'blue': quotation('blue', 1100, '2024-05-10T15:00:00.000Z')}
+    service = make_service(cached)
+    result = service._accept({
+        'blue': quotation('blue', 1110, '2024-05-10T15:01:00.000Z'),
+        'cripto': {'casa': 'cripto', 'compra': 1, 'venta': 2},
+    })
+    assert result['blue']['venta'] == 1110
+    assert 'cripto' in result
+    assert service.version == 2
+
+def test_first_snapshot_is_taken_as_is():
+    service = make_service(None)
+    fresh = {'blue': quotation('blue', 1100, '2024-05-10T15:00:00.000Z')}
+    assert service._accept(fresh) is fresh
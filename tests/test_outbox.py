@@ -0,0 +1,84 @@
+import json
+from cache_manager import CacheManager
+from outbox import Outbox
+
+def read_journal(path) -> list:
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+def test_recover_replays_acks_and_drops_a_truncated_last_line(tmp_path):
+    path = tmp_path / 'outbox.jsonl'
+    lines = [
+        {'op': 'enqueue', 'id': 1, 'at': 10.0, 'markets': ['blue'], 'text': 'hola', 'users': [1, 2, 3, 4]},
+        {'op': 'ack', 'id': 1, 'delivered': [1], 'failed': [2]},
+    ]
+    text = ''.join(json.dumps(line) + '\n' for line in lines)
+    # Caída a mitad de la escritura de una confirmación
+    path.write_text(text + '{"op": "ack", "id": 1, "deliv')
+    outbox = Outbox(str(path))
+    entries = outbox.recover()
+    assert len(entries) == 1
+    entry = entries[0]
+    assert entry.pending == {3, 4}
+    assert entry.delivered == [1]
+    assert outbox.is_pending(3) and not outbox.is_pending(1)
+    # Las entradas nuevas siguen la numeración del journal
+    assert outbox.enqueue(['blue'], 'otro', [5]).id == 2
+
+def test_acks_are_written_on_checkpoint_and_done_closes_an_entry(tmp_path):
+    path = tmp_path / 'outbox.jsonl'
+    outbox = Outbox(str(path), checkpoint_size=100)
+    first = outbox.enqueue(['blue'], 'a', [1, 2])
+    second = outbox.enqueue(['oficial'], 'b', [3])
+    outbox.record(first, 1, True)
+    outbox.record(first, 2, False)
+    # Un envío repetido no se confirma dos veces
+    outbox.record(first, 1, True)
+    assert [record['op'] for record in read_journal(path)] == ['enqueue', 'enqueue']
+    outbox.checkpoint()
+    assert read_journal(path)[-1] == {'op': 'ack', 'id': first.id, 'delivered': [1], 'failed': [2]}
+
+    outbox.complete([first.id])
+    assert read_journal(path)[-1] == {'op': 'done', 'id': first.id}
+    recovered = Outbox(str(path)).recover()
+    assert [entry.id for entry in recovered] == [second.id]
+    assert recovered[0].pending == {3}
+
+def test_completing_the_last_entry_compacts_the_journal_and_resets_ids(tmp_path):
+    path = tmp_path / 'outbox.jsonl'
+    outbox = Outbox(str(path))
+    entries = [outbox.enqueue(['blue'], 'a', [1]), outbox.enqueue(['blue'], 'b', [2])]
+    for entry, user_id in zip(entries, (1, 2)):
+        outbox.record(entry, user_id, True)
+    outbox.complete([entry.id for entry in entries])
+    assert path.read_text() == ''
+    assert not outbox.is_pending(1)
+    assert outbox.enqueue(['blue'], 'c', [3]).id == 1
+    assert Outbox(str(path)).recover()[0].text == 'c'
+
+def test_entries_close_only_once_the_covering_generation_is_flushed(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.jsonl'))
+    entry = outbox.enqueue(['blue'], 'a', [1])
+    outbox.record(entry, 1, True)
+    outbox.complete_after([entry.id], 5)
+    # Un guardado anterior (foto tomada antes de registrar los envíos) no la cierra
+    outbox.on_cache_flushed(4)
+    assert entry.id in outbox.entries
+    outbox.on_cache_flushed(5)
+    assert entry.id not in outbox.entries
+
+def test_cache_flush_of_the_last_sent_times_closes_the_entry(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.jsonl'))
+    cache_manager = CacheManager(str(tmp_path / 'bot_cache.json'), write_behind=True)
+    cache_manager.on_flushed = outbox.on_cache_flushed
+    entry = outbox.enqueue(['blue'], 'a', [1, 2])
+    # Un guardado en curso con una foto previa a los envíos
+    cache_manager.set_last_change_time(1.0, 'blue')
+    previous_generation = cache_manager.generation
+    for user_id in (1, 2):
+        outbox.record(entry, user_id, True)
+    cache_manager.set_users_last_sent([1, 2], 2.0)
+    outbox.complete_after([entry.id], cache_manager.generation)
+    outbox.on_cache_flushed(previous_generation)
+    assert entry.id in outbox.entries
+    assert cache_manager.flush()
+    assert entry.id not in outbox.entries
@@ -0,0 +1,30 @@
+from scheduler import DueScheduler
+
+def test_stale_entries_are_skipped_and_compacted():
+    scheduler = DueScheduler()
+    for round_ in range(5):
+        for user_id in range(100):
+            scheduler.schedule(user_id, 1000.0 + round_ * 10 + user_id)
+    for user_id in range(50, 100):
+        scheduler.cancel(user_id)
+    assert len(scheduler) == 50
+    assert len(scheduler._heap) == 500
+
+    assert scheduler.next_due_time() == 1040.0
+    # Con más del doble de entradas que usuarios, el heap se rearma solo con las vigentes
+    assert len(scheduler._heap) == 50
+
+    assert scheduler.pop_due(1045.0) == [0, 1, 2, 3, 4, 5]
+    assert scheduler.pop_due(2000.0) == list(range(6, 50))
+    assert len(scheduler) == 0
+    assert scheduler.next_due_time() is None
+
+def test_rescheduling_keeps_only_the_latest_due_time():
+    scheduler = DueScheduler()
+    scheduler.schedule(1, 10.0)
+    scheduler.schedule(1, 30.0)
+    scheduler.schedule(2, 20.0)
+    assert scheduler.pop_due(25.0) == [2]
+    assert 1 in scheduler
+    assert scheduler.pop_due(30.0) == [1]
+    assert scheduler.pop_due(100.0) == []
@@ -0,0 +1,33 @@
+from subscribers import BULK_INSERT_THRESHOLD, IdTable
+
+def make_table() -> IdTable:
+    table = IdTable({'last_sent': 'd', 'interval': 'B'})
+    table.load([(30, 3.0, 10), (10, 1.0, 20), (20, 2.0, 30)])
+    return table
+
+def test_upsert_many_updates_existing_rows_and_inserts_new_ones():
+    table = make_table()
+    table.upsert_many([20, 15, 40, 15], last_sent=9.0)
+    assert list(table.ids) == [10, 15, 20, 30, 40]
+    assert list(table.columns['last_sent']) == [1.0, 9.0, 9.0, 3.0, 9.0]
+    # Las columnas omitidas se conservan en las filas existentes y quedan en 0 en las nuevas
+    assert list(table.columns['interval']) == [20, 0, 30, 10, 0]
+
+def test_upsert_many_bulk_path_merges_into_existing_rows():
+    table = make_table()
+    new_ids = list(range(1000, 1000 + 2 * BULK_INSERT_THRESHOLD))
+    # Ids nuevos desordenados y repetidos, mezclados con existentes
+    table.upsert_many(new_ids[::-1] + [10, 30] + new_ids[:5], last_sent=5.0)
+    assert list(table.ids) == [10, 20, 30] + new_ids
+    assert table.get('last_sent', 10) == 5.0
+    assert table.get('last_sent', 20) == 2.0
+    assert table.get('interval', 30) == 10
+    assert all(table.get('last_sent', user_id) == 5.0 for user_id in new_ids)
+    assert all(table.get('interval', user_id) == 0 for user_id in new_ids)
+
+def test_delete_and_find_keep_columns_aligned():
+    table = make_table()
+    assert table.delete(20)
+    assert not table.delete(20)
+    assert table.find(20) == -1
+    assert list(table.items('interval')) == [(10, 20), (30, 10)]
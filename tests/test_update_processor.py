@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime
+from telegram import Chat, Message, Update, User
+from update_processor import PerUserUpdateProcessor
+
+def make_update(update_id: int, user_id: int) -> Update:
+    return Update(update_id, message=Message(
+        update_id, datetime.now(), Chat(user_id, Chat.PRIVATE),
+        from_user=User(user_id, 'test', False), text='/cotizacion'
+    ))
+
+def test_queued_updates_of_one_user_do_not_block_other_users():
+    async def scenario():
+        processor = PerUserUpdateProcessor(4)
+        finished = {}
+
+        async def handler(name: str, seconds: float):
+            await asyncio.sleep(seconds)
+            finished[name] = asyncio.get_running_loop().time()
+
+        started = asyncio.get_running_loop().time()
+        # Cinco updates lentos del usuario A (más que los lugares disponibles)
+        tasks = [
+            asyncio.create_task(processor.process_update(make_update(i, 1), handler(f'a{i}', 0.2)))
+            for i in range(5)
+        ]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(processor.process_update(make_update(10, 2), handler('b', 0))))
+        await asyncio.gather(*tasks)
+        return started, finished
+
+    started, finished = asyncio.run(scenario())
+    # B no espera detrás de los updates encolados de A
+    assert finished['b'] - started < 0.1
+    # Los de A se procesan en orden, de a uno
+    order = sorted((name for name in finished if name.startswith('a')), key=finished.get)
+    assert order == [f'a{i}' for i in range(5)]
+
+def test_concurrency_limit_applies_to_updates_being_processed():
+    async def scenario():
+        processor = PerUserUpdateProcessor(2)
+        running = peak = 0
+
+        async def handler():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*[
+            processor.process_update(make_update(i, 100 + i), handler()) for i in range(6)
+        ])
+        return peak, processor
+
+    peak, processor = asyncio.run(scenario())
+    assert peak == 2
+    # Los locks de usuarios sin updates pendientes se liberan
+    assert not processor._locks and not processor._waiting
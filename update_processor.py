@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import sys
+from typing import Any, Awaitable, Dict, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Configurar logger para el procesador de updates
+logger = logging.getLogger(__name__)
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Procesa updates de distintos usuarios en paralelo y los de un mismo usuario en orden
+
+    El orden por usuario mantiene correcto el estado de los ConversationHandler
+    (ej. /configurar seguido de los minutos), mientras que un handler lento de
+    un usuario no demora a los demás.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        """
+        Args:
+            max_concurrent_updates: Updates que se procesan a la vez como máximo
+        """
+        # El semáforo de PTB se toma antes de do_process_update(): si limitara, los
+        # updates encolados detrás de un mismo usuario ocuparían lugares mientras
+        # esperan su lock. Se deja sin límite y se limita acá, después del lock.
+        super().__init__(sys.maxsize)
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates debe ser positivo")
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # Un lock por usuario con updates en curso; se borra cuando nadie lo espera
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiting: Dict[int, int] = {}
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        """Usuario (o chat) que define el orden del update"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Espera a que terminen los updates anteriores del mismo usuario y procesa este"""
+        key = self._key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                # Solo ocupa un lugar el update que efectivamente se procesa
+                async with self._slots:
+                    await coroutine
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        """No requiere inicialización"""
+
+    async def shutdown(self) -> None:
+        """No requiere liberar recursos"""
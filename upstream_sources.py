@@ -0,0 +1,139 @@
+import logging
+import math
+import time
+from collections import deque
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+from config import (
+    HTTP_TOTAL_TIMEOUT, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT,
+    HEDGE_PERCENTILE, HEDGE_MIN_DELAY, HEDGE_DEFAULT_DELAY, SOURCE_LATENCY_WINDOW,
+)
+
+# Configurar logger para las fuentes de cotizaciones
+logger = logging.getLogger(__name__)
+
+# Muestras necesarias antes de confiar en el percentil de una fuente
+MIN_LATENCY_SAMPLES = 10
+
+# Peso de cada resultado en la tasa de error (media móvil exponencial)
+ERROR_RATE_ALPHA = 0.2
+
+class UpstreamSource:
+    """
+    Una fuente de cotizaciones (dolarapi o un espejo compatible) y sus estadísticas
+
+    Guarda las últimas latencias para estimar la mediana y el percentil de
+    cobertura, una tasa de error suavizada y sus propios validadores HTTP
+    (ETag / Last-Modified), que no sirven entre fuentes distintas.
+    """
+
+    def __init__(self, endpoint: str, window: int = SOURCE_LATENCY_WINDOW):
+        """
+        Args:
+            endpoint: URL de la colección de cotizaciones (ej. https://dolarapi.com/v1/dolares)
+            window: Cantidad de latencias recientes que se guardan
+        """
+        self.endpoint = endpoint
+        self.name = urlsplit(endpoint).netloc or endpoint
+        self.latencies = deque(maxlen=window)
+        self.error_rate = 0.0
+        self.failures = 0
+        self.retry_at = 0.0
+        self.requests = 0
+        self.wins = 0
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        # Hash del último cuerpo de esta fuente, para no decodificar una respuesta repetida
+        self.body_hash: Optional[bytes] = None
+
+    @property
+    def healthy(self) -> bool:
+        """False mientras la fuente está en pausa por fallos seguidos"""
+        return self.failures < CIRCUIT_FAILURE_THRESHOLD or time.monotonic() >= self.retry_at
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Percentil de las latencias recientes (None si no hay muestras)"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+    def hedge_delay(self) -> float:
+        """Segundos a esperar esta fuente antes de consultar también la siguiente"""
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return min(HTTP_TOTAL_TIMEOUT, max(HEDGE_MIN_DELAY, self.percentile(HEDGE_PERCENTILE)))
+
+    def expected_latency(self) -> float:
+        """
+        Latencia esperada hasta obtener una respuesta válida
+
+        Mediana dividida por la probabilidad de éxito: una fuente rápida que falla
+        seguido queda detrás de una algo más lenta pero confiable. Las fuentes
+        nunca consultadas valen 0 para que se prueben al menos una vez.
+        """
+        median = self.percentile(50)
+        if median is None:
+            # Sin respuestas todavía: si ya falló, vale como una fuente lenta
+            median = HEDGE_DEFAULT_DELAY if self.error_rate else 0.0
+        return median / max(0.05, 1 - self.error_rate)
+
+    def record_latency(self, seconds: float):
+        """Guarda una latencia (también de consultas canceladas, como cota inferior)"""
+        self.latencies.append(seconds)
+
+    def record_success(self, seconds: float):
+        """Registra una respuesta válida"""
+        self.record_latency(seconds)
+        self.error_rate *= 1 - ERROR_RATE_ALPHA
+        if self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+            logger.info(f"Fuente '{self.name}' respondió de nuevo")
+        self.failures = 0
+
+    def record_failure(self):
+        """Registra una consulta fallida y pausa la fuente tras varios fallos seguidos"""
+        self.error_rate = self.error_rate * (1 - ERROR_RATE_ALPHA) + ERROR_RATE_ALPHA
+        self.failures += 1
+        if self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+            if self.failures == CIRCUIT_FAILURE_THRESHOLD:
+                logger.warning(f"Fuente '{self.name}' en pausa tras {self.failures} fallos, {CIRCUIT_RESET_TIMEOUT}s")
+            self.retry_at = time.monotonic() + CIRCUIT_RESET_TIMEOUT
+
+    def stats(self) -> Dict:
+        """Resumen para el health check"""
+        return {
+            'source': self.name,
+            'healthy': self.healthy,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'error_rate': round(self.error_rate, 3),
+            'requests': self.requests,
+            'wins': self.wins,
+        }
+
+class UpstreamSources:
+    """Fuentes de cotizaciones ordenadas de la más conveniente a la menos"""
+
+    def __init__(self, endpoints: List[str]):
+        """
+        Args:
+            endpoints: URLs de la colección de cotizaciones, en orden de preferencia
+        """
+        self.sources = [UpstreamSource(endpoint) for endpoint in endpoints]
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def ranked(self) -> List[UpstreamSource]:
+        """
+        Fuentes en el orden en que conviene consultarlas
+
+        Primero las sanas, de menor a mayor latencia esperada; las que están en
+        pausa quedan al final como último recurso. El orden es estable, así a
+        igual latencia se respeta el orden configurado.
+        """
+        return sorted(self.sources, key=lambda source: (not source.healthy, source.expected_latency()))
+
+    def stats(self) -> List[Dict]:
+        """Resumen de cada fuente para el health check"""
+        return [source.stats() for source in self.sources]
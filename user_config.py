@@ -1,16 +1,271 @@
 import json
+import operator
 import os
-from typing import Dict, Optional
+import threading
+from array import array
+from itertools import compress
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from storage import StorageBackend
+from background_writer import BackgroundWriter
+from cache_manager import atomic_write_text
+from chunked_load import iter_chunks, iter_json_object, read_text
+from subscribers import IdTable
+from config import DEFAULT_MARKET, DIGEST_MIN_MINUTES, DIGEST_MAX_MINUTES, STORE_LOAD_CHUNK_SIZE
+
+# Bits de la columna de flags
+ENABLED = 1
+
+# Tabla para bytes.translate(): cada byte de flags pasa a 1 si está habilitado y a 0 si no
+ENABLED_MASK = bytes(1 if flags & ENABLED else 0 for flags in range(256))
+
+# Claves que se guardan en columnas (el resto va a _extra)
+PACKED_KEYS = ('interval_seconds', 'enabled', 'markets', 'digest_minutes')
 
 class UserConfig:
     """Maneja la configuración de usuarios para envío automático"""
     
-    def __init__(self, config_file: str = "user_configs.json"):
+    def __init__(self, config_file: str = "user_configs.json", storage: Optional[StorageBackend] = None,
+                 lazy: bool = False, writer: Optional[BackgroundWriter] = None):
+        """
+        Args:
+            config_file: Archivo JSON de configuraciones (si no se usa storage)
+            storage: Almacenamiento alternativo (ej. SQLite) con escrituras por fila
+            lazy: Si es True, las configuraciones se cargan recién con load() o al primer uso
+            writer: Escritor en segundo plano (si es None, los cambios se escriben en el momento)
+        """
         self.config_file = config_file
-        self.configs = self._load_configs()
+        self.storage = storage
+        self.writer = writer
+        # Una fila por usuario: intervalo (uint8), flags (uint8), combinación de mercados (uint16)
+        # y minutos del resumen (uint8, 0 = cada cambio)
+        self._table = IdTable({'interval': 'B', 'flags': 'B', 'markets': 'H', 'digest': 'B'})
+        # Combinaciones de mercados distintas; la 0 es "sin elegir" (oficial)
+        self._market_sets: List[Tuple[str, ...]] = [()]
+        self._market_set_ids: Dict[Tuple[str, ...], int] = {(): 0}
+        # Claves poco comunes que no entran en las columnas {user_id: {clave: valor}}
+        self._extra: Dict[int, Dict] = {}
+        # Cantidad de usuarios activos (en total, por intervalo y por mercado); los usuarios
+        # de cada grupo se obtienen recorriendo las columnas, sin índices por usuario
+        self._active_count = 0
+        self._active_by_interval: Dict[int, int] = {}
+        self._active_by_market: Dict[str, int] = {}
+        self._loaded = False
+        self._loading = False
+        self._load_lock = threading.Lock()
+        if not lazy:
+            self.load()
+    
+    @property
+    def configs(self) -> Dict[str, Dict]:
+        """Configuraciones de todos los usuarios (copia armada al momento; se cargan al primer uso)"""
+        self.load()
+        return {str(user_id): self._unpack(position) for position, user_id in enumerate(self._table.ids)}
+    
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+    
+    def load(self):
+        """
+        Carga las configuraciones y arma los índices de activos (una sola vez)
+        
+        Puede llamarse desde otro hilo para cargar en segundo plano; los
+        accesos concurrentes esperan a que termine la carga. Desde el event
+        loop no debe usarse mientras carga otro hilo (bloquearía al bot):
+        los handlers esperan a main.stores_ready.
+        """
+        if self._loaded:
+            return
+        if self._loading:
+            raise RuntimeError("Configuraciones cargándose por tandas: esperar a que termine load_async()")
+        with self._load_lock:
+            if self._loaded:
+                return
+            configs = self._load_configs()
+            rows = []
+            for user_id_str, config in configs.items():
+                user_id = int(user_id_str)
+                interval, flags, market_set, digest, extra = self._pack(config)
+                rows.append((user_id, interval, flags, market_set, digest))
+                if extra:
+                    self._extra[user_id] = extra
+            self._table.load(rows)
+            for position in range(len(self._table)):
+                self._index(position, True)
+            self._loaded = True
+    
+    async def load_async(self, chunk_size: int = STORE_LOAD_CHUNK_SIZE):
+        """
+        Igual que load(), pero por tandas en el event loop, cediéndolo entre una y otra
+        
+        Cargar en un hilo no alcanza: json.load() y el armado de las filas no
+        sueltan el GIL, y con muchos usuarios frenaban el loop por segundos.
+        Mientras carga, load() (y todo lo que lo usa) falla: los handlers
+        esperan a main.stores_ready.
+        
+        Args:
+            chunk_size: Usuarios por tanda
+        """
+        if self._loaded:
+            return
+        self._loading = True
+        try:
+            if self.storage is not None:
+                items = self.storage.iter_user_configs(chunk_size)
+            else:
+                text = await read_text(self.config_file)
+                items = iter_json_object(text) if text else ()
+            ordered = True
+            async for chunk in iter_chunks(items, chunk_size):
+                for user_id_str, config in chunk:
+                    user_id = int(user_id_str)
+                    interval, flags, market_set, digest, extra = self._pack(config)
+                    ordered = self._table.append(user_id, interval, flags, market_set, digest) and ordered
+                    if extra:
+                        self._extra[user_id] = extra
+                    if flags & ENABLED:
+                        self._count(extra.get('interval_seconds', interval), market_set, 1)
+            if not ordered:
+                # Archivo de una versión anterior: se ordena una sola vez (el próximo guardado queda ordenado)
+                await self._table.sort_async(chunk_size)
+        except json.JSONDecodeError as e:
+            # Igual que load(): un archivo inválido se toma como vacío
+            print(f"Error al cargar configuraciones: {e}")
+            self._clear_rows()
+        except BaseException:
+            # Sin marcar como cargado: se puede reintentar
+            self._clear_rows()
+            raise
+        finally:
+            self._loading = False
+        self._loaded = True
+    
+    def _clear_rows(self):
+        """Descarta las filas y los contadores (carga a medias)"""
+        self._table.clear()
+        self._extra.clear()
+        self._active_count = 0
+        self._active_by_interval.clear()
+        self._active_by_market.clear()
+    
+    def _market_set_id(self, markets: Optional[List[str]]) -> int:
+        """Número de la combinación de mercados (la registra si es nueva)"""
+        key = tuple(markets or ())
+        market_set = self._market_set_ids.get(key)
+        if market_set is None:
+            market_set = len(self._market_sets)
+            self._market_sets.append(key)
+            self._market_set_ids[key] = market_set
+        return market_set
+    
+    def _pack(self, config: Dict) -> Tuple[int, int, int, int, Dict]:
+        """Convierte una configuración en (intervalo, flags, mercados, resumen, claves extra)"""
+        extra = {key: value for key, value in config.items() if key not in PACKED_KEYS}
+        interval = config.get('interval_seconds', 5)
+        if not isinstance(interval, int) or not 0 <= interval <= 255:
+            # Valor fuera de rango: se conserva tal cual en _extra
+            extra['interval_seconds'] = interval
+            interval = 0
+        digest = config.get('digest_minutes', 0)
+        if not isinstance(digest, int) or not 0 <= digest <= 255:
+            extra['digest_minutes'] = digest
+            digest = 0
+        flags = ENABLED if config.get('enabled', False) else 0
+        return interval, flags, self._market_set_id(config.get('markets')), digest, extra
+    
+    def _unpack(self, position: int) -> Dict:
+        """Arma el dict de configuración de la fila indicada"""
+        return self._unpack_row(self._table.ids, self._table.columns, self._market_sets, self._extra, position)
+    
+    @staticmethod
+    def _unpack_row(ids, columns: Dict, market_sets: List[Tuple[str, ...]], extras: Dict[int, Dict],
+                    position: int) -> Dict:
+        """Arma el dict de configuración de una fila (de la tabla o de una copia para guardar)"""
+        config = {
+            'interval_seconds': columns['interval'][position],
+            'enabled': bool(columns['flags'][position] & ENABLED)
+        }
+        markets = market_sets[columns['markets'][position]]
+        if markets:
+            config['markets'] = list(markets)
+        if columns['digest'][position]:
+            config['digest_minutes'] = columns['digest'][position]
+        extra = extras.get(ids[position])
+        if extra:
+            config.update(extra)
+        return config
+    
+    def _interval_at(self, position: int) -> int:
+        """Intervalo de la fila indicada (respetando valores guardados en _extra)"""
+        extra = self._extra.get(self._table.ids[position])
+        if extra and 'interval_seconds' in extra:
+            return extra['interval_seconds']
+        return self._table.columns['interval'][position]
+    
+    def _index(self, position: int, add: bool):
+        """Suma (o resta) la fila indicada de los contadores de activos, si está habilitada"""
+        if not self._table.columns['flags'][position] & ENABLED:
+            return
+        self._count(self._interval_at(position), self._table.columns['markets'][position], 1 if add else -1)
+    
+    def _count(self, interval: int, market_set: int, delta: int):
+        """Suma (o resta) un usuario activo a los contadores de su intervalo y sus mercados"""
+        self._active_count += delta
+        keys = [(self._active_by_interval, interval)] + [
+            (self._active_by_market, market) for market in self._markets_of_set(market_set)
+        ]
+        for counts, key in keys:
+            count = counts.get(key, 0) + delta
+            if count > 0:
+                counts[key] = count
+            else:
+                counts.pop(key, None)
+    
+    def _select_active(self, selector: Optional[Iterable] = None) -> array:
+        """
+        Ids de los usuarios activos, opcionalmente filtrados por fila
+        
+        Recorre las columnas con compress/map (sin bucle en Python por fila) y
+        devuelve una copia, así se puede iterar aunque la tabla cambie.
+        
+        Args:
+            selector: Un valor verdadero/falso por fila (además de estar habilitada)
+        """
+        enabled = self._table.columns['flags'].tobytes().translate(ENABLED_MASK)
+        if selector is not None:
+            enabled = map(operator.and_, enabled, selector)
+        return array('q', compress(self._table.ids, enabled))
+    
+    def _markets_of_set(self, market_set: int) -> Tuple[str, ...]:
+        """Mercados de una combinación (oficial si no eligió)"""
+        return self._market_sets[market_set] or (DEFAULT_MARKET,)
+    
+    def _store(self, user_id: int, config: Optional[Dict]):
+        """Reemplaza (o quita, con None) la fila de un usuario manteniendo los índices"""
+        position = self._table.find(user_id)
+        if position >= 0:
+            self._index(position, False)
+        if config is None:
+            self._table.delete(user_id)
+            self._extra.pop(user_id, None)
+            return
+        interval, flags, market_set, digest, extra = self._pack(config)
+        position = self._table.upsert(user_id, interval=interval, flags=flags, markets=market_set, digest=digest)
+        if extra:
+            self._extra[user_id] = extra
+        else:
+            self._extra.pop(user_id, None)
+        self._index(position, True)
+    
+    @staticmethod
+    def _markets_of(config: Dict) -> List[str]:
+        """Mercados a los que está suscripto un usuario (oficial si no eligió)"""
+        return config.get('markets') or [DEFAULT_MARKET]
     
     def _load_configs(self) -> Dict:
         """Carga las configuraciones desde el archivo"""
+        if self.storage is not None:
+            return self.storage.load_user_configs()
         if os.path.exists(self.config_file):
             try:
                 with open(self.config_file, 'r', encoding='utf-8') as f:
@@ -21,19 +276,69 @@ class UserConfig:
     
     def _save_configs(self):
         """Guarda las configuraciones en el archivo"""
+        self._prepare_save_configs()()
+    
+    def _prepare_save_configs(self):
+        """
+        Copia las columnas (barato, en el event loop) y devuelve la escritura del archivo
+        
+        La escritura arma el JSON y lo guarda de forma atómica, así una caída a
+        mitad de camino no deja el archivo truncado (y sin suscriptores).
+        """
+        self.load()
+        ids = array('q', self._table.ids)
+        columns = {name: array(data.typecode, data) for name, data in self._table.columns.items()}
+        market_sets = list(self._market_sets)
+        # Los dicts de _extra se reemplazan (no se modifican) al guardar un usuario
+        extras = dict(self._extra)
+        
+        def write():
+            try:
+                configs = {
+                    str(user_id): self._unpack_row(ids, columns, market_sets, extras, position)
+                    for position, user_id in enumerate(ids)
+                }
+                atomic_write_text(self.config_file, json.dumps(configs, indent=2, ensure_ascii=False))
+            except Exception as e:
+                print(f"Error al guardar configuraciones: {e}")
+        
+        return write
+    
+    def _write_user(self, user_id: int, config: Optional[Dict]):
+        """Escribe (o borra) la fila de un usuario en storage"""
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.configs, f, indent=2, ensure_ascii=False)
+            if config is None:
+                self.storage.delete_user_config(user_id)
+            else:
+                self.storage.save_user_config(user_id, config)
         except Exception as e:
-            print(f"Error al guardar configuraciones: {e}")
+            print(f"Error al guardar configuración del usuario {user_id}: {e}")
+    
+    def _persist_user(self, user_id: int):
+        """Persiste el cambio de un usuario (una fila en storage o el archivo completo)"""
+        if self.storage is None:
+            if self.writer is None:
+                self._save_configs()
+            else:
+                # Varios cambios seguidos se escriben juntos
+                self.writer.coalesce(self.config_file, self._prepare_save_configs)
+            return
+        config = self.get_user_config(user_id)
+        if self.writer is None:
+            self._write_user(user_id, config)
+        else:
+            self.writer.submit(lambda: self._write_user(user_id, config))
     
-    def set_user_config(self, user_id: int, interval_seconds: int) -> bool:
+    def set_user_config(self, user_id: int, interval_seconds: int, markets: Optional[List[str]] = None,
+                        digest_minutes: Optional[int] = None) -> bool:
         """
         Configura el envío automático para un usuario
         
         Args:
             user_id: ID del usuario
             interval_seconds: Intervalo en segundos (mínimo 5, máximo 60)
+            markets: Mercados a monitorear (por defecto, los que ya tenía o el oficial)
+            digest_minutes: Minutos del resumen (0 = cada cambio; por defecto, lo que ya tenía)
         
         Returns:
             bool: True si se configuró correctamente
@@ -42,12 +347,25 @@ class UserConfig:
             return False  # Mínimo 5 segundos
         if interval_seconds > 60:  # Máximo 1 minuto
             return False
+        if digest_minutes is not None and digest_minutes != 0 \
+                and not DIGEST_MIN_MINUTES <= digest_minutes <= DIGEST_MAX_MINUTES:
+            return False
         
-        self.configs[str(user_id)] = {
+        previous = self.get_user_config(user_id)
+        if markets is None:
+            markets = self._markets_of(previous) if previous else [DEFAULT_MARKET]
+        if digest_minutes is None:
+            digest_minutes = previous.get('digest_minutes', 0) if previous else 0
+        
+        config = {
             'interval_seconds': interval_seconds,
-            'enabled': True
+            'enabled': True,
+            'markets': list(markets)
         }
-        self._save_configs()
+        if digest_minutes:
+            config['digest_minutes'] = digest_minutes
+        self._store(int(user_id), config)
+        self._persist_user(user_id)
         return True
     
     def get_user_config(self, user_id: int) -> Optional[Dict]:
@@ -58,9 +376,46 @@ class UserConfig:
             user_id: ID del usuario
         
         Returns:
-            Dict con la configuración o None si no existe
+            Dict con la configuración (copia) o None si no existe
+        """
+        self.load()
+        position = self._table.find(int(user_id))
+        return self._unpack(position) if position >= 0 else None
+    
+    def get_user_markets(self, user_id: int) -> List[str]:
+        """
+        Obtiene los mercados a los que está suscripto un usuario
+        
+        Args:
+            user_id: ID del usuario
+        
+        Returns:
+            List[str]: Mercados (vacía si el usuario no tiene configuración)
         """
-        return self.configs.get(str(user_id))
+        self.load()
+        position = self._table.find(int(user_id))
+        if position < 0:
+            return []
+        return list(self._markets_of_set(self._table.columns['markets'][position]))
+    
+    def set_user_markets(self, user_id: int, markets: List[str]) -> bool:
+        """
+        Cambia los mercados que monitorea un usuario
+        
+        Args:
+            user_id: ID del usuario
+            markets: Mercados a monitorear (al menos uno)
+        
+        Returns:
+            bool: True si se actualizó (False si no tiene configuración)
+        """
+        config = self.get_user_config(user_id)
+        if config is None or not markets:
+            return False
+        config['markets'] = list(markets)
+        self._store(int(user_id), config)
+        self._persist_user(user_id)
+        return True
     
     def disable_user_config(self, user_id: int) -> bool:
         """
@@ -72,9 +427,11 @@ class UserConfig:
         Returns:
             bool: True si se desactivó correctamente
         """
-        if str(user_id) in self.configs:
-            self.configs[str(user_id)]['enabled'] = False
-            self._save_configs()
+        config = self.get_user_config(user_id)
+        if config is not None:
+            config['enabled'] = False
+            self._store(int(user_id), config)
+            self._persist_user(user_id)
             return True
         return False
     
@@ -88,24 +445,129 @@ class UserConfig:
         Returns:
             bool: True si se eliminó correctamente
         """
-        if str(user_id) in self.configs:
-            del self.configs[str(user_id)]
-            self._save_configs()
+        self.load()
+        if int(user_id) in self._table:
+            self._store(int(user_id), None)
+            self._persist_user(user_id)
             return True
         return False
     
+    def _iter_users(self, user_ids: Iterable[int]) -> Iterator[Tuple[str, Dict]]:
+        """Arma la configuración de cada usuario de una lista de ids"""
+        for user_id in user_ids:
+            position = self._table.find(user_id)
+            if position >= 0:
+                yield str(user_id), self._unpack(position)
+    
+    def iter_active_ids(self) -> Iterator[int]:
+        """
+        Itera los ids de los usuarios activos sin armar sus configuraciones
+        
+        Returns:
+            Iterador de user_id (int)
+        """
+        self.load()
+        return iter(self._select_active())
+    
     def get_all_active_configs(self) -> Dict:
         """
         Obtiene todas las configuraciones activas
         
         Returns:
-            Dict con todas las configuraciones activas
+            Dict con todas las configuraciones activas (copia armada al momento)
+        """
+        return dict(self.iter_active_configs())
+    
+    def iter_active_configs(self) -> Iterator[Tuple[str, Dict]]:
+        """
+        Itera los usuarios activos sin copiar las configuraciones de todos a la vez
+        
+        Returns:
+            Iterador de (user_id, configuración)
         """
-        active_configs = {}
-        for user_id, config in self.configs.items():
-            if config.get('enabled', False):
-                active_configs[user_id] = config
-        return active_configs
+        self.load()
+        return self._iter_users(self._select_active())
+    
+    def iter_interval_bucket(self, interval_seconds: int) -> Iterator[Tuple[str, Dict]]:
+        """
+        Itera los usuarios activos con un intervalo determinado
+        
+        Args:
+            interval_seconds: Intervalo en segundos
+        
+        Returns:
+            Iterador de (user_id, configuración)
+        """
+        self.load()
+        user_ids = array('q')
+        if isinstance(interval_seconds, int) and 0 <= interval_seconds <= 255:
+            user_ids = self._select_active(map(interval_seconds.__eq__, self._table.columns['interval']))
+        # Los intervalos fuera de rango viven en _extra, con la columna en 0
+        overridden = {
+            user_id: extra['interval_seconds'] for user_id, extra in self._extra.items() if 'interval_seconds' in extra
+        }
+        if overridden:
+            user_ids = [user_id for user_id in user_ids if user_id not in overridden] + [
+                user_id for user_id, interval in overridden.items()
+                if interval == interval_seconds and self.is_user_enabled(user_id)
+            ]
+        return self._iter_users(user_ids)
+    
+    def iter_market_subscribers(self, market: str) -> Iterator[Tuple[str, Dict]]:
+        """
+        Itera los usuarios activos suscriptos a un mercado
+        
+        Args:
+            market: Mercado (oficial, blue, bolsa, ...)
+        
+        Returns:
+            Iterador de (user_id, configuración)
+        """
+        return self.iter_markets_subscribers([market])
+    
+    def iter_markets_subscribers(self, markets: Iterable[str]) -> Iterator[Tuple[str, Dict]]:
+        """
+        Itera una sola vez los usuarios activos suscriptos a alguno de varios mercados
+        
+        Args:
+            markets: Mercados (oficial, blue, bolsa, ...)
+        
+        Returns:
+            Iterador de (user_id, configuración)
+        """
+        self.load()
+        markets = set(markets)
+        # Combinaciones de mercados que incluyen alguno de los pedidos
+        market_sets = {
+            market_set for market_set in range(len(self._market_sets))
+            if not markets.isdisjoint(self._markets_of_set(market_set))
+        }
+        return self._iter_users(self._select_active(map(market_sets.__contains__, self._table.columns['markets'])))
+    
+    def get_active_markets(self) -> Dict[str, int]:
+        """
+        Obtiene la cantidad de usuarios activos por mercado
+        
+        Returns:
+            Dict {mercado: cantidad de usuarios}
+        """
+        self.load()
+        return dict(self._active_by_market)
+    
+    def get_active_intervals(self) -> Dict[int, int]:
+        """
+        Obtiene la cantidad de usuarios activos por intervalo
+        
+        Returns:
+            Dict {intervalo: cantidad de usuarios}
+        """
+        self.load()
+        return dict(self._active_by_interval)
+    
+    def count_active(self) -> int:
+        """Cantidad de usuarios con envío automático habilitado"""
+        self.load()
+        return self._active_count
     
     def is_user_enabled(self, user_id: int) -> bool:
         """
@@ -117,5 +579,5 @@ class UserConfig:
         Returns:
             bool: True si está habilitado
         """
-        config = self.get_user_config(user_id)
-        return config is not None and config.get('enabled', False)
+        self.load()
+        return bool(self._table.get('flags', int(user_id), 0) & ENABLED)
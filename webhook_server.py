@@ -0,0 +1,87 @@
+import hmac
+import json
+import logging
+from typing import Callable, Dict, Optional, Tuple
+from aiohttp import web
+from telegram import Update
+from metrics import REGISTRY
+
+# Configurar logger para el servidor HTTP
+logger = logging.getLogger(__name__)
+
+# Header con el que Telegram envía el secreto configurado en setWebhook
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+class WebhookServer:
+    """Servidor HTTP embebido: recibe updates de Telegram y expone el health check y las métricas"""
+
+    def __init__(self, application, port: int, webhook_path: Optional[str] = None,
+                 secret_token: str = '', status: Optional[Callable[[], Tuple[bool, Dict]]] = None,
+                 host: str = '0.0.0.0'):
+        """
+        Args:
+            application: Aplicación de python-telegram-bot que procesa los updates
+            port: Puerto donde escuchar
+            webhook_path: Ruta que recibe los updates (None para servir solo el health check)
+            secret_token: Secreto que Telegram debe enviar en cada update
+            status: Función que devuelve (listo, detalles) para el health check
+            host: Interfaz donde escuchar
+        """
+        self.application = application
+        self.port = port
+        self.host = host
+        self.webhook_path = webhook_path
+        self.secret_token = secret_token
+        self.status = status
+        self._runner: Optional[web.AppRunner] = None
+
+    def _build_app(self) -> web.Application:
+        """Arma las rutas del servidor"""
+        app = web.Application()
+        app.router.add_get('/', self.handle_health)
+        app.router.add_get('/metrics', self.handle_metrics)
+        if self.webhook_path:
+            app.router.add_post(self.webhook_path, self.handle_update)
+        return app
+
+    async def start(self):
+        """Empieza a escuchar conexiones"""
+        self._runner = web.AppRunner(self._build_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"🌐 Servidor HTTP escuchando en {self.host}:{self.port}")
+
+    async def stop(self):
+        """Deja de escuchar y cierra las conexiones abiertas"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """Recibe un update de Telegram y lo encola para los handlers"""
+        received = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(received.encode(), self.secret_token.encode()):
+            logger.warning(f"Update rechazado desde {request.remote}: secreto inválido")
+            return web.Response(status=403)
+        try:
+            data = await request.json(loads=json.loads)
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logger.error(f"Update inválido recibido por webhook: {e}")
+            return web.Response(status=400)
+        # Responder enseguida; los handlers corren en la aplicación
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """Health check y readiness: 200 si el bot está procesando updates, 503 si no"""
+        ready, details = self.status() if self.status else (self.application.running, {})
+        body = {'status': 'ok' if ready else 'starting', **details}
+        return web.json_response(body, status=200 if ready else 503)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        """Métricas en formato de texto de Prometheus"""
+        return web.Response(
+            body=REGISTRY.render().encode('utf-8'),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+        )